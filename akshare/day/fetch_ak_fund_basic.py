@@ -1,6 +1,7 @@
 import akshare as ak
 import sys
 import os
+import time
 from sqlalchemy import text
 import pandas as pd
 
@@ -9,6 +10,7 @@ root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 import stock_common
+import job_journal
 
 # 配置logger
 import logging
@@ -50,13 +52,21 @@ def ak_fetch_fund_info(fd_code):
         return None
 
 # 获取并保存公募基金基本信息数据
-def fetch_and_save_fund_basic(conn=None):
+def fetch_and_save_fund_basic(conn=None, journal=None):
+    """journal: 任务日志，每次提交后记录已保存的基金，重跑时跳过"""
     df = ak_fetch_fund_list()
     if df is None or len(df) == 0:
         return False
-    
+
+    if journal is not None:
+        todo_codes = set(journal.pending('fund', df['基金代码'].tolist()))
+        logger.info(f"共 {len(df)} 只基金，已完成 {len(df) - len(todo_codes)} 只")
+        df = df[df['基金代码'].isin(todo_codes)]
+
     total_fund = len(df)
-    for index, row in df.iterrows():
+    commit_codes = []
+    batch_start_time = time.time()
+    for index, (_, row) in enumerate(df.iterrows()):
         fd_code = row['基金代码']
         fd_name = row['基金简称'] 
 
@@ -154,18 +164,33 @@ def fetch_and_save_fund_basic(conn=None):
         """)
         
         conn.execute(insert_sql, insert_data)
+        commit_codes.append(fd_code)
         
         if index > 0 and index % 100 == 0:
             conn.commit()
+            if journal is not None:
+                journal.finish_many('fund', commit_codes, 1, round((time.time() - batch_start_time) / len(commit_codes), 3))
+            commit_codes = []
+            batch_start_time = time.time()
             logger.info(f"已处理 {index} / {total_fund} 条数据")
 
     conn.commit()
+    if journal is not None and commit_codes:
+        journal.finish_many('fund', commit_codes, 1, round((time.time() - batch_start_time) / len(commit_codes), 3))
     logger.info(f"成功获取并保存了{total_fund}条公募基金基本信息") 
+    return total_fund
     
     
 if __name__ == "__main__":
     conn = stock_common.get_db_conn()
-    fetch_and_save_fund_basic(conn)
+    # 任务日志：失败时按退避时间重试，--resume 接着上次没跑完的批次，从未保存的基金继续
+    journal = job_journal.JobJournal('ak_fund_basic')
+    journal.run('fund_basic', fetch_and_save_fund_basic, conn, journal, rollback_conn=conn)
+    journal.log_summary()
+    exit_code = journal.exit_code()
+    journal.close()
     conn.close()
     logger.info("更新公募基金基本信息完成！")
+    # 有失败时非0退出
+    sys.exit(exit_code)
 
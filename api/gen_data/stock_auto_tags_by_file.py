@@ -9,6 +9,8 @@ sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 import stock_common
 import stock_tags
+sys.path.append(root_path + '/bao/gen_data')
+import e_fund_ana
 
 # 配置logger
 import logging
@@ -81,6 +83,9 @@ def update_stock_auto_tags(cur_auto_tags, conn = None):
     
         logger.info(f"成功更新{stock_count}个股票自动标签中的{cur_tag}")
 
+    # 自动标签变了，重新生成行业按标签分组的数据
+    e_fund_ana.fund_ana_cohort_gen(conn)
+
 
 if __name__ == "__main__":
     logger.info("开始更新自动标签...")
@@ -0,0 +1,245 @@
+import sys
+import os
+import time
+import sqlite3
+from datetime import datetime
+
+# 获取当前脚本的绝对路径并向上回溯到根目录
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)  # 添加根目录到搜索路径
+
+# 配置logger
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+""" 数据获取任务的本地日志（SQLite文件），记录每个工作单元的状态、尝试次数、耗时和行数
+每次运行默认是一个新的批次(run_key为启动时间)，所有单元重新执行，失败的单元在本次运行内按退避时间重试
+命令行 --resume 接着该任务最近一个有失败或未完成单元的批次跑，--run-key 指定接着跑哪个批次，已完成的单元跳过
+有失败的单元时runner以非0退出，cron可以发现
+查看每个阶段的吞吐量: python api/job_journal.py [job] [run_key] """
+
+# 日志文件
+JOB_JOURNAL_PATH = os.getenv('JOB_JOURNAL_PATH', os.path.join(root_path, 'cache', 'job_journal.db'))
+# 失败后的重试次数，第n次重试前等待 JOB_BACKOFF * 2^(n-1) 秒
+JOB_RETRIES = 2
+JOB_BACKOFF = 30
+
+JOURNAL_DDL = """CREATE TABLE IF NOT EXISTS job_unit (
+    job TEXT NOT NULL,
+    run_key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    unit TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    row_count INTEGER,
+    seconds REAL,
+    error TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    PRIMARY KEY (job, run_key, stage, unit)
+)"""
+
+
+def new_run_key():
+    return datetime.now().strftime('%Y%m%d%H%M%S')
+
+def resolve_run_key(job, path=None):
+    """返回(run_key, 是否接着以前的批次)：--run-key 指定的批次；--resume 最近一个没跑完的批次，没有时新建；默认新建"""
+    if '--run-key' in sys.argv:
+        return sys.argv[sys.argv.index('--run-key') + 1], True
+    if '--resume' in sys.argv:
+        run_key = get_unfinished_run_key(job, path)
+        if run_key is not None:
+            return run_key, True
+        logger.info(f"{job} 没有未完成的批次，新建批次")
+    return new_run_key(), False
+
+def now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def get_row_count(result):
+    """函数返回值里的行数：整数直接用，dict取row_count或saved_count"""
+    if isinstance(result, bool):
+        return None
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict):
+        value = result.get('row_count', result.get('saved_count'))
+        return value if isinstance(value, int) else None
+    return None
+
+class JobJournal:
+    """一个任务一个批次的日志，unit为空字符串时表示整个阶段"""
+    def __init__(self, job, run_key=None, path=None):
+        """run_key为空时按命令行参数决定新建批次还是接着以前的批次，self.resumed表示是否接着以前的批次"""
+        self.job = job
+        self.path = path or JOB_JOURNAL_PATH
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if run_key is None:
+            self.run_key, self.resumed = resolve_run_key(job, self.path)
+        else:
+            self.run_key, self.resumed = run_key, True
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(JOURNAL_DDL)
+        self.conn.commit()
+        logger.info(f"任务日志 {self.path}: {self.job} {self.run_key}{'（接着以前的批次）' if self.resumed else ''}")
+
+    def close(self):
+        self.conn.close()
+
+    def get_status(self, stage, unit=''):
+        row = self.conn.execute("SELECT status FROM job_unit WHERE job = ? AND run_key = ? AND stage = ? AND unit = ?",
+                                (self.job, self.run_key, stage, str(unit))).fetchone()
+        return row['status'] if row else None
+
+    def is_done(self, stage, unit=''):
+        return self.get_status(stage, unit) == 'done'
+
+    def pending(self, stage, units):
+        """units中还没有完成的，保持原来的顺序"""
+        done_units = set(row['unit'] for row in self.conn.execute(
+            "SELECT unit FROM job_unit WHERE job = ? AND run_key = ? AND stage = ? AND status = 'done'", (self.job, self.run_key, stage)))
+        return [unit for unit in units if str(unit) not in done_units]
+
+    def start(self, stage, unit=''):
+        """记为running，尝试次数加1"""
+        self.conn.execute("""INSERT INTO job_unit (job, run_key, stage, unit, status, attempts, started_at) VALUES (?, ?, ?, ?, 'running', 1, ?)
+            ON CONFLICT (job, run_key, stage, unit) DO UPDATE SET status = 'running', attempts = attempts + 1, error = NULL,
+            started_at = excluded.started_at, finished_at = NULL""",
+                          (self.job, self.run_key, stage, str(unit), now_str()))
+        self.conn.commit()
+
+    def finish(self, stage, unit='', row_count=None, seconds=None):
+        self.finish_many(stage, [unit], row_count, seconds)
+
+    def finish_many(self, stage, units, row_count=None, seconds=None):
+        """一批单元记为done，row_count、seconds为每个单元的值，没有start过的尝试次数记1"""
+        rows = [(self.job, self.run_key, stage, str(unit), row_count, seconds, now_str()) for unit in units]
+        self.conn.executemany("""INSERT INTO job_unit (job, run_key, stage, unit, status, attempts, row_count, seconds, finished_at)
+            VALUES (?, ?, ?, ?, 'done', 1, ?, ?, ?)
+            ON CONFLICT (job, run_key, stage, unit) DO UPDATE SET status = 'done', row_count = excluded.row_count,
+            seconds = excluded.seconds, error = NULL, finished_at = excluded.finished_at""", rows)
+        self.conn.commit()
+
+    def fail(self, stage, unit='', error=None, seconds=None):
+        self.conn.execute("""UPDATE job_unit SET status = 'failed', error = ?, seconds = ?, finished_at = ?
+            WHERE job = ? AND run_key = ? AND stage = ? AND unit = ?""",
+                          (error, seconds, now_str(), self.job, self.run_key, stage, str(unit)))
+        self.conn.commit()
+
+    def record_failure(self, stage, error, unit=''):
+        """runner在journal.run之外出错时记一条失败，退出码和下次 --resume 都能看到"""
+        self.start(stage, unit)
+        self.fail(stage, unit, error)
+
+    def run(self, stage, func, *args, unit='', retries=None, backoff=None, rollback_conn=None, **kwargs):
+        """执行一个单元：接着以前的批次时已完成的跳过，失败后按退避时间重试，重试完仍失败记failed，不中断后面的阶段
+        跳过和失败都返回None，是否有失败用 get_failed_units() / exit_code() 判断
+        rollback_conn: 失败后回滚的数据库连接"""
+        if self.is_done(stage, unit):
+            logger.info(f"{self.job} {self.run_key} {stage} {unit} 已完成，跳过")
+            return None
+
+        retries = JOB_RETRIES if retries is None else retries
+        backoff = JOB_BACKOFF if backoff is None else backoff
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                wait_time = backoff * 2 ** (attempt - 1)
+                logger.info(f"{stage} {unit} 第{attempt}次重试，等待{wait_time}秒")
+                time.sleep(wait_time)
+            self.start(stage, unit)
+            start_time = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                seconds = round(time.time() - start_time, 3)
+                logger.error(f"{stage} {unit} 执行失败: {str(e)}")
+                if rollback_conn is not None:
+                    rollback_conn.rollback()
+                self.fail(stage, unit, str(e), seconds)
+                continue
+            self.finish(stage, unit, get_row_count(result), round(time.time() - start_time, 3))
+            return result
+        return None
+
+    def summary(self):
+        """每个阶段的单元数、完成数、失败数、尝试次数、行数、耗时和吞吐量"""
+        rows = self.conn.execute("""SELECT stage, COUNT(*) AS unit_count, SUM(status = 'done') AS done_count,
+            SUM(status = 'failed') AS failed_count, SUM(attempts) AS attempts, SUM(row_count) AS row_count, SUM(seconds) AS seconds,
+            MIN(started_at) AS started_at, MAX(finished_at) AS finished_at
+            FROM job_unit WHERE job = ? AND run_key = ? GROUP BY stage ORDER BY MIN(started_at), stage""", (self.job, self.run_key)).fetchall()
+        result = []
+        for row in rows:
+            item = dict(row)
+            seconds = item['seconds'] or 0
+            item['units_per_second'] = round(item['done_count'] / seconds, 3) if seconds else None
+            item['rows_per_second'] = round(item['row_count'] / seconds, 3) if seconds and item['row_count'] else None
+            result.append(item)
+        return result
+
+    def log_summary(self):
+        summary = self.summary()
+        for item in summary:
+            logger.info(f"{self.job} {self.run_key} {item['stage']}: 完成 {item['done_count']}/{item['unit_count']}，失败 {item['failed_count']}，"
+                        f"尝试 {item['attempts']} 次，{item['row_count'] or 0} 行，{item['seconds'] or 0:.1f} 秒，"
+                        f"{item['units_per_second']} 单元/秒，{item['rows_per_second']} 行/秒")
+        return summary
+
+    def get_failed_units(self):
+        rows = self.conn.execute("SELECT stage, unit, attempts, error FROM job_unit WHERE job = ? AND run_key = ? AND status = 'failed'",
+                                 (self.job, self.run_key)).fetchall()
+        return [dict(row) for row in rows]
+
+    def exit_code(self):
+        """有失败的单元返回1，runner用来设置进程退出码"""
+        failed_units = self.get_failed_units()
+        for item in failed_units:
+            logger.error(f"{self.job} {self.run_key} 失败: {item['stage']} {item['unit']} 尝试 {item['attempts']} 次: {item['error']}")
+        return 1 if failed_units else 0
+
+
+def get_unfinished_run_key(job, path=None):
+    """最近一个有失败或未完成单元的批次"""
+    conn = sqlite3.connect(path or JOB_JOURNAL_PATH)
+    try:
+        conn.execute(JOURNAL_DDL)
+        row = conn.execute("""SELECT run_key FROM job_unit WHERE job = ? GROUP BY run_key HAVING SUM(status <> 'done') > 0
+            ORDER BY MAX(COALESCE(started_at, finished_at)) DESC LIMIT 1""", (job,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def get_latest_run_key(job, path=None):
+    conn = sqlite3.connect(path or JOB_JOURNAL_PATH)
+    try:
+        row = conn.execute("SELECT run_key FROM job_unit WHERE job = ? ORDER BY COALESCE(started_at, finished_at) DESC LIMIT 1", (job,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def get_jobs(path=None):
+    conn = sqlite3.connect(path or JOB_JOURNAL_PATH)
+    try:
+        return [row[0] for row in conn.execute("SELECT DISTINCT job FROM job_unit ORDER BY job")]
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # python api/job_journal.py [job] [run_key]，不指定时输出每个任务最近一个批次
+    if not os.path.exists(JOB_JOURNAL_PATH):
+        logger.info(f"任务日志 {JOB_JOURNAL_PATH} 不存在")
+        sys.exit(0)
+    jobs = [sys.argv[1]] if len(sys.argv) > 1 else get_jobs()
+    for job in jobs:
+        run_key = sys.argv[2] if len(sys.argv) > 2 else get_latest_run_key(job)
+        if run_key is None:
+            continue
+        journal = JobJournal(job, run_key)
+        journal.log_summary()
+        for item in journal.get_failed_units():
+            logger.info(f"失败: {item['stage']} {item['unit']} 尝试 {item['attempts']} 次: {item['error']}")
+        journal.close()
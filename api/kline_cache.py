@@ -0,0 +1,299 @@
+import sys
+import os
+import json
+import shutil
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+from sqlalchemy import text
+
+# 获取当前脚本的绝对路径并向上回溯到根目录
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)  # 添加根目录到搜索路径
+sys.path.append(root_path + '/api')
+import stock_common
+
+# 配置logger
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+""" 日K分表的本地列式缓存（Feather，即Arrow IPC文件）
+日K表按年份分目录，每个年份一个文件：{KLINE_CACHE_DIR}/{表名}/{年份}/{开始日期}_{结束日期}.feather
+增量导出从缓存中最大日期（包含）开始导出，最大日期所在年份的文件合并重写，写完新文件再删除旧文件，中途中断时读取只用最新的文件；历史行有修改（重算分位值、股息率、补数据）后用 --full 全量重建
+回测用到的小表（交易日历、股票基本信息、分红）每次全量导出成一个文件：{KLINE_CACHE_DIR}/{表名}.feather
+文件不压缩，读取时内存映射，只读需要的列和日期范围，没有MySQL也能回测 """
+
+# 缓存目录
+KLINE_CACHE_DIR = os.getenv('KLINE_CACHE_DIR', os.path.join(root_path, 'cache', 'kline'))
+# 按日期分区增量导出的日K表
+KLINE_TABLES = [f'bao_stock_trade_{i}' for i in range(10)] + ['bao_nostock_trade']
+# 每次全量导出的小表
+SNAPSHOT_TABLES = ['bao_trade_date', 'bao_stock_basic', 'bao_stock_dividend']
+# 不导出的字段
+SKIP_COLUMNS = ['created_at', 'updated_at']
+# 导出时每次从数据库读取的行数
+EXPORT_CHUNK_SIZE = 100000
+FILE_SUFFIX = '.feather'
+
+# MySQL字段类型对应的Arrow类型，没有列出的按字符串
+ARROW_TYPES = {
+    'tinyint': pa.int64(), 'smallint': pa.int64(), 'mediumint': pa.int64(), 'int': pa.int64(), 'bigint': pa.int64(),
+    'float': pa.float64(), 'double': pa.float64(), 'decimal': pa.float64(),
+    'date': pa.date32(), 'datetime': pa.timestamp('s'), 'timestamp': pa.timestamp('s'),
+}
+
+
+def to_date_str(value):
+    """日期统一成'YYYY-MM-DD'字符串，None不变"""
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime('%Y-%m-%d')
+
+def get_table_schema(conn, table_name):
+    """按information_schema的字段类型生成Arrow schema，字段顺序和表一致"""
+    sql = """SELECT COLUMN_NAME as column_name, DATA_TYPE as data_type FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name ORDER BY ORDINAL_POSITION"""
+    fields = []
+    for item in conn.execute(text(sql), {'table_name': table_name}).fetchall():
+        column_name = item.column_name.decode() if isinstance(item.column_name, (bytes, bytearray)) else item.column_name
+        data_type = item.data_type.decode() if isinstance(item.data_type, (bytes, bytearray)) else item.data_type
+        if column_name in SKIP_COLUMNS:
+            continue
+        fields.append(pa.field(column_name, ARROW_TYPES.get(data_type.lower(), pa.string())))
+    if not fields:
+        raise ValueError(f"表 {table_name} 不存在")
+    return pa.schema(fields)
+
+def to_text(value):
+    """字符串字段的值，json字段可能返回dict/list"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if value is None or pd.isna(value):
+        return None
+    return value if isinstance(value, str) else str(value)
+
+def frame_to_table(df, schema):
+    """查询结果DataFrame转Arrow表，Decimal转float，空值转null"""
+    arrays = []
+    for field in schema:
+        values = df[field.name]
+        if pa.types.is_floating(field.type):
+            arrays.append(pa.array(pd.to_numeric(values, errors='coerce').astype('float64'), type=field.type, from_pandas=True))
+        elif pa.types.is_integer(field.type):
+            arrays.append(pa.array(pd.to_numeric(values, errors='coerce').astype('Int64'), type=field.type, from_pandas=True))
+        elif pa.types.is_string(field.type):
+            arrays.append(pa.array([to_text(value) for value in values], type=field.type))
+        else:
+            arrays.append(pa.array(values.astype(object).where(values.notna(), None), type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def write_table_file(table, path):
+    """先写临时文件再改名，读的时候不会看到写了一半的文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+def list_year_files(year_dir):
+    """年份目录中的缓存文件名，最新写入的在最后"""
+    file_names = [file_name for file_name in os.listdir(year_dir) if file_name.endswith(FILE_SUFFIX)]
+    return sorted(file_names, key=lambda file_name: (os.stat(os.path.join(year_dir, file_name)).st_mtime_ns, file_name))
+
+def list_parts(table_name, start_date=None, end_date=None, cache_dir=None):
+    """日K表的缓存文件[(开始日期, 结束日期, 路径)]，按日期排序，只返回和日期范围有交集的文件
+    每年一个文件，增量导出重写这一年后才删除原来的文件，中途中断时同一年有多个文件，只用最新写入的一个"""
+    table_dir = os.path.join(cache_dir or KLINE_CACHE_DIR, table_name)
+    start_date, end_date = to_date_str(start_date), to_date_str(end_date)
+    parts = []
+    if not os.path.isdir(table_dir):
+        return parts
+    for year in os.listdir(table_dir):
+        year_dir = os.path.join(table_dir, year)
+        if not year.isdigit() or not os.path.isdir(year_dir):
+            continue
+        file_names = list_year_files(year_dir)
+        if not file_names:
+            continue
+        file_name = file_names[-1]
+        first, last = file_name[:-len(FILE_SUFFIX)].split('_')
+        if (start_date and last < start_date) or (end_date and first > end_date):
+            continue
+        parts.append((first, last, os.path.join(year_dir, file_name)))
+    parts.sort()
+    return parts
+
+def get_cache_max_date(table_name, cache_dir=None):
+    """缓存中的最大日期，没有缓存返回None"""
+    parts = list_parts(table_name, cache_dir=cache_dir)
+    return max(part[1] for part in parts) if parts else None
+
+def has_cache(table_names=None):
+    """这些表是否都已经导出过，默认检查全部表"""
+    table_names = table_names or KLINE_TABLES + SNAPSHOT_TABLES
+    for table_name in table_names:
+        if table_name in SNAPSHOT_TABLES:
+            if not os.path.exists(os.path.join(KLINE_CACHE_DIR, table_name + FILE_SUFFIX)):
+                return False
+        elif not list_parts(table_name):
+            return False
+    return True
+
+def export_kline_table(table_name, full=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """日K表导出到缓存，按日期顺序流式读取，按年份写文件，返回导出行数
+    full=True 时全量重建；否则从缓存最大日期（包含）开始导出，最大日期当天导出后又写入的行也能补上，
+    缓存最大日期所在的年份和新行合并重写成一个文件，每年只保留一个文件"""
+    conn = stock_common.get_db_conn(sql_echo=False)
+    try:
+        schema = get_table_schema(conn, table_name)
+    finally:
+        conn.close()
+
+    table_dir = os.path.join(KLINE_CACHE_DIR, table_name)
+    # 全量重建先写到临时目录，写完再替换，中途失败不影响原来的缓存
+    cache_dir = KLINE_CACHE_DIR + '.tmp' if full else KLINE_CACHE_DIR
+    if full:
+        shutil.rmtree(os.path.join(cache_dir, table_name), ignore_errors=True)
+    max_date = None if full else get_cache_max_date(table_name)
+    where_sql = "AND date >= :max_date" if max_date else ""
+    sql = f"""SELECT {', '.join(schema.names)} FROM {table_name}
+        WHERE date IS NOT NULL {where_sql} ORDER BY date ASC, id ASC"""
+
+    row_count = 0
+    year_tables = []
+    cur_year = None
+    written_paths = set()
+    open_parts = []
+    if max_date:
+        # 最大日期所在的年份：原来的文件读进内存，去掉最大日期当天的行（重新导出），和新行一起重写
+        cur_year = int(max_date[:4])
+        open_parts = [part for part in list_parts(table_name) if int(part[0][:4]) == cur_year]
+        for part in open_parts:
+            table = feather.read_table(part[2], memory_map=False).select(schema.names)
+            year_tables.append(filter_table(table, end_date=(datetime.strptime(max_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')))
+
+    def flush():
+        if not year_tables or sum(table.num_rows for table in year_tables) == 0:
+            year_tables.clear()
+            return
+        table = pa.concat_tables(year_tables)
+        min_max = pc.min_max(table['date']).as_py()
+        path = os.path.join(cache_dir, table_name, str(cur_year),
+                            f"{to_date_str(min_max['min'])}_{to_date_str(min_max['max'])}{FILE_SUFFIX}")
+        write_table_file(table, path)
+        written_paths.add(path)
+        year_tables.clear()
+
+    params = {'max_date': max_date} if max_date else {}
+    for df in stock_common.stream_query_frames(sql, params, chunk_size=chunk_size):
+        years = pd.to_datetime(df['date']).dt.year.to_numpy()
+        # 按日期排序，同一年的行是连续的
+        for year in pd.unique(years):
+            if year != cur_year:
+                flush()
+                cur_year = year
+            year_tables.append(frame_to_table(df[years == year], schema))
+        row_count += len(df)
+    flush()
+    # 重写后删除这一年原来的文件，包括上次中断时留下的文件
+    if open_parts:
+        year_dir = os.path.dirname(open_parts[0][2])
+        for file_name in list_year_files(year_dir):
+            path = os.path.join(year_dir, file_name)
+            if path not in written_paths:
+                os.remove(path)
+
+    if full:
+        shutil.rmtree(table_dir, ignore_errors=True)
+        os.makedirs(KLINE_CACHE_DIR, exist_ok=True)
+        if os.path.isdir(os.path.join(cache_dir, table_name)):
+            os.replace(os.path.join(cache_dir, table_name), table_dir)
+        if os.path.isdir(cache_dir) and not os.listdir(cache_dir):
+            os.rmdir(cache_dir)
+    logger.info(f"{table_name} 导出 {row_count} 行，缓存最大日期 {get_cache_max_date(table_name)}")
+    return row_count
+
+def export_snapshot_table(table_name, chunk_size=EXPORT_CHUNK_SIZE):
+    """小表全量导出成一个文件，返回导出行数"""
+    conn = stock_common.get_db_conn(sql_echo=False)
+    try:
+        schema = get_table_schema(conn, table_name)
+    finally:
+        conn.close()
+
+    sql = f"SELECT {', '.join(schema.names)} FROM {table_name} ORDER BY id ASC"
+    tables = [frame_to_table(df, schema) for df in stock_common.stream_query_frames(sql, chunk_size=chunk_size)]
+    table = pa.concat_tables(tables) if tables else schema.empty_table()
+    write_table_file(table, os.path.join(KLINE_CACHE_DIR, table_name + FILE_SUFFIX))
+    logger.info(f"{table_name} 导出 {table.num_rows} 行")
+    return table.num_rows
+
+def export_all(full=False):
+    """导出全部日K表和小表，返回{表名: 行数}"""
+    start_time = time.time()
+    counts = {}
+    for table_name in KLINE_TABLES:
+        counts[table_name] = export_kline_table(table_name, full=full)
+    for table_name in SNAPSHOT_TABLES:
+        counts[table_name] = export_snapshot_table(table_name)
+    logger.info(f"缓存导出完成，耗时 {time.time() - start_time:.1f} 秒，目录 {KLINE_CACHE_DIR}")
+    return counts
+
+def filter_table(table, start_date=None, end_date=None, codes=None, date_column='date'):
+    """按日期范围（包含两端）和股票代码过滤"""
+    mask = None
+    if start_date:
+        mask = pc.greater_equal(table[date_column], pa.scalar(datetime.strptime(to_date_str(start_date), '%Y-%m-%d').date(), pa.date32()))
+    if end_date:
+        end_mask = pc.less_equal(table[date_column], pa.scalar(datetime.strptime(to_date_str(end_date), '%Y-%m-%d').date(), pa.date32()))
+        mask = end_mask if mask is None else pc.and_(mask, end_mask)
+    if codes is not None:
+        code_mask = pc.is_in(table['code'], value_set=pa.array(list(codes), pa.string()))
+        mask = code_mask if mask is None else pc.and_(mask, code_mask)
+    return table if mask is None else table.filter(mask)
+
+def read_kline(table_name, start_date=None, end_date=None, columns=None, codes=None):
+    """读取日K表缓存，返回pyarrow.Table；内存映射，只读columns列和日期范围内的文件"""
+    parts = list_parts(table_name)
+    if not parts:
+        raise FileNotFoundError(f"没有 {table_name} 的缓存，先运行 python api/kline_cache.py 导出")
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns) + [column for column in ['date', 'code'] if column not in columns]
+
+    tables = []
+    for _, _, path in list_parts(table_name, start_date, end_date):
+        table = feather.read_table(path, columns=read_columns, memory_map=True)
+        tables.append(filter_table(table, start_date, end_date, codes))
+    if not tables:
+        # 日期范围内没有数据，返回空表
+        tables.append(feather.read_table(parts[0][2], columns=read_columns, memory_map=True).slice(0, 0))
+    table = pa.concat_tables(tables)
+    return table.select(list(columns)) if columns is not None else table
+
+def read_snapshot(table_name, columns=None):
+    """读取小表缓存，返回pyarrow.Table"""
+    path = os.path.join(KLINE_CACHE_DIR, table_name + FILE_SUFFIX)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"没有 {table_name} 的缓存，先运行 python api/kline_cache.py 导出")
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='日K分表导出到本地列式缓存')
+    parser.add_argument('--full', action='store_true', help='全量重建，历史数据有修改后使用')
+    parser.add_argument('--tables', nargs='*', default=None, help='只导出这些表，默认全部')
+    args = parser.parse_args()
+
+    if args.tables:
+        for table_name in args.tables:
+            if table_name in SNAPSHOT_TABLES:
+                export_snapshot_table(table_name)
+            else:
+                export_kline_table(table_name, full=args.full)
+    else:
+        export_all(full=args.full)
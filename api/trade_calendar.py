@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import bisect
+from datetime import date, datetime
+from sqlalchemy import text
+
+# 获取当前脚本的绝对路径并向上回溯到根目录
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path)  # 添加根目录到搜索路径
+
+# 配置logger
+import logging
+logger = logging.getLogger(__name__)
+
+""" 交易日历，从bao_trade_date表加载一次，常驻内存。
+日期统一用'YYYY-MM-DD'字符串保存，查询时date/datetime/字符串都可以传入。
+本地有一份json缓存，fetch_baostock_trade_date.py写入新交易日后刷新。
+缓存先写临时文件再替换，读的进程不会读到一半的文件；缓存文件修改时间变了，内存中的日历重新加载。"""
+
+# 本地缓存文件
+CACHE_FILE = os.getenv('TRADE_CALENDAR_CACHE', os.path.join(root_path, 'cache', 'trade_calendar.json'))
+
+def to_date_str(cur_date):
+    if isinstance(cur_date, (date, datetime)):
+        return cur_date.strftime('%Y-%m-%d')
+    return str(cur_date)[:10]
+
+class TradeCalendar:
+    def __init__(self, trade_dates, updated_at=None):
+        # 交易日列表，升序
+        self.trade_dates = sorted(to_date_str(d) for d in trade_dates)
+        # 交易日 -> 序号
+        self.date_ordinal = {d: i for i, d in enumerate(self.trade_dates)}
+        # 交易日 -> 更新时间，页面展示用
+        self.updated_at = updated_at if updated_at else {}
+
+    def __len__(self):
+        return len(self.trade_dates)
+
+    def is_trading_day(self, cur_date):
+        return to_date_str(cur_date) in self.date_ordinal
+
+    def ordinal(self, cur_date):
+        """交易日的序号，非交易日返回None"""
+        return self.date_ordinal.get(to_date_str(cur_date))
+
+    def count_between(self, start_date, end_date):
+        """交易日天数，包含开始日期，不包含结束日期"""
+        start_index = bisect.bisect_left(self.trade_dates, to_date_str(start_date))
+        end_index = bisect.bisect_left(self.trade_dates, to_date_str(end_date))
+        return max(end_index - start_index, 0)
+
+    def between(self, start_date, end_date):
+        """交易日列表，包含开始日期和结束日期"""
+        start_index = bisect.bisect_left(self.trade_dates, to_date_str(start_date))
+        end_index = bisect.bisect_right(self.trade_dates, to_date_str(end_date))
+        return self.trade_dates[start_index:end_index]
+
+    def offset(self, cur_date, days):
+        """往后(days>0)或往前(days<0)第days个交易日，非交易日从前一个交易日算起，超出范围取首尾交易日"""
+        if not self.trade_dates:
+            return None
+        cur_index = bisect.bisect_right(self.trade_dates, to_date_str(cur_date)) - 1
+        new_index = min(max(cur_index + days, 0), len(self.trade_dates) - 1)
+        return self.trade_dates[new_index]
+
+    def prev_trading_day(self, cur_date):
+        """前一个交易日，不包含当天"""
+        cur_index = bisect.bisect_left(self.trade_dates, to_date_str(cur_date))
+        return self.trade_dates[cur_index - 1] if cur_index > 0 else None
+
+    def next_trading_day(self, cur_date):
+        """后一个交易日，不包含当天"""
+        cur_index = bisect.bisect_right(self.trade_dates, to_date_str(cur_date))
+        return self.trade_dates[cur_index] if cur_index < len(self.trade_dates) else None
+
+    def yearly_counts(self):
+        """按年份聚合的交易日数量，[(year, count)]"""
+        counts = {}
+        for d in self.trade_dates:
+            counts[d[:4]] = counts.get(d[:4], 0) + 1
+        return sorted(counts.items())
+
+    def by_year(self, year):
+        """某一年的全部交易日"""
+        return self.between(f"{year}-01-01", f"{year}-12-31")
+
+# 从数据库加载
+def load_trade_calendar_from_db(conn):
+    sql = "SELECT calendar_date, updated_at FROM bao_trade_date WHERE is_trading_day = 1 ORDER BY calendar_date ASC"
+    results = conn.execute(text(sql)).fetchall()
+    updated_at = {to_date_str(item.calendar_date): item.updated_at.strftime('%Y-%m-%d %H:%M:%S') for item in results if item.updated_at}
+    return TradeCalendar([item.calendar_date for item in results], updated_at)
+
+# 从本地缓存加载，没有缓存返回None
+def load_trade_calendar_from_cache(cache_file=CACHE_FILE):
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return TradeCalendar(data['trade_dates'], data.get('updated_at'))
+    except Exception as e:
+        logger.error(f"读取交易日历缓存失败: {str(e)}")
+        return None
+
+# 写到同目录的临时文件再替换，替换是原子的
+def save_trade_calendar_cache(calendar, cache_file=CACHE_FILE):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'trade_dates': calendar.trade_dates, 'updated_at': calendar.updated_at}, f)
+        os.replace(tmp_file, cache_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+# 缓存文件的修改时间，没有缓存返回None
+def get_cache_mtime(cache_file=CACHE_FILE):
+    try:
+        return os.stat(cache_file).st_mtime_ns
+    except OSError:
+        return None
+
+# 进程内的交易日历，和加载时缓存文件的修改时间
+cur_calendar = None
+cur_calendar_mtime = None
+
+def get_trade_calendar(conn=None, refresh=False):
+    """获取交易日历：内存 -> 本地缓存 -> 数据库，refresh=True时从数据库重新加载并写缓存
+    缓存文件被其他进程更新后（修改时间变了）重新从缓存加载"""
+    global cur_calendar, cur_calendar_mtime
+    if not refresh:
+        cache_mtime = get_cache_mtime()
+        if cur_calendar is not None and (cache_mtime is None or cache_mtime == cur_calendar_mtime):
+            return cur_calendar
+        calendar = load_trade_calendar_from_cache() if cache_mtime is not None else None
+        if calendar is not None and len(calendar) > 0:
+            cur_calendar, cur_calendar_mtime = calendar, cache_mtime
+            return cur_calendar
+
+    own_conn = False
+    if conn is None:
+        import stock_common
+        conn = stock_common.get_db_conn(sql_echo=False)
+        own_conn = True
+
+    cur_calendar = load_trade_calendar_from_db(conn)
+    save_trade_calendar_cache(cur_calendar)
+    cur_calendar_mtime = get_cache_mtime()
+    logger.info(f"交易日历已从数据库加载，共{len(cur_calendar)}个交易日")
+
+    if own_conn:
+        conn.close()
+    return cur_calendar
+
+# 交易日写入后刷新
+def refresh_trade_calendar(conn=None):
+    return get_trade_calendar(conn, refresh=True)
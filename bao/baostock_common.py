@@ -1,6 +1,10 @@
 
 import os
+import time
+import multiprocessing
 import baostock as bs
+import pandas as pd
+from sqlalchemy import text
 
 import sys
 # 获取当前脚本的绝对路径并向上回溯到根目录
@@ -25,3 +29,89 @@ def login_baostock():
 def logout_baostock():
     bs.logout()
     logger.info("登出成功")
+
+# K线字段，浮点列和整数列分开转换
+KLINE_FLOAT_COLUMNS = ['open', 'high', 'low', 'close', 'preclose', 'volume', 'amount', 'turn', 'pctChg', 'peTTM', 'pbMRQ', 'psTTM', 'pcfNcfTTM']
+KLINE_INT_COLUMNS = ['adjustflag', 'tradestatus', 'isST']
+KLINE_COLUMNS = ['code', 'date'] + KLINE_FLOAT_COLUMNS + KLINE_INT_COLUMNS
+# 每条INSERT语句的行数
+KLINE_CHUNK_SIZE = 500
+
+def kline_df_to_rows(df):
+    """baostock返回的K线DataFrame按列转换，空字符串转None"""
+    data = {'code': df['code'].tolist(), 'date': df['date'].tolist()}
+    for column in KLINE_FLOAT_COLUMNS + KLINE_INT_COLUMNS:
+        if column not in df.columns:
+            data[column] = [None] * len(df)
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        if column in KLINE_INT_COLUMNS:
+            data[column] = [None if pd.isna(v) else int(v) for v in values]
+        else:
+            data[column] = [None if pd.isna(v) else float(v) for v in values]
+    return [dict(zip(KLINE_COLUMNS, item)) for item in zip(*[data[column] for column in KLINE_COLUMNS])]
+
+def save_kline_rows(rows, table_name, conn, chunk_size=KLINE_CHUNK_SIZE):
+    """多行VALUES写入，每chunk_size行一条INSERT ... ON DUPLICATE KEY UPDATE"""
+    for chunk_begin in range(0, len(rows), chunk_size):
+        chunk = rows[chunk_begin:chunk_begin + chunk_size]
+        values_sql = []
+        params = {}
+        for index, row in enumerate(chunk):
+            values_sql.append("(" + ", ".join([f":{column}_{index}" for column in KLINE_COLUMNS]) + ")")
+            for column in KLINE_COLUMNS:
+                params[f"{column}_{index}"] = row[column]
+
+        insert_sql = text(f"""
+        INSERT INTO {table_name} (
+            {', '.join(KLINE_COLUMNS)}
+        ) VALUES {', '.join(values_sql)}
+        on duplicate key update
+        isST = values(isST)
+        """)
+        conn.execute(insert_sql, params)
+
+# 批量保存K线数据，table_name为空时按code最后一位分表写入bao_stock_trade_x
+def save_kline_data_batch(df, conn, table_name=None, chunk_size=KLINE_CHUNK_SIZE):
+    if df is None or df.empty:
+        return 0
+
+    start_time = time.time()
+    rows = kline_df_to_rows(df)
+
+    # 按目标表分组
+    table_rows = {}
+    for row in rows:
+        cur_table_name = table_name if table_name else f"bao_stock_trade_{row['code'][-1]}"
+        table_rows.setdefault(cur_table_name, []).append(row)
+
+    for cur_table_name, cur_rows in table_rows.items():
+        save_kline_rows(cur_rows, cur_table_name, conn, chunk_size)
+    conn.commit()
+
+    cost_time = time.time() - start_time
+    logger.info(f"保存K线数据 {len(rows)} 条，耗时 {cost_time:.3f} 秒，{len(rows) / max(cost_time, 1e-6):.0f} 条/秒")
+    return len(rows)
+
+class RateLimiter:
+    """令牌桶限流，令牌数和时间放在共享内存里，多个进程共用一个限流器
+    rate: 每秒发放的令牌数，capacity: 桶容量（允许的突发请求数）"""
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(self.rate, 1.0)
+        self._tokens = multiprocessing.Value('d', self.capacity, lock=False)
+        self._last_time = multiprocessing.Value('d', time.monotonic(), lock=False)
+        self._lock = multiprocessing.Lock()
+
+    def acquire(self, tokens=1):
+        """取令牌，不够时等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens.value = min(self.capacity, self._tokens.value + (now - self._last_time.value) * self.rate)
+                self._last_time.value = now
+                if self._tokens.value >= tokens:
+                    self._tokens.value -= tokens
+                    return
+                wait_time = (tokens - self._tokens.value) / self.rate
+            time.sleep(wait_time)
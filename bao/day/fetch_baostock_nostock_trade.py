@@ -60,50 +60,7 @@ def fetch_single_nostock_kline(stock_code, stock_name, start_date, end_date, adj
 # 保存K线数据到bao_nostock_trade表
 def save_kline_data(df, conn):
     """保存K线数据到bao_nostock_trade表"""
-    if df is None or df.empty:
-        return 0
-
-    saved_count = 0
-
-    for _, row in df.iterrows():
-        # 准备插入数据
-        insert_data = {
-            'code': row.get('code'),
-            'date': row.get('date'),
-            'open': float(row.get('open')) if row.get('open') else None,
-            'high': float(row.get('high')) if row.get('high') else None,
-            'low': float(row.get('low')) if row.get('low') else None,
-            'close': float(row.get('close')) if row.get('close') else None,
-            'preclose': float(row.get('preclose')) if row.get('preclose') else None,
-            'volume': float(row.get('volume')) if row.get('volume') else None,
-            'amount': float(row.get('amount')) if row.get('amount') else None,
-            'adjustflag': int(row.get('adjustflag')) if row.get('adjustflag') else None,
-            'turn': float(row.get('turn')) if row.get('turn') else None,
-            'tradestatus': int(row.get('tradestatus')) if row.get('tradestatus') else None,
-            'pctChg': float(row.get('pctChg')) if row.get('pctChg') else None,
-            'peTTM': float(row.get('peTTM')) if row.get('peTTM') else None,
-            'pbMRQ': float(row.get('pbMRQ')) if row.get('pbMRQ') else None,
-            'psTTM': float(row.get('psTTM')) if row.get('psTTM') else None,
-            'pcfNcfTTM': float(row.get('pcfNcfTTM')) if row.get('pcfNcfTTM') else None,
-            'isST': int(row.get('isST')) if row.get('isST') else None
-        }
-        
-        # 使用INSERT ... ON DUPLICATE KEY UPDATE语句
-        insert_sql = text("""
-        INSERT INTO bao_nostock_trade (
-            code, date, open, high, low, close, preclose, volume, amount, adjustflag, turn, tradestatus, pctChg, peTTM, pbMRQ, psTTM, pcfNcfTTM, isST
-        ) VALUES (
-            :code, :date, :open, :high, :low, :close, :preclose, :volume, :amount, :adjustflag, :turn, :tradestatus, :pctChg, :peTTM, :pbMRQ, :psTTM, :pcfNcfTTM, :isST
-        ) on duplicate key update
-        isST = values(isST)
-        """)
-        
-        conn.execute(insert_sql, insert_data)
-        saved_count += 1
-    
-    conn.commit()
-
-    return saved_count
+    return baostock_common.save_kline_data_batch(df, conn, table_name='bao_nostock_trade')
     
 
 # 批量获取并保存非股票K线数据
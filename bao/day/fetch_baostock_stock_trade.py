@@ -5,12 +5,16 @@ import pandas as pd
 from datetime import datetime, timedelta, date
 from sqlalchemy import text
 import time
+import importlib
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # 获取当前脚本的绝对路径并向上回溯到根目录
 root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 import stock_common
+import trade_calendar
 sys.path.append(root_path + '/bao')
 import baostock_common
 
@@ -60,134 +64,188 @@ def fetch_single_stock_kline(stock_code, stock_name, start_date, end_date, adjus
 # 保存K线数据到bao_stock_trade表
 def save_kline_data(df, conn):
     """保存K线数据到bao_stock_trade表"""
-    if df is None or df.empty:
-        return 0
+    return baostock_common.save_kline_data_batch(df, conn)
 
-    saved_count = 0
+# 一次查出每个分表中各股票的最新日期
+def load_kline_latest_dates(conn):
+    latest_dates = {}
+    for divide_table_num in range(0, 10, 1):
+        sql = f"SELECT code, MAX(date) AS max_date FROM bao_stock_trade_{divide_table_num} GROUP BY code"
+        for item in conn.execute(text(sql)).fetchall():
+            # 检查类型，如果是datetime则转换为date，如果已经是date则直接使用
+            latest_dates[item.code] = item.max_date.date() if isinstance(item.max_date, datetime) else item.max_date
+    return latest_dates
 
-    for _, row in df.iterrows():
-        # 准备插入数据
-        insert_data = {
-            'code': row.get('code'),
-            'date': row.get('date'),
-            'open': float(row.get('open')) if row.get('open') else None,
-            'high': float(row.get('high')) if row.get('high') else None,
-            'low': float(row.get('low')) if row.get('low') else None,
-            'close': float(row.get('close')) if row.get('close') else None,
-            'preclose': float(row.get('preclose')) if row.get('preclose') else None,
-            'volume': float(row.get('volume')) if row.get('volume') else None,
-            'amount': float(row.get('amount')) if row.get('amount') else None,
-            'adjustflag': int(row.get('adjustflag')) if row.get('adjustflag') else None,
-            'turn': float(row.get('turn')) if row.get('turn') else None,
-            'tradestatus': int(row.get('tradestatus')) if row.get('tradestatus') else None,
-            'pctChg': float(row.get('pctChg')) if row.get('pctChg') else None,
-            'peTTM': float(row.get('peTTM')) if row.get('peTTM') else None,
-            'pbMRQ': float(row.get('pbMRQ')) if row.get('pbMRQ') else None,
-            'psTTM': float(row.get('psTTM')) if row.get('psTTM') else None,
-            'pcfNcfTTM': float(row.get('pcfNcfTTM')) if row.get('pcfNcfTTM') else None,
-            'isST': int(row.get('isST')) if row.get('isST') else None
-        }
-        
-        # 使用INSERT ... ON DUPLICATE KEY UPDATE语句
-        insert_sql = text(f"""
-        INSERT INTO bao_stock_trade_{insert_data['code'][-1]} (
-            code, date, open, high, low, close, preclose, volume, amount, adjustflag, turn, tradestatus, pctChg, peTTM, pbMRQ, psTTM, pcfNcfTTM, isST
-        ) VALUES (
-            :code, :date, :open, :high, :low, :close, :preclose, :volume, :amount, :adjustflag, :turn, :tradestatus, :pctChg, :peTTM, :pbMRQ, :psTTM, :pcfNcfTTM, :isST
-        ) on duplicate key update
-        isST = values(isST)
-        """)
-        
-        conn.execute(insert_sql, insert_data)
-        saved_count += 1
-    
-    conn.commit()
-
-    return saved_count
-
-# 批量获取并保存股票K线数据
-def batch_fetch_and_save_kline_data(conn):
+# 生成K线获取计划，每只股票一条(code, 开始日期, 结束日期)，已是最新、已退市、区间内无交易日的股票不在计划中
+def build_kline_fetch_plan(conn, stocks=None):
     date_2007 = date(2007, 1, 1)
-    end_date = datetime.now().strftime('%Y-%m-%d')
-    yesterday = datetime.now().date() - timedelta(days=1)
-
-    # 获取所有股票代码
-    stocks = stock_common.get_stock_info_all(conn)
-    
-    if not stocks or len(stocks) == 0:
-        logger.info("未获取到股票数据")
-        return
-    
-    total_stocks = len(stocks)
-    logger.info(f"开始处理{total_stocks}只股票的K线数据")
+    end_date = datetime.now().date()
+    yesterday = end_date - timedelta(days=1)
 
-    # 处理每只股票
-    for index, stock in enumerate(stocks):
-        stock_code = stock.code
-        stock_name = stock.code_name
-        ipo_date = stock.ipo_date
+    if stocks is None:
+        stocks = stock_common.get_stock_info_all(conn)
+    latest_dates = load_kline_latest_dates(conn)
+    calendar = trade_calendar.get_trade_calendar(conn)
 
+    plan = []
+    for stock in stocks:
         """计算开始日期
-        1. 如果表中不存在数据，从start_date开始
+        1. 如果表中不存在数据，从2007-01-01开始
         2. 如果表中存在数据，从最新日期的下一天开始
         """
-        # 查询表中最新日期
-        result = conn.execute(
-            text(f"SELECT MAX(date) FROM bao_stock_trade_{stock.code[-1]} WHERE code = :code"), 
-            {'code': stock_code}
-        ).fetchone()
-        # 检查result[0]的类型，如果是datetime则转换为date，如果已经是date则直接使用
-        if result and result[0]:
-            if hasattr(result[0], 'date'):  # 如果有date方法（datetime类型）
-                latest_date = result[0].date()
-            else:  # 已经是date类型
-                latest_date = result[0]
-        else:
-            latest_date = date_2007
-        
-        # 计算开始日期，如果最近日期是2007-01-01，从2007-01-01开始。否则从最新数据的下一天开始
+        latest_date = latest_dates.get(stock.code) or date_2007
         if latest_date == date_2007:
             start_date = date_2007
         else:
             start_date = latest_date + timedelta(days=1)
-        
-        logger.info(f"{index+1}/{total_stocks} 处理股票: {ipo_date}{stock_name}({stock_code})  {start_date}  {end_date}")
 
         # 如果start_date大于昨天，就跳过当前股票。即最新数据己拿到
         if start_date > yesterday:
-            logger.debug(f"{index+1}/{total_stocks}  股票 {stock_name}({stock_code}) 最新数据已获取，跳过")
             continue
-        
-        if "0" == stock.status and stock.out_date is not None and stock.out_date.strftime('%Y-%m-%d') == latest_date.__str__():
-            logger.debug(f"{index+1}/{total_stocks}  股票 {stock_name}({stock_code}) 退市前全部数据已获取，跳过")
+
+        # 退市前全部数据已获取
+        if "0" == stock.status and stock.out_date is not None and stock.out_date == latest_date:
             continue
-        
 
-        # 开始时间和结束时间无开市日，跳过当前股票
-        tradeday_num = stock_common.getTradeNum(start_date.__str__(), end_date.__str__(), conn)
-        if tradeday_num == 0:
-            logger.debug(f"{index+1}/{total_stocks}  股票 {stock_name}({stock_code}) {start_date} {end_date} 无交易日，跳过")
+        # 开始时间和结束时间无开市日，跳过当前股票，包含开始日期，不包含结束日期
+        if calendar.count_between(start_date, end_date) == 0:
             continue
 
-        # 获取K线数据
-        df = fetch_single_stock_kline(stock_code, stock_name, start_date.__str__(), end_date.__str__())
+        plan.append({'code': stock.code, 'code_name': stock.code_name, 
+                     'start_date': start_date.__str__(), 'end_date': end_date.__str__()})
+    logger.info(f"K线获取计划: {len(stocks)}只股票，需要获取{len(plan)}只")
+    return plan
+
+# 输出获取计划，file_path为空时只写日志
+def dump_kline_fetch_plan(plan, file_path=None):
+    lines = [f"{item['code']},{item['code_name']},{item['start_date']},{item['end_date']}" for item in plan]
+    if file_path:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("code,code_name,start_date,end_date\n")
+            f.write("\n".join(lines) + "\n")
+        logger.info(f"K线获取计划已写入 {file_path}")
+    else:
+        for line in lines:
+            logger.info(line)
+
+# 按计划获取并保存单个股票的K线数据，rate_limiter为空时按原来的固定间隔sleep
+def fetch_and_save_single_stock(index, total_stocks, item, conn, rate_limiter=None):
+    stock_code = item['code']
+    stock_name = item['code_name']
+    logger.info(f"{index+1}/{total_stocks} 处理股票: {stock_name}({stock_code})  {item['start_date']}  {item['end_date']}")
+
+    # 获取K线数据
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    df = fetch_single_stock_kline(stock_code, stock_name, item['start_date'], item['end_date'])
+    if rate_limiter is None:
         time.sleep(0.1)
-        
-        if df is not None and not df.empty:
-            # 保存数据到表
-            saved_count = save_kline_data(df, conn)
-            logger.debug(f"{index+1}/{total_stocks} {stock_name}({stock_code})  成功保存{saved_count}条数据")
-        else:
-            logger.debug(f"{index+1}/{total_stocks}  没有获取到数据或数据为空")
+    
+    if df is not None and not df.empty:
+        # 保存数据到表
+        saved_count = save_kline_data(df, conn)
+        logger.debug(f"{index+1}/{total_stocks} {stock_name}({stock_code})  成功保存{saved_count}条数据")
+        return saved_count
+    else:
+        logger.debug(f"{index+1}/{total_stocks}  没有获取到数据或数据为空")
+        return 0
+
+# 批量获取并保存股票K线数据
+def batch_fetch_and_save_kline_data(conn):
+    plan = build_kline_fetch_plan(conn)
+    total_stocks = len(plan)
+
+    # 处理每只股票
+    for index, item in enumerate(plan):
+        fetch_and_save_single_stock(index, total_stocks, item, conn)
 
         if index % 100 == 0:
             time.sleep(1)
+
+
+# 多进程模式：每个工作进程自己的baostock登录和DB连接
+worker_conn = None
+worker_rate_limiter = None
+
+def init_kline_worker(rate_limiter, bs_module_name='baostock'):
+    """工作进程初始化，bs_module_name可以换成本地的假baostock模块做测试"""
+    global bs, worker_conn, worker_rate_limiter
+    bs = importlib.import_module(bs_module_name)
+    lg = bs.login()
+    if lg.error_code != '0':
+        raise Exception(f"登录baostock失败: {lg.error_msg}")
+    worker_conn = stock_common.get_db_conn(sql_echo=False)
+    worker_rate_limiter = rate_limiter
+    # 进程退出时关闭连接，登出
+    multiprocessing.util.Finalize(None, close_kline_worker, exitpriority=10)
+
+def close_kline_worker():
+    if worker_conn is not None:
+        worker_conn.close()
+    bs.logout()
+
+def fetch_kline_shard(shard_plan, total_stocks):
+    """处理一组股票，shard_plan为(序号, 计划)列表"""
+    saved_count = 0
+    for index, item in shard_plan:
+        try:
+            saved_count += fetch_and_save_single_stock(index, total_stocks, item, worker_conn, worker_rate_limiter)
+        except Exception as e:
+            worker_conn.rollback()
+            logger.error(f"{index+1}/{total_stocks} 股票 {item['code']} 处理失败: {str(e)}")
+    return saved_count
+
+# 多进程批量获取并保存股票K线数据，按code最后一位分组，rate为每秒请求baostock的次数
+def batch_fetch_and_save_kline_data_parallel(conn, workers=4, rate=10, bs_module_name='baostock'):
+    plan = build_kline_fetch_plan(conn)
+    total_stocks = len(plan)
+    if total_stocks == 0:
+        logger.info("没有需要获取的股票数据")
+        return 0
+    logger.info(f"开始处理{total_stocks}只股票的K线数据，{workers}个进程，每秒{rate}次请求")
+
+    # 按code最后一位分组，同一分表的股票在同一组
+    shard_list = {}
+    for index, item in enumerate(plan):
+        shard_list.setdefault(item['code'][-1], []).append((index, item))
+
+    rate_limiter = baostock_common.RateLimiter(rate)
+    saved_count = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_kline_worker, initargs=(rate_limiter, bs_module_name)) as executor:
+        futures = {executor.submit(fetch_kline_shard, shard_plan, total_stocks): shard for shard, shard_plan in shard_list.items()}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                saved_count += future.result()
+                logger.info(f"分组 {shard} 处理完成")
+            except Exception as e:
+                logger.error(f"处理分组 {shard} 时出错: {str(e)}")
+    logger.info(f"股票K线数据处理完成，共保存{saved_count}条数据")
+    return saved_count
         
 
 if __name__ == "__main__":
     logger.info("开始获取股票历史K线数据...")
     # 设置起始日期为2007年1月1日，结束日期为今天
     
+    # 只输出获取计划: python fetch_baostock_stock_trade.py --dry-run [计划文件]
+    if '--dry-run' in sys.argv:
+        dry_run_index = sys.argv.index('--dry-run')
+        plan_file = sys.argv[dry_run_index + 1] if len(sys.argv) > dry_run_index + 1 and not sys.argv[dry_run_index + 1].startswith('--') else None
+        conn = stock_common.get_db_conn(sql_echo=False)
+        dump_kline_fetch_plan(build_kline_fetch_plan(conn), plan_file)
+        conn.close()
+        sys.exit(0)
+
+    # 多进程模式: python fetch_baostock_stock_trade.py --workers 4 --rate 10
+    workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv else 0
+    rate = float(sys.argv[sys.argv.index('--rate') + 1]) if '--rate' in sys.argv else 10
+    if workers > 0:
+        conn = stock_common.get_db_conn(sql_echo=False)
+        batch_fetch_and_save_kline_data_parallel(conn, workers=workers, rate=rate)
+        conn.close()
+        logger.info("股票历史K线数据获取完成！")
+        sys.exit(0)
 
     if not baostock_common.login_baostock():
         raise Exception("登录baostock失败")
@@ -200,4 +258,4 @@ if __name__ == "__main__":
         logger.error(f"批量处理失败: {str(e)}")
     finally:
         # 确保登出
-        baostock_common.logout_baostock()
\ No newline at end of file
+        baostock_common.logout_baostock()
@@ -8,7 +8,9 @@ root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 sys.path.append(root_path + '/bao/season')
+sys.path.append(root_path + '/bao/gen_data')
 import stock_common
+import job_journal
 sys.path.append(root_path + '/bao')
 import baostock_common
 
@@ -17,11 +19,23 @@ import logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 最新快照，和bao_stock_basic的最新日K字段
+def refresh_latest_snapshot(conn):
+    import f_stock_latest_snapshot
+    since_date = f_stock_latest_snapshot.get_snapshot_latest_date(conn)
+    row_count = f_stock_latest_snapshot.refresh_stock_latest_snapshot(conn=conn, since_date=since_date)
+    # 只更新今天有新日K的股票
+    import a_trade_pe_data
+    a_trade_pe_data.bu_bao_stock_basic(conn=conn, since_date=since_date)
+    return row_count
+
 if __name__ == '__main__':
     # 登录baostock
     if not baostock_common.login_baostock():
         raise Exception("登录baostock失败")
     
+    # 每个阶段记入任务日志，失败的阶段重试；--resume 接着上次没跑完的批次，已完成的阶段跳过
+    journal = job_journal.JobJournal('bao_day')
     try:
         conn = stock_common.get_db_conn(sql_echo=False)
 
@@ -34,31 +48,42 @@ if __name__ == '__main__':
             # 1
             logger.info("基本信息开始")
             import fetch_baostock_stock_basic
-            fetch_baostock_stock_basic.fetch_and_save_stock_basic(conn=conn)
+            journal.run('stock_basic', fetch_baostock_stock_basic.fetch_and_save_stock_basic, conn=conn, rollback_conn=conn)
             logger.info("基本信息完成")
 
             #2
             logger.info("分类信息开始")
             import fetch_baostock_stock_basic_industry
-            fetch_baostock_stock_basic_industry.update_stock_industry_info(conn=conn)
+            journal.run('stock_industry', fetch_baostock_stock_basic_industry.update_stock_industry_info, conn=conn, rollback_conn=conn)
             logger.info("分类信息完成")
 
         #3 
         logger.info("非股票交易记录开始")
         import fetch_baostock_nostock_trade
-        fetch_baostock_nostock_trade.batch_fetch_and_save_kline_data(conn=conn)
+        journal.run('nostock_trade', fetch_baostock_nostock_trade.batch_fetch_and_save_kline_data, conn=conn, rollback_conn=conn)
         logger.info("非股票交易记录完成")
 
         #4
         logger.info("股票交易记录开始")
         import fetch_baostock_stock_trade
-        fetch_baostock_stock_trade.batch_fetch_and_save_kline_data(conn=conn)
+        journal.run('stock_trade', fetch_baostock_stock_trade.batch_fetch_and_save_kline_data, conn=conn, rollback_conn=conn)
         logger.info("股票交易记录完成")
 
+        #5
+        logger.info("最新快照开始")
+        journal.run('latest_snapshot', refresh_latest_snapshot, conn, rollback_conn=conn)
+        logger.info("最新快照完成")
+
         conn.close()
         
     except Exception as e:
         logger.error(f"批量处理失败: {str(e)}")
+        journal.record_failure('runner', str(e))
     finally:
+        journal.log_summary()
+        exit_code = journal.exit_code()
+        journal.close()
         # 确保登出
-        baostock_common.logout_baostock()
\ No newline at end of file
+        baostock_common.logout_baostock()
+    # 有失败的阶段时非0退出
+    sys.exit(exit_code)
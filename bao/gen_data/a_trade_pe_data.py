@@ -1,12 +1,16 @@
 import sys
 import os
-from sqlalchemy import text
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
 
 # 获取当前脚本的绝对路径并向上回溯到根目录
 root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 import stock_common
+sys.path.append(root_path + '/bao/gen_data')
+import b_trade_pe1year_dividend
 
 # 配置logger
 import logging
@@ -16,81 +20,104 @@ logger = logging.getLogger(__name__)
 """ bao_stock_trade_0 单表数据补充, 填充空值为前一条记录的值 """
 
 
-def bu_trade_data(conn = None):
-    param_columns = ['peTTM','psTTM','pbMRQ','pcfNcfTTM']
-
-    param_tables = []
-    for divide_table_num in range(0, 10, 1):
-        param_tables.append(f"bao_stock_trade_{divide_table_num}")
-
-    for cur_table in param_tables:
-        for cur_column in param_columns:
-            sql = f"SELECT * FROM {cur_table} where {cur_column} is null"
-            results = conn.execute(text(sql))
-            if results:
-                total_count = results.rowcount
-                logger.info(f"table: {cur_table}, column: {cur_column}, count: {total_count}")
-                for index, item in enumerate(results):
-                    logger.debug(f"table: {cur_table}, column: {cur_column}, {index}/{total_count}")
-                    # 查询前一条记录
-                    sql = f"SELECT * FROM {cur_table} WHERE code = '{item.code}' AND date < '{item.date}' and {cur_column} is not null ORDER BY date DESC LIMIT 1"
-                    prev_results = conn.execute(text(sql))
-                    if prev_results and prev_results.rowcount > 0:
-                        # 用前一条记录的值
-                        prev_item = prev_results.fetchone()
-                        sql = f"UPDATE {cur_table} SET {cur_column} = {prev_item.__getattribute__(cur_column)} WHERE code = '{item.code}' AND date = '{item.date}'"
-                        conn.execute(text(sql))
-                        conn.commit()
-                    else:
-                        # 用0填充
-                        logger.debug(f"table: {cur_table}, column: {cur_column} {item.code} {item.date}, {index}/{total_count}, 没有前一条记录")
-                        sql = f"UPDATE {cur_table} SET {cur_column} = 0 WHERE code = '{item.code}' AND date = '{item.date}'"
-                        conn.execute(text(sql))
-                        conn.commit()
-
-def bu_bao_stock_basic(conn = None):    
+# 需要填充空值的估值字段
+BU_TRADE_COLUMNS = ['peTTM', 'psTTM', 'pbMRQ', 'pcfNcfTTM']
+# 每次批量写回的行数
+BU_TRADE_BATCH_SIZE = 500
+
+def fill_trade_rows(rows):
+    """单只股票按日期顺序向前填充：空值用前一条非空记录的值，前面没有记录用0，rows为(code, date, 估值字段...)，返回(待更新的行, 每个字段填充的数量)"""
+    df = pd.DataFrame(rows, columns=['code', 'date'] + BU_TRADE_COLUMNS)
+    if df.empty:
+        return [], {column: 0 for column in BU_TRADE_COLUMNS}
+
+    values = df[BU_TRADE_COLUMNS].astype(float)
+    null_mask = values.isna()
+    filled = values.ffill().fillna(0)
+
+    update_rows = []
+    for index in np.flatnonzero(null_mask.any(axis=1).to_numpy()):
+        row = {'code': df.at[index, 'code'], 'date': df.at[index, 'date']}
+        for column in BU_TRADE_COLUMNS:
+            row[column] = float(filled.at[index, column])
+        update_rows.append(row)
+    return update_rows, {column: int(null_mask[column].sum()) for column in BU_TRADE_COLUMNS}
+
+def bu_trade_data(conn = None, divide_table_nums=range(0, 10, 1)):
+    """bao_stock_trade_0到9 估值字段的空值填充为前一条记录的值，有空值的股票按code, date流式读取，分批写回，返回每个分表每个字段的填充数量"""
+    # 只更新原来为空的字段，有值的字段保持不变
+    set_sql = ", ".join([f"{column} = COALESCE({column}, :{column})" for column in BU_TRADE_COLUMNS])
+    where_sql = " or ".join([f"{column} is null" for column in BU_TRADE_COLUMNS])
+
+    fill_counts = {}
+    for divide_table_num in divide_table_nums:
+        cur_table = f"bao_stock_trade_{divide_table_num}"
+        table_counts = {column: 0 for column in BU_TRADE_COLUMNS}
+        up_query = text(f"UPDATE {cur_table} SET {set_sql} WHERE code = :code AND date = :date")
+        # 独立的流式连接读取，写回用conn
+        select_sql = f"""SELECT code, date, {', '.join(BU_TRADE_COLUMNS)} FROM {cur_table}
+            WHERE code IN (SELECT DISTINCT code FROM {cur_table} WHERE {where_sql})
+            ORDER BY code ASC, date ASC"""
+
+        code_num = 0
+        update_rows = []
+        for code, rows in stock_common.stream_query_groups(select_sql):
+            code_num += 1
+            code_rows, code_counts = fill_trade_rows(rows)
+            update_rows.extend(code_rows)
+            # 填充改了已算过分位值的日K，分位值的窗口缓存作废
+            if code_rows:
+                b_trade_pe1year_dividend.remove_pe_windows([code])
+            for column in BU_TRADE_COLUMNS:
+                table_counts[column] += code_counts[column]
+            logger.debug(f"table: {cur_table}, {code}, {code_num}, 填充 {code_counts}")
+
+            if len(update_rows) >= BU_TRADE_BATCH_SIZE:
+                conn.execute(up_query, update_rows)
+                conn.commit()
+                update_rows = []
+        if update_rows:
+            conn.execute(up_query, update_rows)
+            conn.commit()
+
+        fill_counts[cur_table] = table_counts
+        logger.info(f"table: {cur_table}, 股票数: {code_num}, 填充数量: {table_counts}")
+    return fill_counts
+
+def bu_bao_stock_basic(conn = None, codes=None, since_date=None):
+    """bao_stock_basic 的 k_date, close, total_market_value 从 stock_latest_snapshot 一次联表更新
+    codes: 只更新这些股票
+    since_date: 只更新快照日期在这天及之后的股票，日K增量获取后使用
+    """
     logger.info(f"开始补充 bao_stock_basic 表的 k_date, close, total_market_value 字段")
-    
-    #  WHERE status = '1'
-    sql = "SELECT code FROM bao_stock_basic"
-    results = conn.execute(text(sql))
-    total_count = results.rowcount
-    logger.info(f"共 {total_count} 只股票需要补充数据")
-    
-    for index, item in enumerate(results):
-        logger.debug(f"处理股票: {item.code}, {index}/{total_count}")
-        
-        code = item.code
-        table_num = code[-1]
-        trade_table = f"bao_stock_trade_{table_num}"
-        
-        sql = f"""
-            SELECT date, close, total_market_value 
-            FROM {trade_table} 
-            WHERE code = :code 
-            ORDER BY date DESC LIMIT 1
-        """
-        trade_result = conn.execute(text(sql), {'code': code}).fetchone()
-        
-        if trade_result:
-            sql = """
-                UPDATE bao_stock_basic 
-                SET k_date = :k_date, 
-                    close = :close, 
-                    total_market_value = :total_market_value 
-                WHERE code = :code
-            """
-            conn.execute(text(sql), {
-                'k_date': trade_result.date,
-                'close': trade_result.close,
-                'total_market_value': trade_result.total_market_value,
-                'code': code
-            })
-            logger.debug(f"股票 {code} 数据更新完成")
-        else:
-            logger.debug(f"股票 {code} 在表 {trade_table} 中没有数据")
+    if codes is not None and len(codes) == 0:
+        logger.info(f"没有需要补充的股票")
+        return 0
+
+    where_list = []
+    params = {}
+    if codes is not None:
+        where_list.append("s.code IN :codes")
+        params['codes'] = list(codes)
+    if since_date is not None:
+        where_list.append("s.date >= :since_date")
+        params['since_date'] = since_date
+    where_sql = ("WHERE " + " AND ".join(where_list)) if where_list else ""
+
+    sql = text(f"""
+        UPDATE bao_stock_basic b
+        INNER JOIN stock_latest_snapshot s ON b.code = s.code
+        SET b.k_date = s.date,
+            b.close = s.close,
+            b.total_market_value = s.total_market_value
+        {where_sql}
+    """)
+    if codes is not None:
+        sql = sql.bindparams(bindparam('codes', expanding=True))
+    result = conn.execute(sql, params)
     conn.commit()
-    logger.info(f"完成补充 bao_stock_basic 表的数据")
+    logger.info(f"完成补充 bao_stock_basic 表的数据，更新 {result.rowcount} 只股票")
+    return result.rowcount
     
             
 if __name__ == "__main__":
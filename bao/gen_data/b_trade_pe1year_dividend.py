@@ -1,6 +1,7 @@
 import sys
 import os
-import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sqlalchemy import text
 import numpy as np
 
@@ -14,186 +15,463 @@ root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 import stock_common
+sys.path.append(root_path + '/bao/gen_data')
+import f_stock_latest_snapshot
 
 # bao_stock_trade_0表数据补充，依赖bao_stock_dividend
+# 按stock_gen_watermark水位增量计算，分位值置空重算的股票用 --backfill --codes 重建
+# 每只股票水位前10年的窗口缓存在 PE_WINDOW_DIR，每晚只从数据库读新的交易日，缓存不存在或水位不一致时读水位前10年
+# 没有水位的股票：分位值已算完的直接记水位，有空值的按原来的方式计算后记水位
 
-def get_stock_trade_page(table_name, page_num, page_size, conn):
-    offset = (page_num - 1) * page_size
-    sql = f"SELECT * FROM {table_name} where pe_year_1_percent is null order by code asc, date asc LIMIT {offset}, {page_size}"
-    results = conn.execute(text(sql)).fetchall()
-    return results
+# 分位值计算的水位：stock_gen_watermark 中每只股票已经计算到的最后交易日
+WATERMARK_STAGE = 'pe_percent'
+# 分位值最长的窗口年数，增量计算时只读取水位前这么多年的日K
+MAX_PERCENT_YEARS = 10
+# 每只股票水位前10年窗口的本地缓存，一只股票一个文件，缓存的水位和表中的水位一致时只从数据库读水位之后的新行
+PE_WINDOW_DIR = os.getenv('PE_WINDOW_DIR', os.path.join(root_path, 'cache', 'pe_window'))
+# 窗口缓存的字段，日期之外都是float，空值为NaN
+PE_WINDOW_COLUMNS = ['turn', 'peTTM', 'pbMRQ', 'psTTM', 'pcfNcfTTM']
+
+def update_stock_total_market_value(table_name, conn, code=None, since_date=None):
+    """总市值为空的行补总市值，code/since_date 只更新这只股票这天之后的行"""
+    where_sql = ""
+    params = {}
+    if code is not None:
+        where_sql += " and code = :code"
+        params['code'] = code
+    if since_date is not None:
+        where_sql += " and date > :since_date"
+        params['since_date'] = since_date
+    sql = f"""update {table_name} set total_market_value = amount/turn*100/10000/10000 where total_market_value is null and turn > 0{where_sql}"""
+    conn.execute(text(sql), params)
+    conn.commit()
 
-def get_stock_trade_total(table_name, conn):
-    sql = f"SELECT count(*) FROM {table_name} where pe_year_1_percent is null"
-    results = conn.execute(text(sql)).fetchone()
-    return results[0]
+def get_watermark_todo_list(divide_table_num, conn):
+    """有水位并且水位之后有新日K的股票，[(code, 水位日期)]，按(code, date)索引逐只判断，不扫全表"""
+    sql = f"""SELECT w.code, w.last_date FROM stock_gen_watermark w
+        WHERE w.stage = :stage AND RIGHT(w.code, 1) = :divide_table_num
+        AND EXISTS (SELECT 1 FROM bao_stock_trade_{divide_table_num} t WHERE t.code = w.code AND t.date > w.last_date)
+        ORDER BY w.code ASC"""
+    results = conn.execute(text(sql), {'stage': WATERMARK_STAGE, 'divide_table_num': str(divide_table_num)}).fetchall()
+    return [(item.code, item.last_date) for item in results]
 
-def update_stock_total_market_value(table_name, conn):
-    sql = f"""update {table_name} set total_market_value = amount/turn*100/10000/10000 where total_market_value is null and turn > 0"""
-    conn.execute(text(sql))
+def seed_watermarks(divide_table_num, conn):
+    """还没有水位、分位值已全部算完的股票，水位直接记为MAX(date)，返回记录的股票数
+    只看没有水位的股票，全部有水位后按(code, date)索引逐只判断，不扫全表"""
+    sql = f"""INSERT INTO stock_gen_watermark (stage, code, last_date)
+        SELECT :stage, t.code, MAX(t.date) FROM bao_stock_trade_{divide_table_num} t
+        WHERE t.code IN (SELECT b.code FROM bao_stock_basic b WHERE RIGHT(b.code, 1) = :divide_table_num
+            AND NOT EXISTS (SELECT 1 FROM stock_gen_watermark w WHERE w.stage = :stage AND w.code = b.code))
+        GROUP BY t.code
+        HAVING SUM(t.pe_year_1_percent is null) = 0"""
+    result = conn.execute(text(sql), {'stage': WATERMARK_STAGE, 'divide_table_num': str(divide_table_num)})
     conn.commit()
+    if result.rowcount > 0:
+        logger.info(f"{divide_table_num}表 {result.rowcount}只分位值已算完的股票记录水位")
+    return result.rowcount
 
-def get_stock_trade_turn(cur_table_name, cur_code, cur_date_str, days, conn):
-    # 包含当天的数据
-    sql = f"""SELECT SUM(turn) AS total_turn FROM (
-                select b.turn from {cur_table_name} b where b.code = '{cur_code}' and date <= '{cur_date_str}' order by date desc limit {days}) AS subquery"""
-    results = conn.execute(text(sql), {'date': cur_date_str}).fetchone()
-    if results is None or results.total_turn is None:
-        # 无数据，换手率设置为0
-        return 0
-    else:
-        return results.total_turn
-
-def get_fenhong_percent(cur_code, cur_date_str, cur_open_price, conn):
-    # 1年内，包含交易日当天的分红
-    sql = f"""select sum(dividCashPsBeforeTax) total_cash from bao_stock_dividend where code = '{cur_code}'
-                and dividOperateDate <= '{cur_date_str}' and dividOperateDate > DATE_SUB('{cur_date_str}', INTERVAL 1 YEAR)"""
-    results = conn.execute(text(sql)).fetchone()
-    if results is None or results.total_cash is None:
-        # 最近一年分红为0
-        logger.debug("最近一年没有分红: %s %s", cur_code, cur_date_str)
-        return 0
-    else:
-        stock_fenghong_percent = results.total_cash/cur_open_price*100
-        return round(stock_fenghong_percent, 2)
+def get_no_watermark_todo_codes(divide_table_num, conn):
+    """还没有水位的股票中，有分位值为空的行的股票，第一次按水位计算时用原来的判断方式"""
+    sql = f"""SELECT b.code FROM bao_stock_basic b
+        WHERE RIGHT(b.code, 1) = :divide_table_num
+        AND NOT EXISTS (SELECT 1 FROM stock_gen_watermark w WHERE w.stage = :stage AND w.code = b.code)
+        AND EXISTS (SELECT 1 FROM bao_stock_trade_{divide_table_num} t WHERE t.code = b.code AND t.pe_year_1_percent is null)
+        ORDER BY b.code ASC"""
+    results = conn.execute(text(sql), {'stage': WATERMARK_STAGE, 'divide_table_num': str(divide_table_num)}).fetchall()
+    return [item.code for item in results]
 
-def single_update_trade_data(cur_table_name, cur_code, cur_date_str, cur_open_price, conn):
-    insert_data = {'code': cur_code, 'date': cur_date_str}
-    stock_fenghong_percent = None
+def get_shard_codes(divide_table_num, conn):
+    """分表中的全部股票，重建时用"""
+    sql = f"SELECT DISTINCT code FROM bao_stock_trade_{divide_table_num} order by code asc"
+    results = conn.execute(text(sql)).fetchall()
+    return [item.code for item in results]
 
-    # 股息率 最近一年分红/开盘价*100
-    if cur_open_price is None or cur_open_price == 0:
-        stock_fenghong_percent = 0
-    else:
-        stock_fenghong_percent = get_fenhong_percent(cur_code, cur_date_str, cur_open_price, conn)
-    insert_data['stock_fenghong_percent'] = stock_fenghong_percent
-
-    # 近5天换手率
-    insert_data['turn_percent_5'] = get_stock_trade_turn(cur_table_name, cur_code, cur_date_str, 5, conn)
-    # 近15天换手率
-    insert_data['turn_percent_15'] = get_stock_trade_turn(cur_table_name, cur_code, cur_date_str, 15, conn)
-    # 近30天换手率
-    insert_data['turn_percent_30'] = get_stock_trade_turn(cur_table_name, cur_code, cur_date_str, 30, conn)
-
-    # 近1年pe 百分位
-    param_year = [1,3,5,10]
-    for year in param_year:
-        pepbpspcf_percent = get_pepspbpcf_percent(cur_table_name, cur_code, cur_date_str, year, conn)
-        if pepbpspcf_percent is None:
-            logger.debug(f"最近{year}年没有pepbpspcf数据: %s %s", cur_code, cur_date_str)
-            insert_data[f'pe_year_{year}_percent'] = 0
-            insert_data[f'ps_year_{year}_percent'] = 0
-            insert_data[f'pb_year_{year}_percent'] = 0
-            insert_data[f'pcf_year_{year}_percent'] = 0
-        else:
-            insert_data[f'pe_year_{year}_percent'] = round(float(pepbpspcf_percent['peTTM']), 2)
-            insert_data[f'ps_year_{year}_percent'] = round(float(pepbpspcf_percent['psTTM']), 2)
-            insert_data[f'pb_year_{year}_percent'] = round(float(pepbpspcf_percent['pbMRQ']), 2)
-            insert_data[f'pcf_year_{year}_percent'] = round(float(pepbpspcf_percent['pcfNcfTTM']), 2)
-
-    # 更新DB 股票信息
-    up_query = f"""update {cur_table_name} set stock_fenghong_percent = :stock_fenghong_percent, turn_percent_5 = :turn_percent_5, turn_percent_15 = :turn_percent_15, turn_percent_30 = :turn_percent_30, 
+def save_watermark(code, last_date, conn):
+    sql = """INSERT INTO stock_gen_watermark (stage, code, last_date) VALUES (:stage, :code, :last_date)
+        ON DUPLICATE KEY UPDATE last_date = VALUES(last_date)"""
+    conn.execute(text(sql), {'stage': WATERMARK_STAGE, 'code': code, 'last_date': last_date})
+
+def get_pe_window_path(code):
+    return os.path.join(PE_WINDOW_DIR, f"{code}.npz")
+
+def load_pe_window(code, last_date):
+    """读取股票的窗口缓存，{'date': 日期数组, 字段: 值数组}；没有缓存或缓存的水位不是last_date时返回None"""
+    path = get_pe_window_path(code)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            window = {name: data[name] for name in data.files}
+    except Exception as e:
+        logger.warning(f"{code} 读取窗口缓存失败: {str(e)}")
+        return None
+    if str(window.pop('last_date')) != str(last_date) or len(window['date']) == 0 or str(window['date'][-1]) != str(last_date):
+        return None
+    return window
+
+def save_pe_window(code, dates, columns):
+    """保存水位前10年的窗口，dates为按日期升序的日期列表，columns为{字段: 值数组}，先写临时文件再替换"""
+    date_array = np.array(dates, dtype='datetime64[D]')
+    begin = np.searchsorted(date_array, np.datetime64(date_sub_years(dates[-1], MAX_PERCENT_YEARS), 'D'), side='right')
+    os.makedirs(PE_WINDOW_DIR, exist_ok=True)
+    path = get_pe_window_path(code)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, last_date=str(dates[-1]), date=date_array[begin:], **{column: columns[column][begin:] for column in PE_WINDOW_COLUMNS})
+    os.replace(tmp_path, path)
+
+def remove_pe_windows(codes):
+    """水位之前的日K有修改后删除这些股票的窗口缓存，下次从数据库重新读取"""
+    for code in codes:
+        path = get_pe_window_path(code)
+        if os.path.exists(path):
+            os.remove(path)
+
+def get_dividend_events(cur_code, conn):
+    """单只股票的全部除权除息，按除权除息日期升序，返回(日期数组, 每股分红数组)"""
+    sql = """select dividOperateDate, dividCashPsBeforeTax from bao_stock_dividend where code = :code
+                and dividOperateDate is not null and dividCashPsBeforeTax is not null order by dividOperateDate asc"""
+    results = conn.execute(text(sql), {'code': cur_code}).fetchall()
+    event_dates = np.array([item.dividOperateDate for item in results], dtype='datetime64[D]')
+    # 字段是float，MySQL的SUM按float转double累加，这里保持一致
+    event_cash = np.array([item.dividCashPsBeforeTax for item in results], dtype=np.float32).astype(np.float64)
+    return event_dates, event_cash
+
+def get_fenhong_percent_list(dates, opens, event_dates, event_cash):
+    """股息率：1年内（包含交易日当天）的分红/开盘价*100
+    dates: 交易日列表，opens: 对应的开盘价，空值或0的股息率为0
+    窗口为 dividOperateDate <= 当天 and dividOperateDate > DATE_SUB(当天, INTERVAL 1 YEAR)
+    """
+    result = [0] * len(dates)
+    if len(event_dates) == 0 or len(dates) == 0:
+        return result
+    cur_dates = np.array(dates, dtype='datetime64[D]')
+    cutoffs = np.array([date_sub_years(d, 1) for d in dates], dtype='datetime64[D]')
+    # 每一天窗口内的分红下标 [lo, hi)
+    hi = np.searchsorted(event_dates, cur_dates, side='right')
+    lo = np.searchsorted(event_dates, cutoffs, side='right')
+    # 相同窗口只算一次，按日期顺序逐个累加，与SQL的SUM结果一致
+    window_sums = {}
+    for index in range(len(dates)):
+        if lo[index] >= hi[index] or opens[index] is None or opens[index] == 0:
+            # 最近一年没有分红，或者没有开盘价
+            continue
+        window = (lo[index], hi[index])
+        if window not in window_sums:
+            total_cash = 0.0
+            for cash in event_cash[window[0]:window[1]]:
+                total_cash += float(cash)
+            window_sums[window] = total_cash
+        result[index] = round(window_sums[window]/opens[index]*100, 2)
+    return result
+
+# 更新分析后的数据，按 code+date 批量写回
+UPDATE_TRADE_DATA_SQL = """update {table_name} set stock_fenghong_percent = :stock_fenghong_percent, turn_percent_5 = :turn_percent_5, turn_percent_15 = :turn_percent_15, turn_percent_30 = :turn_percent_30, 
                     pe_year_1_percent = :pe_year_1_percent, pe_year_3_percent = :pe_year_3_percent, pe_year_5_percent = :pe_year_5_percent, pe_year_10_percent = :pe_year_10_percent,
                     pb_year_1_percent = :pb_year_1_percent, pb_year_3_percent = :pb_year_3_percent, pb_year_5_percent = :pb_year_5_percent, pb_year_10_percent = :pb_year_10_percent,
                     ps_year_1_percent = :ps_year_1_percent, ps_year_3_percent = :ps_year_3_percent, ps_year_5_percent = :ps_year_5_percent, ps_year_10_percent = :ps_year_10_percent,
                     pcf_year_1_percent = :pcf_year_1_percent, pcf_year_3_percent = :pcf_year_3_percent, pcf_year_5_percent = :pcf_year_5_percent, pcf_year_10_percent = :pcf_year_10_percent
                     where code = :code and date = :date"""
-    conn.execute(text(up_query), insert_data)
-    logger.debug("更新分析后的数据: %s %s", cur_code, cur_date_str)
-
-def get_pepspbpcf_percent(cur_table_name, cur_code, cur_date_str, cur_year_num, conn):
-    # 取日K数据，包含当天的交易数据
-    query = f"""SELECT peTTM, pbMRQ, psTTM, pcfNcfTTM, code, date
-               FROM {cur_table_name} where code = '{cur_code}' and date > DATE_SUB('{cur_date_str}', INTERVAL {cur_year_num} YEAR) and date <= '{cur_date_str}' order by date asc"""
-    history_data = conn.execute(text(query)).fetchall()
-    if history_data is None or len(history_data) == 0:
-        # 无数据
-        logger.debug("%s 最近 %s 年无交易数据: %s %s", cur_table_name, cur_year_num, cur_code, cur_date)
-        return None
-    
-    # 获取当前值
-    sql_current = f"""SELECT peTTM, pbMRQ, psTTM, pcfNcfTTM, code, date
-            FROM {cur_table_name} 
-            WHERE code = '{cur_code}' AND date = '{cur_date_str}'
-            """
-    current_result = conn.execute(text(sql_current)).fetchone()
-    
-    if not current_result:
-        # 无数据
-        logger.debug("无当天的交易数据 %s %s %s", cur_table_name, cur_code, cur_date_str)
-        return None
-    
-    param_columns = ['peTTM','pbMRQ','psTTM','pcfNcfTTM']
-    return_result = {}
-
-    for index, cur_column in enumerate(param_columns):
-        current_value = current_result[index]
-        
-        # 计算百分位
-        history_values = [d[index] for d in history_data]
-        percentile = np.sum(np.array(history_values) <= current_value) / len(history_values) * 100
-        return_result[cur_column] = percentile
-    
-    return return_result
+
+# 分位值的年数，和对应的字段前缀/K线字段
+PERCENT_YEARS = [1, 3, 5, 10]
+PERCENT_COLUMNS = {'pe': 'peTTM', 'pb': 'pbMRQ', 'ps': 'psTTM', 'pcf': 'pcfNcfTTM'}
+# 每次向量化比较的行数，控制内存占用
+PERCENT_BLOCK_SIZE = 256
+# 每次批量写回的行数
+UPDATE_BATCH_SIZE = 500
+# 换手率累计的交易日数
+TURN_DAYS = [5, 15, 30]
+
+def date_sub_years(cur_date, years):
+    # 与MySQL的DATE_SUB(date, INTERVAL n YEAR)一致，2月29日退到2月28日
+    try:
+        return cur_date.replace(year=cur_date.year - years)
+    except ValueError:
+        return cur_date.replace(year=cur_date.year - years, day=28)
+
+def get_window_starts(dates, years, rows=None):
+    # 每一行的窗口起始下标，窗口为 date > DATE_SUB(当天, INTERVAL n YEAR) and date <= 当天
+    # rows: 只算这些行，其余行为0
+    rows = np.arange(len(dates)) if rows is None else rows
+    starts = np.zeros(len(dates), dtype=np.int64)
+    cutoffs = np.array([date_sub_years(dates[index], years) for index in rows], dtype='datetime64[D]')
+    starts[rows] = np.searchsorted(np.array(dates, dtype='datetime64[D]'), cutoffs, side='right')
+    return starts
+
+def rolling_percent_rank(values, starts_list, rows, block_size=PERCENT_BLOCK_SIZE):
+    """滚动百分位：窗口内 <= 当天值 的行数 / 窗口行数 * 100
+    values: 按日期升序的值，空值为NaN，不计入<=的行数，但计入窗口行数
+    starts_list: {年数: 每一行的窗口起始下标}
+    rows: 需要计算的行下标（升序）
+    返回 {年数: 与rows对应的百分位}
+    """
+    result = {year: np.zeros(len(rows)) for year in starts_list}
+    min_starts = np.minimum.reduce(list(starts_list.values()))
+
+    for block_begin in range(0, len(rows), block_size):
+        block_rows = rows[block_begin:block_begin + block_size]
+        lo = min_starts[block_rows].min()
+        hi = block_rows.max() + 1
+
+        # le[k, j]: 第lo+j行的值 <= 第block_rows[k]行的值，再按列累加得到前缀计数
+        le = values[lo:hi][np.newaxis, :] <= values[block_rows][:, np.newaxis]
+        counts = np.cumsum(le, axis=1, dtype=np.int32)
+        k = np.arange(len(block_rows))
+        upper = counts[k, block_rows - lo]
+
+        for year, starts in starts_list.items():
+            block_starts = starts[block_rows]
+            lower_index = block_starts - lo - 1
+            lower = np.where(lower_index >= 0, counts[k, np.maximum(lower_index, 0)], 0)
+            result[year][block_begin:block_begin + len(block_rows)] = (upper - lower) / (block_rows - block_starts + 1) * 100
+
+    return result
+
+def rolling_turn_sums(turns, days_list=TURN_DAYS):
+    """近N个交易日（包含当天）的换手率之和，一次累加计算所有窗口
+    turns: 按日期升序的换手率，空值为NaN，按0累加，与SQL的SUM(turn)一致
+    返回 {天数: 每一行的换手率之和}
+    """
+    cumsum = np.concatenate(([0.0], np.cumsum(np.nan_to_num(np.asarray(turns, dtype=float)))))
+    index = np.arange(1, len(cumsum))
+    return {days: cumsum[index] - cumsum[np.maximum(index - days, 0)] for days in days_list}
+
+def gen_pe_data_by_code(cur_table_name, cur_code, conn, last_date=None, backfill=False):
+    """计算单只股票的分位值、换手率、股息率，批量写回，并把水位更新到最后一个交易日
+    last_date: 水位日期，只计算之后的行；有窗口缓存时只从数据库读水位之后的行，没有时读取水位前10年的日K（最长的分位值窗口）
+    backfill: 读取全部日K，全部重算
+    都没有时计算分位值为空的行
+    算完后保存新水位前10年的窗口缓存
+    """
+    window = None if backfill or last_date is None else load_pe_window(cur_code, last_date)
+    if backfill or last_date is None:
+        where_sql = ""
+        params = {'code': cur_code}
+    elif window is not None:
+        where_sql = "and date > :last_date"
+        params = {'code': cur_code, 'last_date': last_date}
+    else:
+        where_sql = f"and date > DATE_SUB(:last_date, INTERVAL {MAX_PERCENT_YEARS} YEAR)"
+        params = {'code': cur_code, 'last_date': last_date}
+    sql = f"""SELECT date, open, turn, peTTM, pbMRQ, psTTM, pcfNcfTTM, pe_year_1_percent is null as todo
+              FROM {cur_table_name} where code = :code {where_sql} order by date asc"""
+    history_data = conn.execute(text(sql), params).fetchall()
+
+    # 缓存的窗口在前，数据库读出的行在后，按日期升序
+    window_num = len(window['date']) if window is not None else 0
+    dates = (window['date'].astype(object).tolist() if window is not None else []) + [item.date for item in history_data]
+    opens = [None] * window_num + [item.open for item in history_data]
+    columns = {}
+    for column in PE_WINDOW_COLUMNS:
+        values = np.array([getattr(item, column) for item in history_data], dtype=float)
+        columns[column] = np.concatenate((window[column], values)) if window is not None else values
+
+    if backfill:
+        rows = np.arange(len(dates), dtype=np.int64)
+    elif window is not None:
+        rows = np.arange(window_num, len(dates), dtype=np.int64)
+    elif last_date is not None:
+        rows = np.array([index for index, item in enumerate(history_data) if item.date > last_date], dtype=np.int64)
+    else:
+        rows = np.array([index for index, item in enumerate(history_data) if item.todo], dtype=np.int64)
+    if len(rows) == 0:
+        # 没有要计算的行，第一次计算时也记录水位，下次按水位判断
+        if last_date is None and history_data:
+            save_watermark(cur_code, history_data[-1].date, conn)
+            conn.commit()
+        return 0
+
+    # 新行补总市值
+    update_stock_total_market_value(cur_table_name, conn, code=cur_code, since_date=None if backfill else last_date)
+
+    starts_list = {year: get_window_starts(dates, year, rows) for year in PERCENT_YEARS}
+    percent_list = {}
+    for prefix, column in PERCENT_COLUMNS.items():
+        percent_list[prefix] = rolling_percent_rank(columns[column], starts_list, rows)
+    turn_list = rolling_turn_sums(columns['turn'])
+    event_dates, event_cash = get_dividend_events(cur_code, conn)
+    fenghong_list = get_fenhong_percent_list([dates[index] for index in rows], [opens[index] for index in rows], event_dates, event_cash)
+
+    update_list = []
+    for k, index in enumerate(rows):
+        cur_date_str = dates[index].strftime("%Y-%m-%d")
+        insert_data = {'code': cur_code, 'date': cur_date_str}
+
+        # 股息率 最近一年分红/开盘价*100
+        insert_data['stock_fenghong_percent'] = fenghong_list[k]
+
+        # 近5/15/30天换手率
+        for days in TURN_DAYS:
+            insert_data[f'turn_percent_{days}'] = float(turn_list[days][index])
+
+        # 近1/3/5/10年 pe/pb/ps/pcf 百分位
+        for prefix in PERCENT_COLUMNS:
+            for year in PERCENT_YEARS:
+                insert_data[f'{prefix}_year_{year}_percent'] = round(float(percent_list[prefix][year][k]), 2)
+        update_list.append(insert_data)
+
+    # 批量更新DB
+    up_query = text(UPDATE_TRADE_DATA_SQL.format(table_name=cur_table_name))
+    for batch_begin in range(0, len(update_list), UPDATE_BATCH_SIZE):
+        conn.execute(up_query, update_list[batch_begin:batch_begin + UPDATE_BATCH_SIZE])
+    save_watermark(cur_code, dates[-1], conn)
+    conn.commit()
+    # 提交后再保存窗口缓存，提交失败时缓存的水位和表中的不一致，下次从数据库读取
+    save_pe_window(cur_code, dates, columns)
+    logger.debug("更新分析后的数据: %s %s 条", cur_code, len(update_list))
+    return len(update_list)
     
 
+def get_pe_todo_list(divide_table_num, conn, backfill=False, codes=None):
+    """需要计算的股票[(code, 水位日期)]，按code排序
+    backfill: 重建codes（为空时整张分表）的全部行，水位日期为None
+    """
+    if backfill:
+        if codes is None:
+            return [(code, None) for code in get_shard_codes(divide_table_num, conn)]
+        return [(code, None) for code in sorted(codes) if code.endswith(str(divide_table_num))]
+    seed_watermarks(divide_table_num, conn)
+    todo_list = get_watermark_todo_list(divide_table_num, conn)
+    todo_list += [(code, None) for code in get_no_watermark_todo_codes(divide_table_num, conn)]
+    todo_list.sort()
+    if codes is not None:
+        codes = set(codes)
+        todo_list = [(code, last_date) for code, last_date in todo_list if code in codes]
+    return todo_list
+
 # 补充分析数据
-def gen_pe_data(divide_table_num=0, conn=None):
-    
+def gen_pe_data(divide_table_num=0, conn=None, backfill=False, codes=None):
+    """按水位增量计算分位值，耗时和新增的交易日数有关，和表的大小无关
+    backfill: 重建codes（为空时整张分表）的全部行
+    """
     # 如果没有传入连接，创建新连接
     own_conn = False
     if conn is None:
-        import stock_common
         conn = stock_common.get_db_conn(sql_echo=False)
         own_conn = True
 
-    # 获取pe为空的数据
     cur_table_name = f"""bao_stock_trade_{divide_table_num}"""
+    try:
+        todo_list = get_pe_todo_list(divide_table_num, conn, backfill=backfill, codes=codes)
+        if not todo_list:
+            logger.info(f"执行结束: {divide_table_num}表 无数据")
+            return 0
+
+        # 按股票逐只计算，每只股票一次读取，一次批量写回
+        done_count = 0
+        for index, (cur_code, last_date) in enumerate(todo_list):
+            done_count += gen_pe_data_by_code(cur_table_name=cur_table_name, cur_code=cur_code, conn=conn, last_date=last_date, backfill=backfill)
+            logger.info(f"执行结束: {divide_table_num}表，{index+1}/{len(todo_list)} {cur_code}，水位 {last_date}，己处理 {done_count}")
+
+        # 刷新这些股票的最新快照
+        f_stock_latest_snapshot.refresh_stock_latest_snapshot(conn, codes=[code for code, _ in todo_list], divide_table_nums=[divide_table_num])
+        return done_count
+    finally:
+        # 如果是自己创建的连接，关闭它
+        if own_conn:
+            conn.close()
+
+# 多进程计算时每个任务的股票数，按code分段，大分表拆成多个任务
+PE_TASK_CODES = 50
+# 失败任务的重试次数
+PE_TASK_RETRIES = 2
+
+def gen_pe_data_task(divide_table_num, todo_list, backfill=False):
+    """子进程执行的一个任务：一张分表中的一段股票，用本进程连接池的连接，返回处理的行数和耗时"""
+    start_time = time.time()
+    cur_table_name = f"""bao_stock_trade_{divide_table_num}"""
+    conn = stock_common.get_db_conn(sql_echo=False)
+    try:
+        done_count = 0
+        for cur_code, last_date in todo_list:
+            done_count += gen_pe_data_by_code(cur_table_name=cur_table_name, cur_code=cur_code, conn=conn, last_date=last_date, backfill=backfill)
+        # 刷新这些股票的最新快照
+        f_stock_latest_snapshot.refresh_stock_latest_snapshot(conn, codes=[code for code, _ in todo_list], divide_table_nums=[divide_table_num])
+    finally:
+        conn.close()
+    return {'row_count': done_count, 'seconds': round(time.time() - start_time, 2), 'pid': os.getpid()}
 
-    # 更新股票总市值
-    update_stock_total_market_value(table_name=cur_table_name, conn=conn)
-    logger.info(f"执行结束: {divide_table_num}表 更新股票总市值")
+def run_pe_tasks(tasks, task_indexes, workers, backfill=False):
+    """执行一轮任务，返回(成功的结果{任务序号: 结果}, 失败的任务序号)，每个任务完成时打印进度"""
+    results = {}
+    failed = []
 
-    total_count = get_stock_trade_total(table_name=cur_table_name, conn=conn)
-    if total_count == 0:
-        logger.info(f"执行结束: {divide_table_num}表 无数据")
-        return
+    def task_name(index):
+        divide_table_num, todo_list = tasks[index]
+        return f"{divide_table_num}表 {todo_list[0][0]}~{todo_list[-1][0]} {len(todo_list)}只股票"
 
-    done_count = 0
-    while True:
-        trade_data_list = get_stock_trade_page(table_name=cur_table_name, page_num=1, page_size=10, conn=conn)
-        if trade_data_list is None or len(trade_data_list) < 1:
-            # 无数据，结束
-            logger.info(f"执行结束: {divide_table_num}表 无数据")
-            break
-        # 开始循环更新
-        for item in trade_data_list:
-            cur_date_str = item.date.strftime("%Y-%m-%d")
-            single_update_trade_data(cur_table_name=cur_table_name, cur_code=item.code, cur_date_str=cur_date_str, cur_open_price=item.open, conn=conn)
-        # 每批次提交一次DB
-        conn.commit()
-        done_count += len(trade_data_list)
-        logger.info(f"执行结束: {divide_table_num}表，己处理 {done_count} / {total_count}, {trade_data_list[0].id} {trade_data_list[0].code} {trade_data_list[0].date}")
-    
-    # 如果是自己创建的连接，关闭它
-    if own_conn:
+    def finish(index, get_result):
+        try:
+            results[index] = get_result()
+            logger.info(f"任务完成 {len(results)}/{len(task_indexes)}: {task_name(index)}，"
+                        f"{results[index]['row_count']}行，耗时{results[index]['seconds']}秒，进程{results[index]['pid']}")
+        except Exception as e:
+            failed.append(index)
+            logger.error(f"任务失败: {task_name(index)}，{e}")
+
+    if workers > 1 and len(task_indexes) > 1:
+        # 子进程先丢掉从父进程继承的连接池，各自建自己的连接池
+        with ProcessPoolExecutor(max_workers=workers, initializer=stock_common.dispose_engines) as executor:
+            futures = {executor.submit(gen_pe_data_task, tasks[index][0], tasks[index][1], backfill): index for index in task_indexes}
+            for future in as_completed(futures):
+                finish(futures[future], future.result)
+    else:
+        for index in task_indexes:
+            finish(index, lambda: gen_pe_data_task(tasks[index][0], tasks[index][1], backfill))
+    return results, sorted(failed)
+
+def run_pe_data_parallel(workers=None, backfill=False, codes=None, divide_table_nums=range(0, 10, 1),
+                         task_codes=PE_TASK_CODES, retries=PE_TASK_RETRIES):
+    """多进程计算全部分表的分位值，按(分表, code段)拆分任务，失败的任务重试，已完成的不再执行
+    返回 {'task_count', 'row_count', 'failed': [失败任务说明], 'seconds'}
+    """
+    start_time = time.time()
+    conn = stock_common.get_db_conn(sql_echo=False)
+    try:
+        tasks = []
+        for divide_table_num in divide_table_nums:
+            todo_list = get_pe_todo_list(divide_table_num, conn, backfill=backfill, codes=codes)
+            for task_begin in range(0, len(todo_list), task_codes):
+                tasks.append((divide_table_num, todo_list[task_begin:task_begin + task_codes]))
+    finally:
         conn.close()
 
+    workers = workers or os.cpu_count() or 1
+    logger.info(f"计算pe分位值：{len(tasks)}个任务，{workers}个进程")
+    results = {}
+    pending = list(range(len(tasks)))
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt > 0:
+            logger.warning(f"{len(pending)}个任务失败，第{attempt}次重试")
+        round_results, pending = run_pe_tasks(tasks, pending, workers, backfill=backfill)
+        results.update(round_results)
+
+    summary = {
+        'task_count': len(tasks),
+        'row_count': sum(result['row_count'] for result in results.values()),
+        'failed': [f"{tasks[index][0]}表 {tasks[index][1][0][0]}~{tasks[index][1][-1][0]}" for index in pending],
+        'seconds': round(time.time() - start_time, 2),
+    }
+    if summary['failed']:
+        logger.error(f"计算pe分位值有{len(summary['failed'])}个任务重试后仍失败: {summary['failed']}")
+    logger.info(f"计算pe分位值完成：{summary['task_count']}个任务，{summary['row_count']}行，耗时{summary['seconds']}秒")
+    return summary
+
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='bao_stock_trade表分位值、换手率、股息率增量计算')
+    parser.add_argument('--backfill', action='store_true', help='全部重算，不按水位')
+    parser.add_argument('--codes', nargs='*', default=None, help='只计算这些股票')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认CPU核数')
+    args = parser.parse_args()
     logger.info("开始补充bao_stock_trade表pe数据...")
-    
-    for divide_table_num in range(0, 10, 1):
-        conn = stock_common.get_db_conn(sql_echo=False)
-        # 创建并启动线程
-        t = threading.Thread(
-            target=gen_pe_data,
-            args=(divide_table_num, conn),
-            name=f"pe数据生成线程-{divide_table_num}"
-        )
-        t.start()
-        logger.info(f"启动线程执行gen_pe_data(divide_table_num={divide_table_num})...")
-        #conn.close()
-    #t.join()  # 等待所有线程完成
-    #conn.close()
 
+    divide_table_nums = range(0, 10, 1)
+    if args.codes:
+        divide_table_nums = sorted({int(code[-1]) for code in args.codes})
+    run_pe_data_parallel(workers=args.workers, backfill=args.backfill, codes=args.codes, divide_table_nums=divide_table_nums)
+    logger.info("补充bao_stock_trade表pe数据完成！")
@@ -1,6 +1,9 @@
 import sys
 import os
-from sqlalchemy import text
+import json
+from types import SimpleNamespace
+import pandas as pd
+from sqlalchemy import text, bindparam
 
 # 获取当前脚本的绝对路径并向上回溯到根目录
 root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -15,132 +18,163 @@ import logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 获取行业所有股票代码
-def get_industry_stocks(conn, industry):
-    sql = f"""SELECT code, code_name FROM bao_stock_basic WHERE industry = :industry AND status = '1' ORDER BY code ASC"""
-    results = conn.execute(text(sql), {'industry': industry}).fetchall()
-    return [(row.code, row.code_name) for row in results]
-
-# 获取股票最新交易数据（根据code最后一位直接查询对应表）
-def get_latest_trade_data(conn, code):
-    table_name = f"bao_stock_trade_{code[-1]}"
-    sql = f"""SELECT code, date, total_market_value, pe_year_1_percent, pe_year_3_percent, pe_year_5_percent, pe_year_10_percent,
-               ps_year_1_percent, ps_year_3_percent, ps_year_5_percent, ps_year_10_percent
-               FROM {table_name} WHERE code = :code ORDER BY date DESC LIMIT 1"""
-    result = conn.execute(text(sql), {'code': code}).fetchone()
-    return result
+# PE/PS分位值字段
+FUND_PERCENT_COLUMNS = ['pe_year_1_percent', 'pe_year_3_percent', 'pe_year_5_percent', 'pe_year_10_percent',
+                        'ps_year_1_percent', 'ps_year_3_percent', 'ps_year_5_percent', 'ps_year_10_percent']
+# 每个行业取总市值TOP N的股票
+FUND_TOP_NUM = 10
+
+FUND_ANA_UPSERT_SQL = """INSERT INTO fund_ana (industry, all_stock, top_stock, pe_year_1_percent, pe_year_3_percent, pe_year_5_percent, pe_year_10_percent,
+                ps_year_1_percent, ps_year_3_percent, ps_year_5_percent, ps_year_10_percent, created_at, updated_at)
+                VALUES (:industry, :all_stock, :top_stock, :pe_year_1_percent, :pe_year_3_percent, :pe_year_5_percent, :pe_year_10_percent,
+                :ps_year_1_percent, :ps_year_3_percent, :ps_year_5_percent, :ps_year_10_percent, NOW(), NOW())
+                ON DUPLICATE KEY UPDATE 
+                all_stock = VALUES(all_stock),
+                top_stock = VALUES(top_stock),
+                pe_year_1_percent = VALUES(pe_year_1_percent),
+                pe_year_3_percent = VALUES(pe_year_3_percent),
+                pe_year_5_percent = VALUES(pe_year_5_percent),
+                pe_year_10_percent = VALUES(pe_year_10_percent),
+                ps_year_1_percent = VALUES(ps_year_1_percent),
+                ps_year_3_percent = VALUES(ps_year_3_percent),
+                ps_year_5_percent = VALUES(ps_year_5_percent),
+                ps_year_10_percent = VALUES(ps_year_10_percent),
+                updated_at = NOW()"""
+
+# 所有行业的上市股票，和最新交易数据（stock_latest_snapshot快照表），一次查询
+def get_industry_stock_frame(conn):
+    sql = f"""SELECT b.industry, b.code, b.code_name, s.total_market_value, {', '.join(f's.{column}' for column in FUND_PERCENT_COLUMNS)}
+               FROM bao_stock_basic b LEFT JOIN stock_latest_snapshot s ON b.code = s.code
+               WHERE b.industry IS NOT NULL AND b.industry <> '' AND b.status = '1'
+               ORDER BY b.industry ASC, b.code ASC"""
+    results = conn.execute(text(sql)).fetchall()
+    return pd.DataFrame(results, columns=['industry', 'code', 'code_name', 'total_market_value'] + FUND_PERCENT_COLUMNS)
+
+def mean_not_null(values):
+    # 过滤NULL值后求平均，分位值是Decimal，保持原来的计算方式
+    values = [value for value in values if value is not None and not pd.isna(value)]
+    return sum(values) / len(values) if values else None
+
+def build_fund_ana_rows(df):
+    """按行业分组：全部股票代码、总市值TOP10股票代码、TOP10的PE/PS分位值平均值"""
+    # 过滤掉名称包含"ST"的股票
+    df = df[~df['code_name'].fillna('').str.contains('ST', regex=False)]
+    if df.empty:
+        return []
+    all_stock = df.groupby('industry', sort=True)['code'].agg(','.join)
+
+    # 有总市值的股票，按总市值从大到小排序，市值相同按代码排序，取TOP 10
+    trade_df = df[df['total_market_value'].notna() & (df['total_market_value'] != 0)]
+    trade_df = trade_df.sort_values(['industry', 'total_market_value', 'code'], ascending=[True, False, True])
+    top_df = trade_df.groupby('industry', sort=True).head(FUND_TOP_NUM)
+    top_group = top_df.groupby('industry', sort=True)
+    top_stock = top_group['code'].agg(','.join)
+    percent_means = top_group[FUND_PERCENT_COLUMNS].agg(mean_not_null)
+
+    rows = []
+    for industry in all_stock.index:
+        if industry not in top_stock.index:
+            logger.warning(f"行业 {industry} 没有交易数据，跳过")
+            continue
+        row = {'industry': industry, 'all_stock': all_stock[industry], 'top_stock': top_stock[industry]}
+        for column in FUND_PERCENT_COLUMNS:
+            value = percent_means.at[industry, column]
+            row[column] = None if value is None or pd.isna(value) else value
+        rows.append(row)
+        logger.debug(f"行业 {industry} TOP 10股票: {row['top_stock']}")
+    return rows
 
 # 生成行业分析数据
 def fund_ana_data_gen():
     conn = stock_common.get_db_conn(sql_echo=False)
     try:
-        # 查询所有行业
-        sql = """SELECT DISTINCT industry FROM bao_stock_basic WHERE industry IS NOT NULL AND industry <> '' ORDER BY industry"""
-        industries = conn.execute(text(sql)).fetchall()
-        
-        logger.info(f"共找到 {len(industries)} 个行业")
-        
-        for industry_row in industries:
-            industry = industry_row.industry
-            logger.info(f"开始处理行业: {industry}")
-            
-            # 获取该行业的所有股票代码和名称
-            codes_with_names = get_industry_stocks(conn, industry)
-            
-            # 过滤掉名称包含"ST"的股票
-            codes_with_names = [(code, code_name) for code, code_name in codes_with_names if 'ST' not in code_name]
-            
-            if not codes_with_names:
-                logger.warning(f"行业 {industry} 没有股票数据，跳过")
-                continue
-            
-            codes = [code for code, code_name in codes_with_names]
-            
-            # 生成all_stock字段（逗号分隔的代码）
-            all_stock = ','.join(codes)
-            logger.info(f"行业 {industry} 共有 {len(codes)} 只股票（已排除ST股票）")
-            
-            # 查询所有股票的最新交易数据
-            stock_data_list = []
-            for code, code_name in codes_with_names:
-                latest_data = get_latest_trade_data(conn, code)
-                if latest_data and latest_data.total_market_value:
-                    stock_data_list.append(latest_data)
-            
-            if not stock_data_list:
-                logger.warning(f"行业 {industry} 没有交易数据，跳过")
-                continue
-            
-            # 按总市值排序，取TOP 10
-            stock_data_list.sort(key=lambda x: x.total_market_value, reverse=True)
-            top_stocks = [data.code for data in stock_data_list[:10]]
-            top_stock = ','.join(top_stocks)
-            logger.info(f"行业 {industry} TOP 10股票: {top_stock}")
-            
-            # 计算PE分位值平均值（只取TOP 10股票，过滤NULL值）
-            pe_1_values = [data.pe_year_1_percent for data in stock_data_list[:10] if data.pe_year_1_percent is not None]
-            pe_3_values = [data.pe_year_3_percent for data in stock_data_list[:10] if data.pe_year_3_percent is not None]
-            pe_5_values = [data.pe_year_5_percent for data in stock_data_list[:10] if data.pe_year_5_percent is not None]
-            pe_10_values = [data.pe_year_10_percent for data in stock_data_list[:10] if data.pe_year_10_percent is not None]
-            
-            pe_year_1_percent = sum(pe_1_values) / len(pe_1_values) if pe_1_values else None
-            pe_year_3_percent = sum(pe_3_values) / len(pe_3_values) if pe_3_values else None
-            pe_year_5_percent = sum(pe_5_values) / len(pe_5_values) if pe_5_values else None
-            pe_year_10_percent = sum(pe_10_values) / len(pe_10_values) if pe_10_values else None
-            
-            # 计算PS分位值平均值（只取TOP 10股票，过滤NULL值）
-            ps_1_values = [data.ps_year_1_percent for data in stock_data_list[:10] if data.ps_year_1_percent is not None]
-            ps_3_values = [data.ps_year_3_percent for data in stock_data_list[:10] if data.ps_year_3_percent is not None]
-            ps_5_values = [data.ps_year_5_percent for data in stock_data_list[:10] if data.ps_year_5_percent is not None]
-            ps_10_values = [data.ps_year_10_percent for data in stock_data_list[:10] if data.ps_year_10_percent is not None]
-            
-            ps_year_1_percent = sum(ps_1_values) / len(ps_1_values) if ps_1_values else None
-            ps_year_3_percent = sum(ps_3_values) / len(ps_3_values) if ps_3_values else None
-            ps_year_5_percent = sum(ps_5_values) / len(ps_5_values) if ps_5_values else None
-            ps_year_10_percent = sum(ps_10_values) / len(ps_10_values) if ps_10_values else None
-            
-            logger.info(f"行业 {industry} PE分位值平均值 - 1年: {pe_year_1_percent}, 3年: {pe_year_3_percent}, 5年: {pe_year_5_percent}, 10年: {pe_year_10_percent}")
-            logger.info(f"行业 {industry} PS分位值平均值 - 1年: {ps_year_1_percent}, 3年: {ps_year_3_percent}, 5年: {ps_year_5_percent}, 10年: {ps_year_10_percent}")
-            
-            # 使用INSERT ... ON DUPLICATE KEY UPDATE写入数据
-            upsert_sql = """INSERT INTO fund_ana (industry, all_stock, top_stock, pe_year_1_percent, pe_year_3_percent, pe_year_5_percent, pe_year_10_percent,
-                            ps_year_1_percent, ps_year_3_percent, ps_year_5_percent, ps_year_10_percent, created_at, updated_at)
-                            VALUES (:industry, :all_stock, :top_stock, :pe_year_1_percent, :pe_year_3_percent, :pe_year_5_percent, :pe_year_10_percent,
-                            :ps_year_1_percent, :ps_year_3_percent, :ps_year_5_percent, :ps_year_10_percent, NOW(), NOW())
-                            ON DUPLICATE KEY UPDATE 
-                            all_stock = VALUES(all_stock),
-                            top_stock = VALUES(top_stock),
-                            pe_year_1_percent = VALUES(pe_year_1_percent),
-                            pe_year_3_percent = VALUES(pe_year_3_percent),
-                            pe_year_5_percent = VALUES(pe_year_5_percent),
-                            pe_year_10_percent = VALUES(pe_year_10_percent),
-                            ps_year_1_percent = VALUES(ps_year_1_percent),
-                            ps_year_3_percent = VALUES(ps_year_3_percent),
-                            ps_year_5_percent = VALUES(ps_year_5_percent),
-                            ps_year_10_percent = VALUES(ps_year_10_percent),
-                            updated_at = NOW()"""
-            
-            conn.execute(text(upsert_sql), {
-                'industry': industry,
-                'all_stock': all_stock,
-                'top_stock': top_stock,
-                'pe_year_1_percent': pe_year_1_percent,
-                'pe_year_3_percent': pe_year_3_percent,
-                'pe_year_5_percent': pe_year_5_percent,
-                'pe_year_10_percent': pe_year_10_percent,
-                'ps_year_1_percent': ps_year_1_percent,
-                'ps_year_3_percent': ps_year_3_percent,
-                'ps_year_5_percent': ps_year_5_percent,
-                'ps_year_10_percent': ps_year_10_percent
-            })
+        df = get_industry_stock_frame(conn)
+        logger.info(f"共找到 {df['industry'].nunique()} 个行业，{len(df)} 只股票")
+
+        rows = build_fund_ana_rows(df)
+        if rows:
+            # 一次批量写入，INSERT ... ON DUPLICATE KEY UPDATE
+            conn.execute(text(FUND_ANA_UPSERT_SQL), rows)
             conn.commit()
-            
-            logger.info(f"行业 {industry} 数据更新完成")
         
-        logger.info("所有行业数据生成完成！")
+        logger.info(f"所有行业数据生成完成！共 {len(rows)} 个行业")
+
+        # 行业按自动标签分组的数据
+        fund_ana_cohort_gen(conn)
     finally:
         conn.close()
 
+# 按自动标签分组的股票：(字段前缀, 标签, 只取市值TOP N，None为全部)
+FUND_COHORTS = [('fenghong_3', '3股息', None), ('growth_15', '15成长', None),
+                ('growth_5', '5成长大股', FUND_TOP_NUM), ('fenghong_1_growth_5', '1股息5成长', FUND_TOP_NUM)]
+# 计算PE/PS分位值平均值的分组和字段
+FUND_COHORT_MEAN_PREFIXES = ['fenghong_3', 'growth_15']
+FUND_COHORT_PERCENT_COLUMNS = ['pe_year_1_percent', 'pe_year_3_percent', 'pe_year_5_percent',
+                               'ps_year_1_percent', 'ps_year_3_percent', 'ps_year_5_percent']
+FUND_COHORT_COLUMNS = [f'{prefix}_stock' for prefix, _, _ in FUND_COHORTS] + \
+    [f'{prefix}_{column}' for prefix in FUND_COHORT_MEAN_PREFIXES for column in FUND_COHORT_PERCENT_COLUMNS]
+
+def build_fund_ana_cohort_rows(stocks, snapshot_map):
+    """stocks: 上市股票(industry, code, auto_tags, total_market_value)，按id排序；snapshot_map: {code: 最新日K}"""
+    stocks_by_industry = {}
+    for stock in stocks:
+        stocks_by_industry.setdefault(stock.industry, []).append(stock)
+
+    rows = []
+    for industry, industry_stocks in stocks_by_industry.items():
+        if not industry:
+            continue
+        row = {'industry': industry}
+        for prefix, tag, top_num in FUND_COHORTS:
+            cohort = [stock for stock in industry_stocks if stock.auto_tags and tag in stock.auto_tags]
+            # 按市值倒序排序
+            cohort.sort(key=lambda x: x.total_market_value or 0, reverse=True)
+            if top_num:
+                cohort = cohort[:top_num]
+            codes = [stock.code for stock in cohort]
+            row[f'{prefix}_stock'] = ','.join(codes) if codes else None
+
+            if prefix in FUND_COHORT_MEAN_PREFIXES:
+                # PE/PS分位值平均值，过滤NULL值
+                for column in FUND_COHORT_PERCENT_COLUMNS:
+                    values = [getattr(snapshot_map[code], column) for code in codes
+                              if code in snapshot_map and getattr(snapshot_map[code], column) is not None]
+                    row[f'{prefix}_{column}'] = sum(values) / len(values) if values else None
+        rows.append(row)
+    return rows
+
+# 生成行业按自动标签分组的数据，自动标签或者日K分位值更新后执行
+def fund_ana_cohort_gen(conn=None):
+    own_conn = False
+    if conn is None:
+        conn = stock_common.get_db_conn(sql_echo=False)
+        own_conn = True
+    try:
+        sql = """SELECT industry, code, auto_tags, total_market_value FROM bao_stock_basic WHERE status = '1' ORDER BY id ASC"""
+        stocks = []
+        for item in conn.execute(text(sql)).fetchall():
+            auto_tags = json.loads(item.auto_tags) if isinstance(item.auto_tags, str) and item.auto_tags else item.auto_tags
+            stocks.append(SimpleNamespace(industry=item.industry, code=item.code, auto_tags=auto_tags, total_market_value=item.total_market_value))
+        snapshot_map = stock_common.get_latest_snapshot_map(conn)
+
+        rows = build_fund_ana_cohort_rows(stocks, snapshot_map)
+        if rows:
+            update_sql = ',\n'.join(f'{column} = VALUES({column})' for column in FUND_COHORT_COLUMNS)
+            upsert_sql = f"""INSERT INTO fund_ana_cohort (industry, {', '.join(FUND_COHORT_COLUMNS)})
+                VALUES (:industry, {', '.join(f':{column}' for column in FUND_COHORT_COLUMNS)})
+                ON DUPLICATE KEY UPDATE
+                {update_sql}"""
+            conn.execute(text(upsert_sql), rows)
+            # 已经没有上市股票的行业删除
+            delete_sql = text("DELETE FROM fund_ana_cohort WHERE industry NOT IN :industries").bindparams(bindparam('industries', expanding=True))
+            conn.execute(delete_sql, {'industries': [row['industry'] for row in rows]})
+            conn.commit()
+        logger.info(f"fund_ana_cohort 生成完成，共 {len(rows)} 个行业")
+        return len(rows)
+    finally:
+        if own_conn:
+            conn.close()
+
 if __name__ == "__main__":
     logger.info("开始生成行业分析数据...")
     fund_ana_data_gen()
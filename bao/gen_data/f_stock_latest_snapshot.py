@@ -0,0 +1,84 @@
+import sys
+import os
+from sqlalchemy import text, bindparam
+
+# 获取当前脚本的绝对路径并向上回溯到根目录
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(root_path)  # 添加根目录到搜索路径
+sys.path.append(root_path + '/api')
+import stock_common
+
+# 配置logger
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+""" stock_latest_snapshot 每只股票最新一条日K，从bao_stock_trade_0到9汇总。
+日K获取完、pe分位值计算完后增量刷新，读最新数据的地方都查这张表。"""
+
+SNAPSHOT_COLUMNS = ['date', 'open', 'close', 'peTTM', 'pbMRQ', 'psTTM', 'pcfNcfTTM', 'isST',
+                    'pe_year_1_percent', 'pe_year_3_percent', 'pe_year_5_percent', 'pe_year_10_percent',
+                    'pb_year_1_percent', 'pb_year_3_percent', 'pb_year_5_percent', 'pb_year_10_percent',
+                    'ps_year_1_percent', 'ps_year_3_percent', 'ps_year_5_percent', 'ps_year_10_percent',
+                    'pcf_year_1_percent', 'pcf_year_3_percent', 'pcf_year_5_percent', 'pcf_year_10_percent',
+                    'stock_fenghong_percent', 'turn_percent_5', 'turn_percent_15', 'turn_percent_30', 'total_market_value']
+
+# 快照中最新的日期，没有数据返回None
+def get_snapshot_latest_date(conn):
+    result = conn.execute(text("SELECT MAX(date) FROM stock_latest_snapshot")).fetchone()
+    return result[0] if result else None
+
+def refresh_stock_latest_snapshot(conn, codes=None, since_date=None, divide_table_nums=range(0, 10, 1)):
+    """刷新快照
+    codes: 只刷新这些股票，为空刷新全部
+    since_date: 只刷新在这天及之后有日K的股票，日K增量获取后使用
+    divide_table_nums: 只刷新这些分表
+    """
+    insert_columns = ', '.join(['code'] + SNAPSHOT_COLUMNS)
+    select_columns = ', '.join(['t.code'] + [f't.{column}' for column in SNAPSHOT_COLUMNS])
+    update_columns = ',\n'.join([f'{column} = VALUES({column})' for column in SNAPSHOT_COLUMNS])
+
+    total_count = 0
+    for divide_table_num in divide_table_nums:
+        table_name = f"bao_stock_trade_{divide_table_num}"
+        where_list = []
+        params = {}
+        if codes is not None:
+            table_codes = [code for code in codes if code[-1] == str(divide_table_num)]
+            if not table_codes:
+                continue
+            where_list.append("code IN :codes")
+            params['codes'] = table_codes
+        if since_date is not None:
+            # 有新日K的股票，新日K里的最大日期就是最新日期
+            where_list.append("date >= :since_date")
+            params['since_date'] = since_date
+        where_sql = ("WHERE " + " AND ".join(where_list)) if where_list else ""
+
+        sql = text(f"""INSERT INTO stock_latest_snapshot ({insert_columns})
+                SELECT {select_columns} FROM {table_name} t
+                INNER JOIN (
+                    SELECT code, MAX(date) as max_date
+                    FROM {table_name}
+                    {where_sql}
+                    GROUP BY code
+                ) latest ON t.code = latest.code AND t.date = latest.max_date
+                ON DUPLICATE KEY UPDATE
+                {update_columns}""")
+        if codes is not None:
+            sql = sql.bindparams(bindparam('codes', expanding=True))
+        result = conn.execute(sql, params)
+        conn.commit()
+        total_count += result.rowcount
+        logger.debug(f"{table_name} 刷新快照 {result.rowcount}")
+
+    logger.info(f"stock_latest_snapshot 刷新完成，影响行数 {total_count}")
+    return total_count
+
+
+if __name__ == "__main__":
+    logger.info("开始刷新stock_latest_snapshot...")
+    conn = stock_common.get_db_conn(sql_echo=False)
+    refresh_stock_latest_snapshot(conn)
+    conn.close()
+    logger.info("刷新stock_latest_snapshot完成！")
@@ -1,4 +1,3 @@
-import datetime
 import sys
 import os
 from sqlalchemy import text
@@ -18,68 +17,74 @@ logger = logging.getLogger(__name__)
 
 """ 开始补分红数据
 如果分红数据有错，则将分红数据置null。再在这里重新跑即可
-pe_year_1_percent is not null and stock_fenghong_percent is null """
+pe_year_1_percent is not null and stock_fenghong_percent is null
+only_null=False 时重算表中全部行，分红数据更新后使用 """
 
-def get_fh_trade_page(table_name, page_num, page_size, conn):
-    offset = (page_num - 1) * page_size
-    sql = f"SELECT * FROM {table_name} where pe_year_1_percent is not null and stock_fenghong_percent is null order by code asc, date asc LIMIT {offset}, {page_size}"
-    results = conn.execute(text(sql)).fetchall()
-    return results
+UPDATE_FH_SQL = """update {table_name} set stock_fenghong_percent = :stock_fenghong_percent
+                    where code = :code and date = :date"""
+
+TODO_WHERE_SQL = "pe_year_1_percent is not null and stock_fenghong_percent is null"
 
-def get_fh_trade_total(table_name, conn):
-    sql = f"SELECT count(*) FROM {table_name} where pe_year_1_percent is not null and stock_fenghong_percent is null"
+def get_fh_trade_total(table_name, conn, only_null=True):
+    where_sql = f"where {TODO_WHERE_SQL}" if only_null else ""
+    sql = f"SELECT count(*) FROM {table_name} {where_sql}"
     results = conn.execute(text(sql)).fetchone()
     return results[0]
 
+def get_fh_todo_codes(table_name, conn, only_null=True):
+    where_sql = f"where {TODO_WHERE_SQL}" if only_null else ""
+    sql = f"SELECT DISTINCT code FROM {table_name} {where_sql} order by code asc"
+    results = conn.execute(text(sql)).fetchall()
+    return [item.code for item in results]
 
-def single_update_fh_trade_data(cur_table_name, cur_code, cur_date_str, cur_open_price, conn):
-    stock_fenghong_percent = None
-    # 股息率 最近一年分红/开盘价*100
-    if cur_open_price is None or cur_open_price == 0:
-        stock_fenghong_percent = 0
-    else:
-        stock_fenghong_percent = b_trade_pe1year_dividend.get_fenhong_percent(cur_code, cur_date_str, cur_open_price, conn)
+def update_fh_data_by_code(cur_table_name, cur_code, conn, only_null=True):
+    """单只股票的分红一次读取，按交易日计算股息率，批量写回"""
+    where_sql = f"and {TODO_WHERE_SQL}" if only_null else ""
+    sql = f"SELECT date, open FROM {cur_table_name} where code = :code {where_sql} order by date asc"
+    trade_data_list = conn.execute(text(sql), {'code': cur_code}).fetchall()
+    if not trade_data_list:
+        return 0
 
-    # 更新DB 股票信息，有则更新，无则新增
-    sql = f"""update {cur_table_name} set stock_fenghong_percent = {stock_fenghong_percent}
-                    where code = '{cur_code}' and date = '{cur_date_str}'"""
-    conn.execute(text(sql))
-    conn.commit()  # 提交连接层面的事务
+    event_dates, event_cash = b_trade_pe1year_dividend.get_dividend_events(cur_code, conn)
+    fenghong_list = b_trade_pe1year_dividend.get_fenhong_percent_list(
+        [item.date for item in trade_data_list], [item.open for item in trade_data_list], event_dates, event_cash)
+    update_list = [{'code': cur_code, 'date': item.date.strftime("%Y-%m-%d"), 'stock_fenghong_percent': fenghong_list[index]}
+                   for index, item in enumerate(trade_data_list)]
 
-    logger.debug("更新分析后的数据: %s %s %s", cur_table_name, cur_code, cur_date_str)
+    up_query = text(UPDATE_FH_SQL.format(table_name=cur_table_name))
+    batch_size = b_trade_pe1year_dividend.UPDATE_BATCH_SIZE
+    for batch_begin in range(0, len(update_list), batch_size):
+        conn.execute(up_query, update_list[batch_begin:batch_begin + batch_size])
+    conn.commit()
+    logger.debug("更新股息率: %s %s %s 条", cur_table_name, cur_code, len(update_list))
+    return len(update_list)
 
 # 补充分红数据
-def gen_fh_data(divide_table_num=0, conn=None):
+def gen_fh_data(divide_table_num=0, conn=None, only_null=True):
     # 获取fenghong为空的数据
     cur_table_name = f"""bao_stock_trade_{divide_table_num}"""
 
-    total_count = get_fh_trade_total(table_name=cur_table_name, conn=conn)
+    total_count = get_fh_trade_total(table_name=cur_table_name, conn=conn, only_null=only_null)
     if total_count == 0:
         logger.info(f"执行结束: {divide_table_num}表 无数据")
         return
 
+    # 按股票逐只计算，每只股票的分红只查一次
+    codes = get_fh_todo_codes(table_name=cur_table_name, conn=conn, only_null=only_null)
     done_count = 0
-    while True:
-        trade_data_list = get_fh_trade_page(table_name=cur_table_name, page_num=1, page_size=10, conn=conn)
-        if trade_data_list is None or len(trade_data_list) < 1:
-            # 无数据，结束
-            logger.info(f"执行结束: {divide_table_num}表 {done_count} / {total_count}")
-            break
-        # 开始循环更新
-        for item in trade_data_list:
-            cur_date_str = datetime.datetime.strptime(item.date, '%Y-%m-%d').strftime('%Y-%m-%d')
-            single_update_fh_trade_data(cur_table_name=cur_table_name, cur_code=item.code, cur_date_str=cur_date_str, cur_open_price=item.open, conn=conn)
-        # 每批次提交一次DB
-        conn.commit()
-        done_count += len(trade_data_list)
-        logger.info(f"执行: {divide_table_num}表 {done_count} / {total_count} 提交DB")
-     
+    for index, cur_code in enumerate(codes):
+        done_count += update_fh_data_by_code(cur_table_name=cur_table_name, cur_code=cur_code, conn=conn, only_null=only_null)
+        logger.info(f"执行: {divide_table_num}表，{index+1}/{len(codes)} {cur_code}，己处理 {done_count} / {total_count}")
+    logger.info(f"执行结束: {divide_table_num}表 {done_count} / {total_count}")
+
 
 if __name__ == "__main__":
     logger.info("开始补充bao_stock_trade表fenghong数据...")
+    # --all 重算全部行，默认只补stock_fenghong_percent为空的行
+    only_null = '--all' not in sys.argv
     conn = stock_common.get_db_conn(sql_echo=False)
     # 补充fenghong百分比数据
     for divide_table_num in range(0, 10, 1):
-       gen_fh_data(divide_table_num=divide_table_num, conn=conn)
+       gen_fh_data(divide_table_num=divide_table_num, conn=conn, only_null=only_null)
     conn.close()
     logger.info("补充bao_stock_trade表fenghong数据完成！")
@@ -9,7 +9,7 @@ sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 import stock_common
 sys.path.append(root_path + '/bao/gen_data')
-import gen_pe1year_bao_stock_trade2
+import b_trade_pe1year_dividend
 
 # 配置logger
 import logging
@@ -18,75 +18,90 @@ logger = logging.getLogger(__name__)
 
 """ 开始补turn换手率数据
 如果换手率数据有错，则将换手率turn_percent_5置null。再在这里重新跑即可
-pe_year_1_percent is not null and turn_percent_5 is null """
+pe_year_1_percent is not null and turn_percent_5 is null
+only_null=False 时重算表中全部行 """
 
-def get_turn_trade_page(table_name, page_num, page_size, conn):
-    offset = (page_num - 1) * page_size
-    query = f"SELECT * FROM {table_name} where pe_year_1_percent is not null and turn_percent_5 is null order by code asc, date asc LIMIT {offset}, {page_size}"
-    results = conn.execute(text(query)).fetchall()
-    return results
+UPDATE_TURN_SQL = """update {table_name} set turn_percent_5 = :turn_percent_5, turn_percent_15 = :turn_percent_15, turn_percent_30 = :turn_percent_30
+                    where code = :code and date = :date"""
+
+TODO_WHERE_SQL = "pe_year_1_percent is not null and turn_percent_5 is null"
 
-def get_turn_trade_total(table_name, conn):
-    query = f"SELECT count(*) FROM {table_name} where pe_year_1_percent is not null and turn_percent_5 is null"
+def get_turn_trade_total(table_name, conn, only_null=True):
+    where_sql = f"where {TODO_WHERE_SQL}" if only_null else ""
+    query = f"SELECT count(*) FROM {table_name} {where_sql}"
     results = conn.execute(text(query)).fetchone()
     return results[0]
 
-def single_update_turn_data(cur_table_name, cur_code, cur_date_str, conn):
-    # 近5天换手率
-    turn_percent_5 = b_trade_pe1year.get_stock_trade_turn(cur_table_name, cur_code, cur_date_str, 5, conn)
-    # 近15天换手率
-    turn_percent_15 = b_trade_pe1year.get_stock_trade_turn(cur_table_name, cur_code, cur_date_str, 15, conn)
-    # 近30天换手率
-    turn_percent_30 = b_trade_pe1year.get_stock_trade_turn(cur_table_name, cur_code, cur_date_str, 30, conn)
-    
-    # 更新DB 股票信息，有则更新，无则新增
-    sql = f"""update {cur_table_name} set turn_percent_5 = {turn_percent_5}, turn_percent_15 = {turn_percent_15}, turn_percent_30 = {turn_percent_30}
-                    where code = '{cur_code}' and date = '{cur_date_str}'"""
-    conn.execute(text(sql))
-    conn.commit()
+def get_turn_todo_codes(table_name, conn, only_null=True):
+    where_sql = f"where {TODO_WHERE_SQL}" if only_null else ""
+    query = f"SELECT DISTINCT code FROM {table_name} {where_sql} order by code asc"
+    results = conn.execute(text(query)).fetchall()
+    return [item.code for item in results]
 
-    logger.debug("更新分析后的数据: %s %s" % (cur_code, cur_date_str))
+def update_turn_data_by_code(cur_table_name, cur_code, conn, only_null=True):
+    """一次读取单只股票的全部换手率，累加计算近5/15/30天换手率，批量写回"""
+    sql = f"""SELECT date, turn, ({TODO_WHERE_SQL}) as todo
+              FROM {cur_table_name} where code = :code order by date asc"""
+    history_data = conn.execute(text(sql), {'code': cur_code}).fetchall()
+    if not history_data:
+        return 0
+
+    turn_list = b_trade_pe1year_dividend.rolling_turn_sums([item.turn for item in history_data])
+    update_list = []
+    for index, item in enumerate(history_data):
+        if only_null and not item.todo:
+            continue
+        update_data = {'code': cur_code, 'date': item.date.strftime("%Y-%m-%d")}
+        for days in b_trade_pe1year_dividend.TURN_DAYS:
+            update_data[f'turn_percent_{days}'] = float(turn_list[days][index])
+        update_list.append(update_data)
+    if not update_list:
+        return 0
+
+    up_query = text(UPDATE_TURN_SQL.format(table_name=cur_table_name))
+    batch_size = b_trade_pe1year_dividend.UPDATE_BATCH_SIZE
+    for batch_begin in range(0, len(update_list), batch_size):
+        conn.execute(up_query, update_list[batch_begin:batch_begin + batch_size])
+    conn.commit()
+    logger.debug("更新换手率: %s %s 条", cur_code, len(update_list))
+    return len(update_list)
 
 
 # 补充turn换手率数据
-def gen_turn_data(divide_table_num=0, conn=None):
-    # 获取turn为空的数据
+def gen_turn_data(divide_table_num=0, conn=None, only_null=True):
     cur_table_name = f"""bao_stock_trade_{divide_table_num}"""
 
-    total_count = get_turn_trade_total(table_name=cur_table_name, conn=conn)
+    total_count = get_turn_trade_total(table_name=cur_table_name, conn=conn, only_null=only_null)
     if total_count == 0:
         logger.info(f"执行结束: {divide_table_num}表 无数据")
         return
-        
+
+    # 按股票逐只计算，每只股票一次读取，一次批量写回
+    codes = get_turn_todo_codes(table_name=cur_table_name, conn=conn, only_null=only_null)
     done_count = 0
-    while True:
-        trade_data_list = get_turn_trade_page(table_name=cur_table_name, page_num=1, page_size=10, conn=conn)
-        if trade_data_list is None or len(trade_data_list) < 1:
-            # 无数据，结束
-            logger.info(f"执行结束: {divide_table_num}表 {done_count} / {total_count}")
-            break
-        # 开始循环更新
-        for item in trade_data_list:
-            single_update_turn_data(cur_table_name=cur_table_name, cur_code=item.code, cur_date=item.date, conn=conn)
-        # 每批次提交一次DB
-        conn.commit()
-        done_count += len(trade_data_list)
-        logger.info(f"执行: {divide_table_num}表 {done_count} / {total_count}")
-            
+    for index, cur_code in enumerate(codes):
+        done_count += update_turn_data_by_code(cur_table_name=cur_table_name, cur_code=cur_code, conn=conn, only_null=only_null)
+        logger.info(f"执行: {divide_table_num}表，{index+1}/{len(codes)} {cur_code}，己处理 {done_count} / {total_count}")
+    logger.info(f"执行结束: {divide_table_num}表 {done_count} / {total_count}")
+
 
 if __name__ == "__main__":
     logger.info("开始补充bao_stock_trade表turn换手率数据...")
+    # --all 重算全部行，默认只补turn_percent_5为空的行
+    only_null = '--all' not in sys.argv
 
-    for divide_table_num in range(0, 1, 1):
+    threads = []
+    for divide_table_num in range(0, 10, 1):
         conn = stock_common.get_db_conn(sql_echo=False)
         # 创建并启动线程
         t = threading.Thread(
             target=gen_turn_data,
-            args=(divide_table_num, conn),
+            args=(divide_table_num, conn, only_null),
             name=f"turn数据生成线程-{divide_table_num}"
         )
         t.start()
+        threads.append((t, conn))
         logger.info(f"启动线程执行gen_turn_data(divide_table_num={divide_table_num})...")
-        #conn.close()
-    #t.join()  # 等待所有线程完成
-    #conn.close()
+    for t, conn in threads:
+        t.join()  # 等待所有线程完成
+        conn.close()
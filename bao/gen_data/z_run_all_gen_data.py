@@ -41,21 +41,12 @@ if __name__ == '__main__':
         #2
         logger.info("计算pe分位值等开始")
         import b_trade_pe1year_dividend
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        
-        # 使用多线程执行任务
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            # 提交任务 - 不传递conn参数，让每个线程自己创建
-            futures = {executor.submit(b_trade_pe1year_dividend.gen_pe_data, divide_table_num): divide_table_num for divide_table_num in range(0, 10, 1)}
-            
-            # 等待所有任务完成
-            for future in as_completed(futures):
-                divide_table_num = futures[future]
-                try:
-                    future.result()
-                except Exception as e:
-                    logger.error(f"处理分表 {divide_table_num} 时出错: {str(e)}")
+        # 多进程执行，按(分表, code段)拆分任务，每个进程用自己的连接池，失败的任务重试
+        b_trade_pe1year_dividend.run_pe_data_parallel()
         logger.info("计算pe分位值等完成")
+        # 分位值更新后，重新生成行业按标签分组的数据
+        import e_fund_ana
+        e_fund_ana.fund_ana_cohort_gen(conn=conn)
 
         #3 
         logger.info("生成ana报告开始")
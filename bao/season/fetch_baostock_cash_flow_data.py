@@ -3,7 +3,6 @@
 """
 下载季频现金流量数据并保存到数据库
 """
-from re import T
 import baostock as bs
 import pandas as pd
 from datetime import datetime
@@ -18,6 +17,8 @@ sys.path.append(root_path + '/api')
 import stock_common
 sys.path.append(root_path + '/bao')
 import baostock_common
+sys.path.append(root_path + '/bao/season')
+import season_common
 
 # 配置logger
 import logging
@@ -112,102 +113,17 @@ def save_cash_flow_data(df, conn):
     return saved_count
 
 
-# 保存空数据
-def save_empty_cash_flow_data(code, year, quarter, conn):
-    # 准备插入数据
-    insert_data = {
-        'code': code,
-        'year': year,
-        'quarter': quarter
-    }
-    
-    # 使用INSERT
-    insert_sql = text("""
-    INSERT INTO bao_stock_cash_flow (code, year, quarter, data_exist) VALUES (:code, :year, :quarter, 0)""")
-    
-    # 执行插入
-    conn.execute(insert_sql, insert_data)
-
-    # 提交事务
-    conn.commit()
-
 # 批量获取并保存所有股票的季频现金流量数据
 def batch_fetch_and_save_cash_flow_data(start_year=2007, end_year=None, end_quarter=4, conn=None):
     """
-    批量获取并保存所有股票的季频现金流量数据
+    批量获取并保存所有股票的季频现金流量数据，表中已有的季度（包括空数据占位）一次读入，只下载缺失的季度
     :param start_year: 开始年份，默认2007年
     :param end_year: 结束年份，默认当前年份
+    :param end_quarter: 结束年份的最后一个季度
+    :return: 下载统计
     """
-    # 设置结束年份
-    if end_year is None:
-        end_year = datetime.now().year
-
-    # 获取所有上市股票代码
-    stocks = stock_common.get_stock_info_all(conn)
-    
-    if not stocks:
-        logger.info("未获取到上市股票数据")
-        return
-    
-    total_stocks = len(stocks)
-    logger.info(f"开始处理{total_stocks}只股票的季频现金流量数据")
-    
-
-    # 处理每只股票
-    for index, stock in enumerate(stocks):
-        stock_code = stock.code
-        stock_name = stock.code_name
-        logger.info(f"处理 {index+1}/{total_stocks}: {stock_code} - {stock_name}")
-
-        #查询数据是否己有数据
-        check_sql = text("""
-        SELECT COUNT(*) FROM bao_stock_cash_flow
-        WHERE code = :code AND year = :year AND quarter = :quarter
-        """)
-        result = conn.execute(check_sql, {'code': stock_code, 'year': end_year, 'quarter': end_quarter}).fetchone()
-        if result[0] > 0:
-            logger.debug(f"{index+1}/{total_stocks}  股票 {stock_code} {stock_name} {end_year}年Q{end_quarter} 现金流量数据已存在，跳过")
-            continue
-        
-        # 处理该股票的所有年份和季度数据
-        for year in range(start_year, end_year + 1):
-            for quarter in range(1, 5):
-                
-                if(year == end_year and quarter > end_quarter):
-                    continue
-
-                # 己退市，那退市时间之后的数据不用再查了
-                target_date = datetime.strptime(f"{year}-{quarter*3}-01", "%Y-%m-%d").date()
-                
-                # 将stock.out_date转换为日期对象进行比较
-                out_date = datetime.strptime(stock.out_date, "%Y-%m-%d").date() if isinstance(stock.out_date, str) else stock.out_date
-                
-                if stock.out_date and out_date < target_date:
-                    break
-
-                #查询数据是否己有数据
-                check_sql = text("""
-                SELECT COUNT(*) FROM bao_stock_cash_flow
-                WHERE code = :code AND year = :year AND quarter = :quarter
-                """)
-                result = conn.execute(check_sql, {'code': stock_code, 'year': year, 'quarter': quarter}).fetchone()
-                if result[0] > 0:
-                    logger.debug(f"{index+1}/{total_stocks}  股票 {stock_code} {stock_name} {year}年Q{quarter} 现金流量数据已存在，跳过")
-                    continue
-
-                
-                # 查询季频现金流量数据
-                df = query_cash_flow_data(stock_code, year, quarter)
-                time.sleep(0.1)
-                
-                if df is not None and not df.empty:
-                    # 保存数据到数据库
-                    saved_count = save_cash_flow_data(df, conn)
-                    logger.debug(f"{index+1}/{total_stocks}  成功保存 {stock_code} {stock_name} {year}年Q{quarter} {saved_count}条季频现金流量数据")
-                else:
-                    save_empty_cash_flow_data(stock_code, year, quarter, conn)
-                    logger.debug(f"{index+1}/{total_stocks}  股票 {stock_code} {stock_name} {year}年Q{quarter} 现金流量数据为空，保存空数据成功")
-
+    return season_common.batch_fetch_season_data('bao_stock_cash_flow', '季频现金流量数据', query_cash_flow_data, save_cash_flow_data,
+                                                 start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn)
 
 
 if __name__ == '__main__':
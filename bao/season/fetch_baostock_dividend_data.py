@@ -12,6 +12,8 @@ sys.path.append(root_path + '/api')
 import stock_common
 sys.path.append(root_path + '/bao')
 import baostock_common
+sys.path.append(root_path + '/bao/season')
+import season_common
 
 # 配置logger
 import logging
@@ -121,93 +123,30 @@ def save_dividend_data(df, conn):
     return saved_count
 
 
-# 保存空数据
-def save_empty_dividend_data(code, year, conn):
-    # 准备插入数据
-    insert_data = {
-        'code': code,
-        'year': year
-    }
-    
-    # 使用INSERT
-    insert_sql = text("""
-    INSERT INTO bao_stock_dividend (code, year, data_exist) VALUES (:code, :year, 0)""")
-    
-    # 执行插入
-    conn.execute(insert_sql, insert_data)
-
-    # 提交事务
-    conn.commit()
-
-
 # 批量获取并保存除权除息数据
 def batch_fetch_and_save_dividend_data(start_year=2007, conn=None, check_exist=False):
     """
     批量获取并保存所有上市股票的除权除息数据
-    :param start_date: 开始日期，默认为'2007-01-01'
-    :param end_date: 结束日期，默认为当前日期
-    :return: 任务是否成功
+    :param start_year: 开始年份，默认2007年，结束年份为当前年份
+    :param check_exist: True时表中已有的年份（包括空数据占位）一次读入跳过，False时全部重新查询
+    :return: 下载统计
     """
-
-     # 设置结束年份
+    # 设置结束年份
     end_year = datetime.now().year
 
     # 获取所有上市股票代码
     stocks = stock_common.get_stock_info_all(conn)
-        
-    
     if not stocks:
         logger.info("没有找到股票数据")
-        return False
-    
-    total_stocks = len(stocks)
-    logger.info(f"开始处理{total_stocks}只股票的除权除息数据")
-
-    success_count = 0
-    error_count = 0
-
-    # 处理每只股票
-    for index, stock in enumerate(stocks):
-        logger.info(f"处理进度: {index+1}/{total_stocks} - {stock.code_name}({stock.code})")
-
-        # 处理该股票的所有年份数据
-        for year in range(start_year, end_year + 1):
-
-            # 己退市，那退市时间之后的数据不用再查了
-            target_date = datetime.strptime(f"{year+1}-01-01", "%Y-%m-%d").date()
-            
-            # 将stock.out_date转换为日期对象进行比较
-            out_date = datetime.strptime(stock.out_date, "%Y-%m-%d").date() if isinstance(stock.out_date, str) else stock.out_date
-            
-            if stock.out_date and out_date < target_date:
-                break
-
-
-            #查询数据是否己有数据
-            if check_exist:
-                check_sql = text("""
-                SELECT COUNT(*) FROM bao_stock_dividend
-                WHERE code = :code AND year = :year
-                """)
-                result = conn.execute(check_sql, {'code': stock.code, 'year': year}).fetchone()
-                if result[0] > 0:
-                    logger.debug(f"{index+1}/{total_stocks}  股票 {stock.code} {stock.code_name} {year}年 除权除息数据已存在，跳过")
-                continue
-
-            # 获取除权除息数据
-            dividend_data = query_dividend_data(stock.code, stock.code_name, year)
-            time.sleep(0.1)
-            
-            # 保存数据
-            if dividend_data is not None and not dividend_data.empty:
-                saved = save_dividend_data(dividend_data, conn)
-                success_count += saved
-                logger.debug(f"{index+1}/{total_stocks}  成功保存{saved}条除权除息数据")
-            else:
-                save_empty_dividend_data(stock.code, year, conn)
-                logger.debug(f"{index+1}/{total_stocks} 股票 {stock.code} {stock.code_name} {year}年 除权除息数据为空，保存空数据成功")
+        return None
 
-    logger.info(f"除权除息数据获取完成！成功处理{success_count}条记录，{error_count}只股票获取失败")
+    key_columns = season_common.YEAR_KEY_COLUMNS
+    exist_keys = season_common.get_exist_keys('bao_stock_dividend', start_year, end_year, conn, key_columns) if check_exist else set()
+    plan = season_common.plan_year_cells(stocks, exist_keys, start_year, end_year)
+    logger.info(f"开始处理{len(stocks)}只股票的除权除息数据")
+    return season_common.fetch_season_cells('bao_stock_dividend', '除权除息数据', plan,
+                                            lambda stock, year: query_dividend_data(stock.code, stock.code_name, year),
+                                            save_dividend_data, conn, key_columns)
 
 
 # 主函数
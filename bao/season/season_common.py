@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+季频数据下载计划：每张表已有的(code, year, quarter)一次读入集合，只下载缺失的季度，结果批量写入
+多进程模式下六张表合成一个任务队列，共用限流器，断点文件记录已完成的季度
+"""
+from datetime import date, datetime
+import time
+import os
+import json
+import importlib
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from sqlalchemy import text
+import sys
+# 获取当前脚本的绝对路径并向上回溯到根目录
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(root_path)  # 添加根目录到搜索路径
+sys.path.append(root_path + '/api')
+import stock_common
+sys.path.append(root_path + '/bao')
+import baostock_common
+
+# 配置logger
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 季频表的主键字段，分红表只按年
+SEASON_KEY_COLUMNS = ('code', 'year', 'quarter')
+YEAR_KEY_COLUMNS = ('code', 'year')
+# 空数据占位每次批量写入的行数
+EMPTY_BATCH_SIZE = 500
+# 每次查询baostock后的间隔秒数
+QUERY_INTERVAL = 0.1
+
+def to_date(value):
+    """bao_stock_basic的ipo_date/out_date可能是字符串或日期，统一转成日期，空值返回None"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value), "%Y-%m-%d").date()
+
+def get_exist_keys(table_name, start_year, end_year, conn, key_columns=SEASON_KEY_COLUMNS):
+    """表中start_year到end_year已有的主键集合，包括data_exist=0的空数据占位，一次查询"""
+    sql = f"""SELECT DISTINCT {', '.join(key_columns)} FROM {table_name}
+        WHERE year >= :start_year AND year <= :end_year"""
+    results = conn.execute(text(sql), {'start_year': start_year, 'end_year': end_year}).fetchall()
+    return set(tuple(item) for item in results)
+
+def get_season_list(start_year, end_year, end_quarter=4):
+    """start_year Q1 到 end_year Q{end_quarter} 的全部季度"""
+    return [(year, quarter) for year in range(start_year, end_year + 1) for quarter in range(1, 5)
+            if not (year == end_year and quarter > end_quarter)]
+
+def is_season_listed(stock, year, quarter=None):
+    """上市年份之前的不查；己退市的，退市之后的季度（分红按年）不查，与原来逐条判断的规则一致"""
+    ipo_date = to_date(stock.ipo_date)
+    if ipo_date and year < ipo_date.year:
+        return False
+    out_date = to_date(stock.out_date)
+    if out_date is None:
+        return True
+    target_date = date(year + 1, 1, 1) if quarter is None else date(year, quarter * 3, 1)
+    return out_date >= target_date
+
+def plan_season_cells(stocks, exist_keys, start_year, end_year, end_quarter=4):
+    """返回[(stock, [(year, quarter), ...])]，只包含表中缺失且在上市期间的季度"""
+    season_list = get_season_list(start_year, end_year, end_quarter)
+    plan = []
+    for stock in stocks:
+        cells = [(year, quarter) for year, quarter in season_list
+                 if (stock.code, year, quarter) not in exist_keys and is_season_listed(stock, year, quarter)]
+        if cells:
+            plan.append((stock, cells))
+    return plan
+
+def plan_year_cells(stocks, exist_keys, start_year, end_year):
+    """按年的数据（分红），返回[(stock, [(year,), ...])]，exist_keys为空时全部重新查询"""
+    plan = []
+    for stock in stocks:
+        cells = [(year,) for year in range(start_year, end_year + 1)
+                 if (stock.code, year) not in exist_keys and is_season_listed(stock, year)]
+        if cells:
+            plan.append((stock, cells))
+    return plan
+
+def save_empty_season_rows(table_name, rows, conn, key_columns=SEASON_KEY_COLUMNS):
+    """批量保存空数据占位 data_exist = 0"""
+    if not rows:
+        return 0
+    insert_sql = text(f"""INSERT INTO {table_name} ({', '.join(key_columns)}, data_exist)
+        VALUES ({', '.join(f':{column}' for column in key_columns)}, 0)""")
+    conn.execute(insert_sql, rows)
+    conn.commit()
+    return len(rows)
+
+class SeasonWriter:
+    """按表缓存下载结果，有数据的DataFrame攒够batch_size行合并后用表的save_func一次保存，空数据占位批量insert"""
+    def __init__(self, conn, batch_size=EMPTY_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.tables = {}
+
+    def register(self, table_name, save_func, key_columns=SEASON_KEY_COLUMNS):
+        self.tables[table_name] = {'save_func': save_func, 'key_columns': key_columns, 'frames': [], 'frame_rows': 0, 'empty_rows': []}
+
+    def add(self, table_name, code, cell, df):
+        """df为空时记一条空数据占位，返回是否有数据"""
+        table = self.tables[table_name]
+        if df is not None and not df.empty:
+            table['frames'].append(df)
+            table['frame_rows'] += len(df)
+            if table['frame_rows'] >= self.batch_size:
+                self.flush_frames(table_name)
+            return True
+        table['empty_rows'].append(dict(zip(table['key_columns'], (code,) + tuple(cell))))
+        if len(table['empty_rows']) >= self.batch_size:
+            self.flush_empty(table_name)
+        return False
+
+    def flush_frames(self, table_name):
+        table = self.tables[table_name]
+        saved_count = table['save_func'](pd.concat(table['frames'], ignore_index=True), self.conn) if table['frames'] else 0
+        table['frames'] = []
+        table['frame_rows'] = 0
+        return saved_count
+
+    def flush_empty(self, table_name):
+        table = self.tables[table_name]
+        empty_count = save_empty_season_rows(table_name, table['empty_rows'], self.conn, table['key_columns'])
+        table['empty_rows'] = []
+        return empty_count
+
+    def flush(self):
+        for table_name in self.tables:
+            self.flush_frames(table_name)
+            self.flush_empty(table_name)
+
+def fetch_season_cells(table_name, data_name, plan, query_func, save_func, conn, key_columns=SEASON_KEY_COLUMNS):
+    """按计划逐个季度下载，结果经SeasonWriter批量写入
+    query_func(stock, *cell) 返回DataFrame或None，cell为(year, quarter)或(year,)
+    返回 {'stock_count', 'cell_count', 'saved_count', 'empty_count'}
+    """
+    total_stocks = len(plan)
+    total_cells = sum(len(cells) for _, cells in plan)
+    logger.info(f"{data_name}: {total_stocks}只股票共缺失{total_cells}个季度")
+
+    summary = {'stock_count': total_stocks, 'cell_count': total_cells, 'saved_count': 0, 'empty_count': 0}
+    writer = SeasonWriter(conn)
+    writer.register(table_name, save_func, key_columns)
+    try:
+        for index, (stock, cells) in enumerate(plan):
+            logger.info(f"处理 {index+1}/{total_stocks}: {stock.code} - {stock.code_name}，缺失{len(cells)}个季度")
+            for cell in cells:
+                df = query_func(stock, *cell)
+                time.sleep(QUERY_INTERVAL)
+
+                if writer.add(table_name, stock.code, cell, df):
+                    summary['saved_count'] += len(df)
+                    logger.debug(f"{index+1}/{total_stocks}  获取 {stock.code} {stock.code_name} {cell} {len(df)}条{data_name}")
+                else:
+                    summary['empty_count'] += 1
+                    logger.debug(f"{index+1}/{total_stocks} 股票 {stock.code} {stock.code_name} {cell} {data_name}为空")
+    finally:
+        # 出错时已经查过的数据也保存，下次不再重复查询
+        writer.flush()
+
+    logger.info(f"{data_name}获取完成: {summary}")
+    return summary
+
+def batch_fetch_season_data(table_name, data_name, query_func, save_func, start_year=2007, end_year=None, end_quarter=4, conn=None):
+    """季频数据批量获取：已有的季度一次读入，只下载缺失的季度"""
+    if end_year is None:
+        end_year = datetime.now().year
+
+    # 获取所有上市股票代码
+    stocks = stock_common.get_stock_info_all(conn)
+    if not stocks:
+        logger.info("未获取到上市股票数据")
+        return None
+
+    exist_keys = get_exist_keys(table_name, start_year, end_year, conn)
+    plan = plan_season_cells(stocks, exist_keys, start_year, end_year, end_quarter)
+    logger.info(f"开始处理{len(stocks)}只股票的{data_name}，表中已有{len(exist_keys)}个季度")
+    return fetch_season_cells(table_name, data_name, plan,
+                              lambda stock, year, quarter: query_func(stock.code, year, quarter), save_func, conn)
+
+# 多进程季频下载：六张表的缺失季度合成一个任务队列，每个工作进程自己的baostock登录和DB连接，共用一个限流器
+# (表名, 模块名, 查询函数, 保存函数, 数据名称, 主键字段)
+SEASON_TABLES = [
+    ('bao_stock_balance', 'fetch_baostock_balance_data', 'query_balance_data', 'save_balance_data', '季频偿债能力数据', SEASON_KEY_COLUMNS),
+    ('bao_stock_cash_flow', 'fetch_baostock_cash_flow_data', 'query_cash_flow_data', 'save_cash_flow_data', '季频现金流量数据', SEASON_KEY_COLUMNS),
+    ('bao_stock_growth', 'fetch_baostock_growth_data', 'query_growth_data', 'save_growth_data', '季频成长能力数据', SEASON_KEY_COLUMNS),
+    ('bao_stock_operation', 'fetch_baostock_operation_data', 'query_operation_data', 'save_operation_data', '季频营运能力数据', SEASON_KEY_COLUMNS),
+    ('bao_stock_profit', 'fetch_baostock_profit_data', 'query_profit_data', 'save_profit_data', '季频盈利能力数据', SEASON_KEY_COLUMNS),
+    ('bao_stock_dividend', 'fetch_baostock_dividend_data', 'query_dividend_data', 'save_dividend_data', '除权除息数据', YEAR_KEY_COLUMNS),
+]
+# 每个任务处理的股票数
+SEASON_TASK_CODES = 20
+# 断点文件目录，每完成一个任务追加一次已完成的季度
+SEASON_CHECKPOINT_DIR = os.environ.get('SEASON_CHECKPOINT_DIR', os.path.join(root_path, 'cache', 'season'))
+
+def build_season_queue(conn, start_year, end_year, end_quarter=4, dividend_start_year=None, dividend_check_exist=False, tables=None):
+    """所有表缺失的季度合成一个队列，返回[(表名, code, code_name, cell)]，按股票排序
+    dividend_start_year: 分红的开始年份，默认同start_year，结束年份为当前年份；dividend_check_exist=False时分红全部重新查询，与原来一致"""
+    stocks = stock_common.get_stock_info_all(conn)
+    queue = []
+    for table_name, _, _, _, data_name, key_columns in SEASON_TABLES:
+        if tables is not None and table_name not in tables:
+            continue
+        if key_columns == YEAR_KEY_COLUMNS:
+            table_start_year = dividend_start_year or start_year
+            table_end_year = datetime.now().year
+            exist_keys = get_exist_keys(table_name, table_start_year, table_end_year, conn, key_columns) if dividend_check_exist else set()
+            plan = plan_year_cells(stocks, exist_keys, table_start_year, table_end_year)
+        else:
+            exist_keys = get_exist_keys(table_name, start_year, end_year, conn, key_columns)
+            plan = plan_season_cells(stocks, exist_keys, start_year, end_year, end_quarter)
+        table_queue = [(table_name, stock.code, stock.code_name, cell) for stock, cells in plan for cell in cells]
+        logger.info(f"{data_name}: 缺失{len(table_queue)}个季度")
+        queue.extend(table_queue)
+    queue.sort(key=lambda unit: unit[1])
+    return queue
+
+def get_unit_key(unit):
+    """断点文件里一个季度的标识: (表名, code, year[, quarter])"""
+    table_name, code, _, cell = unit
+    return (table_name, code) + tuple(cell)
+
+def get_checkpoint_path(start_year, end_year, end_quarter):
+    return os.path.join(SEASON_CHECKPOINT_DIR, f"season_{start_year}_{end_year}Q{end_quarter}.jsonl")
+
+def load_checkpoint(checkpoint_path):
+    """已完成的季度集合，文件不存在返回空集合"""
+    if not os.path.exists(checkpoint_path):
+        return set()
+    done_keys = set()
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            # 写了一半的最后一行忽略
+            try:
+                done_keys.update(tuple(key) for key in json.loads(line))
+            except ValueError:
+                continue
+    return done_keys
+
+def remove_checkpoint(checkpoint_path):
+    """新的一次运行开始前删除上次留下的断点文件"""
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+        logger.info(f"删除上次的断点文件 {checkpoint_path}")
+
+def append_checkpoint(checkpoint_path, keys):
+    if not keys:
+        return
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    with open(checkpoint_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps([list(key) for key in keys], ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def split_season_tasks(queue, task_codes=SEASON_TASK_CODES):
+    """同一只股票的季度在同一个任务里，每个任务task_codes只股票"""
+    tasks = []
+    codes = []
+    for unit in queue:
+        if not codes or codes[-1] != unit[1]:
+            if len(codes) >= task_codes:
+                codes = []
+            if not codes:
+                tasks.append([])
+            codes.append(unit[1])
+        tasks[-1].append(unit)
+    return tasks
+
+worker_conn = None
+worker_rate_limiter = None
+worker_fetchers = {}
+worker_bs = None
+
+def init_season_worker(rate_limiter, bs_module_name='baostock'):
+    """工作进程初始化，bs_module_name可以换成本地的假baostock模块做测试"""
+    global worker_conn, worker_rate_limiter, worker_bs
+    worker_bs = importlib.import_module(bs_module_name)
+    lg = worker_bs.login()
+    if lg.error_code != '0':
+        raise Exception(f"登录baostock失败: {lg.error_msg}")
+    # 不复用父进程fork过来的连接池
+    stock_common.dispose_engines()
+    worker_conn = stock_common.get_db_conn(sql_echo=False)
+    worker_rate_limiter = rate_limiter
+    sys.path.append(root_path + '/bao/season')
+    for table_name, module_name, query_name, save_name, _, key_columns in SEASON_TABLES:
+        module = importlib.import_module(module_name)
+        module.bs = worker_bs
+        worker_fetchers[table_name] = (getattr(module, query_name), getattr(module, save_name), key_columns)
+    # 进程退出时关闭连接，登出
+    multiprocessing.util.Finalize(None, close_season_worker, exitpriority=10)
+
+def close_season_worker():
+    if worker_conn is not None:
+        worker_conn.close()
+    if worker_bs is not None:
+        worker_bs.logout()
+
+def query_season_unit(unit):
+    table_name, code, code_name, cell = unit
+    query_func, _, key_columns = worker_fetchers[table_name]
+    if key_columns == YEAR_KEY_COLUMNS:
+        return query_func(code, code_name, *cell)
+    return query_func(code, *cell)
+
+def fetch_season_task(units):
+    """处理一个任务，查询失败的季度跳过，最后全部写入后返回已完成和失败的季度"""
+    writer = SeasonWriter(worker_conn)
+    for table_name, (_, save_func, key_columns) in worker_fetchers.items():
+        writer.register(table_name, save_func, key_columns)
+
+    result = {'done': [], 'failed': [], 'saved_count': 0, 'empty_count': 0}
+    for unit in units:
+        table_name, code, code_name, cell = unit
+        worker_rate_limiter.acquire()
+        try:
+            df = query_season_unit(unit)
+        except Exception as e:
+            logger.error(f"{table_name} {code} {code_name} {cell} 查询失败: {str(e)}")
+            result['failed'].append(get_unit_key(unit))
+            continue
+        if writer.add(table_name, code, cell, df):
+            result['saved_count'] += len(df)
+        else:
+            result['empty_count'] += 1
+        result['done'].append(get_unit_key(unit))
+    try:
+        writer.flush()
+    except Exception:
+        worker_conn.rollback()
+        raise
+    return result
+
+def run_season_fetch_parallel(start_year, end_year=None, end_quarter=4, workers=4, rate=10, dividend_start_year=None,
+                              dividend_check_exist=False, tables=None, checkpoint_path=None, task_codes=SEASON_TASK_CODES,
+                              bs_module_name='baostock', resume=False):
+    """多进程下载所有季频表的缺失季度，rate为所有进程合计每秒请求baostock的次数
+    每完成一个任务把完成的季度追加到断点文件，全部成功后删除断点文件
+    resume: True时接着上次的断点文件跑，跳过已完成的季度；False时删除上次留下的断点文件，重新开始
+    返回 {'unit_count', 'done_count', 'failed_count', 'saved_count', 'empty_count', 'seconds'}
+    """
+    if end_year is None:
+        end_year = datetime.now().year
+    if checkpoint_path is None:
+        checkpoint_path = get_checkpoint_path(start_year, end_year, end_quarter)
+
+    if not resume:
+        remove_checkpoint(checkpoint_path)
+
+    start_time = time.time()
+    conn = stock_common.get_db_conn(sql_echo=False)
+    try:
+        queue = build_season_queue(conn, start_year, end_year, end_quarter, dividend_start_year, dividend_check_exist, tables)
+    finally:
+        conn.close()
+    done_keys = load_checkpoint(checkpoint_path)
+    if done_keys:
+        queue = [unit for unit in queue if get_unit_key(unit) not in done_keys]
+        logger.info(f"断点文件 {checkpoint_path} 已完成{len(done_keys)}个季度")
+
+    summary = {'unit_count': len(queue), 'done_count': 0, 'failed_count': 0, 'saved_count': 0, 'empty_count': 0}
+    if not queue:
+        logger.info("没有需要获取的季频数据")
+    else:
+        tasks = split_season_tasks(queue, task_codes)
+        logger.info(f"开始处理{len(queue)}个季度，{len(tasks)}个任务，{workers}个进程，每秒{rate}次请求")
+        rate_limiter = baostock_common.RateLimiter(rate)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_season_worker, initargs=(rate_limiter, bs_module_name)) as executor:
+            futures = {executor.submit(fetch_season_task, units): units for units in tasks}
+            for future in as_completed(futures):
+                units = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    summary['failed_count'] += len(units)
+                    logger.error(f"任务 {units[0][1]}~{units[-1][1]} 写入失败: {str(e)}")
+                    continue
+                append_checkpoint(checkpoint_path, result['done'])
+                for key in ['saved_count', 'empty_count']:
+                    summary[key] += result[key]
+                summary['done_count'] += len(result['done'])
+                summary['failed_count'] += len(result['failed'])
+                logger.info(f"进度 {summary['done_count']}/{summary['unit_count']}，失败 {summary['failed_count']}")
+
+    if summary['failed_count'] == 0:
+        remove_checkpoint(checkpoint_path)
+    summary['seconds'] = round(time.time() - start_time, 3)
+    logger.info(f"季频数据获取完成: {summary}")
+    return summary
@@ -9,76 +9,122 @@ sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 sys.path.append(root_path + '/bao/season')
 import stock_common
+import job_journal
 sys.path.append(root_path + '/bao')
 import baostock_common
+import season_common
 
 # 配置logger
 import logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 清除最近季度的空数据占位，重新查询
+def clear_empty_data(conn, end_year, end_quarter):
+    logger.info("清除旧数据开始")
+    conn.execute(text(f"delete from bao_stock_balance where year = {end_year} and quarter >= {end_quarter-1} and data_exist = 0"))
+    conn.execute(text(f"delete from bao_stock_cash_flow where year = {end_year} and quarter > {end_quarter-1} and data_exist = 0"))
+    conn.execute(text(f"delete from bao_stock_growth where year = {end_year} and quarter > {end_quarter-1} and data_exist = 0"))
+    conn.execute(text(f"delete from bao_stock_operation where year = {end_year} and quarter > {end_quarter-1} and data_exist = 0"))
+    conn.execute(text(f"delete from bao_stock_profit where year = {end_year} and quarter > {end_quarter-1} and data_exist = 0"))
+    conn.execute(text(f"delete from bao_stock_dividend where year = {end_year} and data_exist = 0"))
+    conn.commit()
+    logger.info("清除旧数据完成")
+
+# 多进程获取，有失败的季度时抛出异常，由任务日志按退避时间重试
+# 断点文件在本次运行开始时已经处理过（新运行删除，--resume保留），这里总是接着断点文件跑，重试时跳过已完成的季度
+def run_season_parallel(start_year, end_year, end_quarter, workers, rate, checkpoint_path):
+    summary = season_common.run_season_fetch_parallel(start_year, end_year, end_quarter, workers=workers, rate=rate,
+                                                      dividend_start_year=end_year, checkpoint_path=checkpoint_path, resume=True)
+    if summary['failed_count'] > 0:
+        raise Exception(f"{summary['failed_count']}个季度获取失败")
+    return summary
+
 if __name__ == '__main__':
+    start_year = 2025
+    end_year = 2025
+    end_quarter = 4
+
+    # 多进程模式（默认）: python z_run_all_season.py --workers 4 --rate 10，--workers 0 按表逐个串行获取
+    # --resume（或 --run-key）接着上次没跑完的批次和断点文件继续，不清除空数据占位；默认每次重新开始
+    workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv else 4
+    rate = float(sys.argv[sys.argv.index('--rate') + 1]) if '--rate' in sys.argv else 10
+    # 每个阶段记入任务日志，失败的阶段重试；接着以前的批次时已完成的阶段跳过
+    journal = job_journal.JobJournal('bao_season')
+    resume = journal.resumed
+    if workers > 0:
+        checkpoint_path = season_common.get_checkpoint_path(start_year, end_year, end_quarter)
+        # 新的运行：删除上次留下的断点文件，清除空数据占位，分红全部重新查询
+        # --resume：保留断点文件和已经写入的空数据占位，跳过已完成的季度
+        if not resume:
+            season_common.remove_checkpoint(checkpoint_path)
+            conn = stock_common.get_db_conn(sql_echo=False)
+            journal.run('clear_empty', clear_empty_data, conn, end_year, end_quarter, rollback_conn=conn)
+            conn.close()
+        # 六张表合成一个任务队列，每个进程自己登录baostock，分红按原来的方式全部重新查询
+        journal.run('season_parallel', run_season_parallel, start_year, end_year, end_quarter, workers, rate, checkpoint_path)
+        journal.log_summary()
+        exit_code = journal.exit_code()
+        journal.close()
+        # 有失败的阶段时非0退出
+        sys.exit(exit_code)
+
     # 登录baostock
     if not baostock_common.login_baostock():
         raise Exception("登录baostock失败")
     
     try:
-        start_year = 2025
-        end_year = 2025
-        end_quarter = 4
-
         conn = stock_common.get_db_conn(sql_echo=False)
-        # 0 清除旧数据
-        logger.info("清除旧数据开始")
-        conn.execute(text(f"delete from bao_stock_balance where year = {end_year} and quarter >= {end_quarter-1} and data_exist = 0"))
-        conn.execute(text(f"delete from bao_stock_cash_flow where year = {end_year} and quarter > {end_quarter-1} and data_exist = 0"))
-        conn.execute(text(f"delete from bao_stock_growth where year = {end_year} and quarter > {end_quarter-1} and data_exist = 0"))
-        conn.execute(text(f"delete from bao_stock_operation where year = {end_year} and quarter > {end_quarter-1} and data_exist = 0"))
-        conn.execute(text(f"delete from bao_stock_profit where year = {end_year} and quarter > {end_quarter-1} and data_exist = 0"))
-        conn.execute(text(f"delete from bao_stock_dividend where year = {end_year} and data_exist = 0"))
-        conn.commit()
-        logger.info("清除旧数据完成")
+        # 0 清除旧数据，接着以前的批次时不清除
+        if not resume:
+            journal.run('clear_empty', clear_empty_data, conn, end_year, end_quarter, rollback_conn=conn)
         
         # 1
         logger.info("季频偿债能力数据获取开始")
         import fetch_baostock_balance_data
-        fetch_baostock_balance_data.batch_fetch_and_save_balance_data(start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn)
+        journal.run('balance', fetch_baostock_balance_data.batch_fetch_and_save_balance_data, start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn, rollback_conn=conn)
         logger.info("季频偿债能力数据获取完成")
         
         #2
         logger.info("季频现金流量数据获取开始")
         import fetch_baostock_cash_flow_data
-        fetch_baostock_cash_flow_data.batch_fetch_and_save_cash_flow_data(start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn)
+        journal.run('cash_flow', fetch_baostock_cash_flow_data.batch_fetch_and_save_cash_flow_data, start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn, rollback_conn=conn)
         logger.info("季频现金流量数据获取完成")
 
         #3 
         logger.info("季频成长能力数据获取开始")
         import fetch_baostock_growth_data
-        fetch_baostock_growth_data.batch_fetch_and_save_growth_data(start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn)
+        journal.run('growth', fetch_baostock_growth_data.batch_fetch_and_save_growth_data, start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn, rollback_conn=conn)
         logger.info("季频成长能力数据获取完成")
 
         #4
         logger.info("季频营运能力数据获取开始")
         import fetch_baostock_operation_data
-        fetch_baostock_operation_data.batch_fetch_and_save_operation_data(start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn)
+        journal.run('operation', fetch_baostock_operation_data.batch_fetch_and_save_operation_data, start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn, rollback_conn=conn)
         logger.info("季频营运能力数据获取完成")
 
         #5
         logger.info("季频盈利能力数据获取开始")
         import fetch_baostock_profit_data
-        fetch_baostock_profit_data.batch_fetch_and_save_profit_data(start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn)
+        journal.run('profit', fetch_baostock_profit_data.batch_fetch_and_save_profit_data, start_year=start_year, end_year=end_year, end_quarter=end_quarter, conn=conn, rollback_conn=conn)
         logger.info("季频盈利能力数据获取完成")
 
         #6
         logger.info("分红数据获取开始")
         import fetch_baostock_dividend_data
-        fetch_baostock_dividend_data.batch_fetch_and_save_dividend_data(start_year=end_year, conn=conn, check_exist=False)
+        journal.run('dividend', fetch_baostock_dividend_data.batch_fetch_and_save_dividend_data, start_year=end_year, conn=conn, check_exist=False, rollback_conn=conn)
         logger.info("分红数据获取完成")
 
         conn.close()
         
     except Exception as e:
         logger.error(f"批量处理失败: {str(e)}")
+        journal.record_failure('runner', str(e))
     finally:
+        journal.log_summary()
+        exit_code = journal.exit_code()
+        journal.close()
         # 确保登出
-        baostock_common.logout_baostock()
\ No newline at end of file
+        baostock_common.logout_baostock()
+    # 有失败的阶段时非0退出
+    sys.exit(exit_code)
\ No newline at end of file
@@ -10,6 +10,7 @@ root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 import stock_common
+import trade_calendar
 sys.path.append(root_path + '/bao')
 import baostock_common
 
@@ -57,6 +58,9 @@ def fetch_and_save_trade_dates(start_date, end_date, conn=None):
     
     logger.info(f"成功获取并保存了{len(df)}条交易日数据")
 
+    # 刷新交易日历缓存
+    trade_calendar.refresh_trade_calendar(conn)
+
 
 # 增量更新交易日数据
 def incremental_update_trade_dates(conn=None):
@@ -14,6 +14,9 @@ from cenue.util.CommissionConfig import CommissionConfig
 from cenue.auto.log_config import LogConfig
 from cenue.auto.db_reader import DBReader
 from cenue.auto.txt_writer import TXTWriter, INDEX_CODES
+from cenue.auto.strategy_config import StrategyConfig
+sys.path.append(os.path.join(project_root, 'api'))
+from trade_calendar import TradeCalendar
 
 """
 写一个自动交易策略回测代码，代码全部写在auto_cenue1.py文件中。   超跌股
@@ -50,7 +53,14 @@ roe查询表bao_stock_profit，字段为code, date, roe。
 
 
 class BacktestEngine:
-    def __init__(self):
+    def __init__(self, config=None, db_reader=None, write_log=True):
+        """config: 策略阈值StrategyConfig，为空使用默认值
+        db_reader: 已加载好数据的DBReader，参数扫描时多个回测共用一份日K面板
+        write_log: 是否把输出写到logs目录的日志文件
+        """
+        # 策略阈值
+        self.config = config if config is not None else StrategyConfig()
+        
         # 资金相关
         self.initial_capital = 1000*10000  # 初始资金，单位：元
         self.capital = self.initial_capital  # 当前可用资金，单位：元
@@ -77,6 +87,7 @@ class BacktestEngine:
         
         # 交易日历
         self.trading_days = []  # 交易日列表，格式：['2023-01-03', '2023-01-04', ...]
+        self.trade_calendar = TradeCalendar([])  # 交易日历，按日期查序号
         
         # 使用当前文件名作为前缀
         self.prefix = os.path.splitext(os.path.basename(__file__))[0]  # 日志文件名前缀，使用当前文件名
@@ -85,18 +96,20 @@ class BacktestEngine:
         self.daily_trade_count = 0
         
         # 初始化外部模块
-        self.log_config = LogConfig(self.prefix)  # 日志配置模块
-        self.db_reader = DBReader()  # 数据库读取模块
+        self.log_config = LogConfig(self.prefix) if write_log else None  # 日志配置模块
+        self.db_reader = db_reader if db_reader is not None else DBReader()  # 数据库读取模块
         self.txt_writer = TXTWriter(self.prefix, self.db_reader)  # 文件写入模块
     
     def close(self):
         """关闭资源"""
         self.db_reader.close()
-        self.log_config.close()
+        if self.log_config:
+            self.log_config.close()
     
     def get_trading_days(self):
         """获取交易日历"""
         self.trading_days = self.db_reader.get_trading_days(self.start_date, self.end_date)
+        self.trade_calendar = TradeCalendar(self.trading_days or [])
         return len(self.trading_days) > 0
     
 
@@ -106,106 +119,103 @@ class BacktestEngine:
         if not selected_stocks:
             return []
         
-        # 1. 分别获取ps、pe分位值、股息率的排序位次
-        # 按ps_year_1_percent从小到大排序，获取每只股票的ps位次
-        ps_sorted = sorted(selected_stocks, key=lambda x: x['ps_year_1_percent'])
-        ps_rank_dict = {stock['code']: i+1 for i, stock in enumerate(ps_sorted)}
-        
-        # 按pe_year_1_percent从小到大排序，获取每只股票的pe位次
-        pe_sorted = sorted(selected_stocks, key=lambda x: x['pe_year_1_percent'])
-        pe_rank_dict = {stock['code']: i+1 for i, stock in enumerate(pe_sorted)}
+        # 1. 分别获取ps、pe分位值、股息率的排序位次，稳定排序，相同值保持原来的先后顺序
+        def get_rank(values):
+            order = np.argsort(values, kind='stable')
+            rank = np.empty(len(values), dtype=np.int64)
+            rank[order] = np.arange(1, len(values) + 1)
+            return rank
         
-        # 按dividend_yield从大到小排序，获取每只股票的股息率位次
-        dividend_sorted = sorted(selected_stocks, key=lambda x: x['dividend_yield'], reverse=True)
-        dividend_rank_dict = {stock['code']: i+1 for i, stock in enumerate(dividend_sorted)}
+        # ps_year_1_percent、pe_year_1_percent从小到大，dividend_yield从大到小
+        ps_rank = get_rank(np.array([stock['ps_year_1_percent'] for stock in selected_stocks], dtype=np.float64))
+        pe_rank = get_rank(np.array([stock['pe_year_1_percent'] for stock in selected_stocks], dtype=np.float64))
+        dividend_rank = get_rank(-np.array([stock['dividend_yield'] for stock in selected_stocks], dtype=np.float64))
         
         # 2. 计算每只股票的综合位次（ps位次 + pe位次 + 股息率位次）
-        # 给每个股票添加综合位次属性
-        for stock in selected_stocks:
-            ps_rank = ps_rank_dict[stock['code']]
-            pe_rank = pe_rank_dict[stock['code']]
-            dividend_rank = dividend_rank_dict[stock['code']]
-            stock['composite_rank'] = ps_rank + pe_rank + dividend_rank
+        composite_rank = ps_rank + pe_rank + dividend_rank
+        for i, stock in enumerate(selected_stocks):
+            stock['composite_rank'] = int(composite_rank[i])
         
         # 3. 按综合位次从小到大排序
-        sorted_stocks = sorted(selected_stocks, key=lambda x: x['composite_rank'])
+        sorted_stocks = [selected_stocks[i] for i in np.argsort(composite_rank, kind='stable')]
         
         return sorted_stocks
     
+    def prepare_select_data(self, stock_basic):
+        """按面板的股票顺序准备选股用的数组：是否在基本信息中、上市日期序号"""
+        panel = self.db_reader.panel
+        self.select_stock_basic = stock_basic
+        self.basic_mask = np.array([code in stock_basic and stock_basic[code]['ipo_date'] is not None for code in panel.codes], dtype=bool)
+        self.ipo_ordinal = np.array([stock_basic[code]['ipo_date'].toordinal() if self.basic_mask[i] else 0 for i, code in enumerate(panel.codes)], dtype=np.int64)
+        self.dividend_mask_cache = {}
+    
+    def get_dividend_mask(self, year):
+        """当前年份的前2年每年都有分红的股票，按面板的股票顺序，按年份缓存"""
+        if year not in self.dividend_mask_cache:
+            dividend_data = self.db_reader.dividend_data_cache
+            self.dividend_mask_cache[year] = np.array([
+                code in dividend_data and (year - 1) in dividend_data[code] and (year - 2) in dividend_data[code]
+                for code in self.db_reader.panel.codes], dtype=bool)
+        return self.dividend_mask_cache[year]
+    
     def select_stocks(self, date, stock_basic):
-        """选股逻辑"""
+        """选股逻辑：当天所有股票的列数据按条件生成布尔掩码"""
         # 获取所有股票的日K数据
-        daily_data_list = self.db_reader.get_all_stocks_daily(date)
-        if not daily_data_list:
+        columns, code_idx = self.db_reader.panel.get_day_columns(date) if self.db_reader.panel is not None else (None, None)
+        if columns is None or len(code_idx) == 0:
             print(f"{date} 没有日K数据")
             return []
         
+        if getattr(self, 'select_stock_basic', None) is not stock_basic:
+            self.prepare_select_data(stock_basic)
+        
+        current_date = datetime.strptime(date, '%Y-%m-%d').date()
+        config = self.config
+        # 空值为NaN，NaN参与的比较都是False，与原来的空值判断一致
+        with np.errstate(invalid='ignore'):
+            mask = (
+                # 检查基本信息，上市时间
+                self.basic_mask[code_idx]
+                & (current_date.toordinal() - self.ipo_ordinal[code_idx] >= 2*365)
+                # 检查总市值
+                & (columns['total_market_value'] > config.min_market_value)
+                # 检查动态PE，0和空值不买入
+                & (columns['peTTM'] != 0) & (columns['peTTM'] <= config.max_pe)
+                # 检查动态股息率（使用数据库中已计算好的字段）
+                & (columns['stock_fenghong_percent'] >= config.min_dividend)
+                # 检查PE 1年分位值
+                & (columns['pe_year_1_percent'] != 0) & (columns['pe_year_1_percent'] <= config.max_pe_percent)
+                # 检查PS 1年分位值
+                & (columns['ps_year_1_percent'] != 0) & (columns['ps_year_1_percent'] <= config.max_ps_percent)
+                # 动态PS不能为空或0
+                & (columns['psTTM'] != 0) & ~np.isnan(columns['psTTM'])
+                # 检查是否有分红记录：当前交易日的前2年每年都有分红
+                & self.get_dividend_mask(current_date.year)[code_idx]
+                # 检查是否为ST股票，ST股票不买入
+                & (columns['isST'] != 1)
+                # 检查股价是否低于1元，低于1元不买入
+                & (columns['close'] >= 1)
+            )
+        
+        # 检查roe，roe<5%不买入
+        """ roe_avg = self.get_roe_avg(code, date)
+        if roe_avg < 0.05:
+            continue """
+        
         selected = []
-        for daily_data in daily_data_list:
-            code = daily_data['code']
-            
-            # 检查基本信息
-            if code not in stock_basic:
-                continue
-            
-            # 检查上市时间
-            ipo_date = stock_basic[code]['ipo_date']
-            current_date = datetime.strptime(date, '%Y-%m-%d').date()
-            if (current_date - ipo_date).days < 2*365:
-                continue
-            
-            # 检查总市值
-            if not daily_data['total_market_value'] or daily_data['total_market_value'] <= 50:
-                continue
-            
-            # 检查动态PE
-            if not daily_data['peTTM'] or daily_data['peTTM'] > 35:
-                continue
-            
-            # 检查动态股息率（使用数据库中已计算好的字段）
-            dividend_yield = daily_data['stock_fenghong_percent'] if daily_data['stock_fenghong_percent'] else 0
-            if dividend_yield < 1:
-                continue
-            
-            # 检查PE 1年分位值
-            if not daily_data['pe_year_1_percent'] or daily_data['pe_year_1_percent'] > 20:
-                continue
-            
-            # 检查PS 1年分位值
-            if not daily_data['ps_year_1_percent'] or daily_data['ps_year_1_percent'] > 20:
-                continue
-            
-            # 计算动态PS
-            if not daily_data['psTTM']:
-                continue
-            
-            # 检查是否有分红记录：当前交易日的前2年每年都有分红
-            if not self.db_reader.has_dividend(code, date):
-                continue
-            
-            # 检查是否为ST股票，ST股票不买入
-            if daily_data['isST'] == 1:
-                continue
-            
-            # 检查股价是否低于1元，低于1元不买入
-            if daily_data['close'] < 1:
-                continue
-            
-            # 检查roe，roe<5%不买入
-            """ roe_avg = self.get_roe_avg(code, date)
-            if roe_avg < 0.05:
-                continue """
-            
+        panel = self.db_reader.panel
+        for i in np.flatnonzero(mask):
+            code = panel.codes[code_idx[i]]
             selected.append({
                 'code': code,
                 'code_name': stock_basic[code]['code_name'],
-                'peTTM': daily_data['peTTM'],
-                'psTTM': daily_data['psTTM'],
-                'total_market_value': daily_data['total_market_value'],
-                'pe_year_1_percent': daily_data['pe_year_1_percent'],
-                'ps_year_1_percent': daily_data['ps_year_1_percent'],
-                'close': daily_data['close'],
-                'dividend_yield': dividend_yield
+                'peTTM': float(columns['peTTM'][i]),
+                'psTTM': float(columns['psTTM'][i]),
+                'total_market_value': float(columns['total_market_value'][i]),
+                'pe_year_1_percent': float(columns['pe_year_1_percent'][i]),
+                'ps_year_1_percent': float(columns['ps_year_1_percent'][i]),
+                'close': float(columns['close'][i]),
+                'dividend_yield': float(columns['stock_fenghong_percent'][i])
             })
         
         # 调用排序方法
@@ -231,23 +241,24 @@ class BacktestEngine:
     def check_stop_condition(self, code, buy_price, current_price, date):
         """检查止盈止损条件"""
         pnl = self.calculate_pnl(code, buy_price, current_price)
+        config = self.config
         
         # 止盈检查
-        if pnl >= 100:
+        if pnl >= config.take_profit_all:
             # 清仓，90天内禁止买入
-            forbidden_date = self.get_future_date(date, 90)
+            forbidden_date = self.get_future_date(date, config.take_profit_forbid_days)
             self.forbidden_buy[code] = forbidden_date
             return 'sell_all'  # 清仓
-        elif pnl >= 30:
+        elif pnl >= config.take_profit:
             return 'sell_part'  # 开始止盈
         
         # 止损检查
-        if pnl <= -10:
+        if pnl <= -config.stop_loss:
             # 清仓，30天内禁止买入
-            forbidden_date = self.get_future_date(date, 30)
+            forbidden_date = self.get_future_date(date, config.stop_loss_forbid_days)
             self.forbidden_buy[code] = forbidden_date
             return 'sell_all'  # 清仓
-        elif pnl <= -3:
+        elif pnl <= -config.stop_buy_loss:
             self.stop_buy[code] = date  # 停止买入
             return 'stop_buy'  # 停止买入
         
@@ -255,17 +266,15 @@ class BacktestEngine:
     
     def get_future_date(self, current_date, days):
         """获取未来N个交易日的日期"""
-        current_idx = self.trading_days.index(current_date)
-        future_idx = min(current_idx + days, len(self.trading_days) - 1)
-        return self.trading_days[future_idx]
+        return self.trade_calendar.offset(current_date, days)
     
     def check_trade_interval(self, code, date):
         """检查是否满足交易间隔要求"""
         if code not in self.last_trade_date:
             return True
         last_date = self.last_trade_date[code]
-        last_idx = self.trading_days.index(last_date)
-        current_idx = self.trading_days.index(date)
+        last_idx = self.trade_calendar.ordinal(last_date)
+        current_idx = self.trade_calendar.ordinal(date)
         return (current_idx - last_idx) >= 5
     
     def execute_trade(self, date, selected_stocks, stock_basic):
@@ -291,7 +300,7 @@ class BacktestEngine:
             pe_year_1_percent = daily_data.get('pe_year_1_percent', 0)
             ps_year_1_percent = daily_data.get('ps_year_1_percent', 0)
             
-            if pe_year_1_percent > 70 or ps_year_1_percent > 70:
+            if pe_year_1_percent > self.config.sell_percent or ps_year_1_percent > self.config.sell_percent:
                 # 需要卖出
                 if not self.check_trade_interval(code, date):
                     continue
@@ -330,7 +339,7 @@ class BacktestEngine:
                         'code': code,
                         'code_name': stock_basic[code]['code_name'],
                         'action': 'sell',
-                        'reason': f'动态PE1年分位值({pe_year_1_percent}%)或动态PS1年分位值({ps_year_1_percent}%)高于70%',
+                        'reason': f'动态PE1年分位值({pe_year_1_percent}%)或动态PS1年分位值({ps_year_1_percent}%)高于{self.config.sell_percent}%',
                         'price': daily_data['close'],
                         'shares': sell_shares,
                         'amount': sell_amount,
@@ -629,40 +638,43 @@ class BacktestEngine:
     
 
     
-    def run_backtest(self):
-        """运行回测"""
-        print("开始回测...")
-        
+    def load_data(self):
+        """加载回测需要的数据：交易日历、日K、分红、股票基本信息，返回股票基本信息，失败返回None"""
         # 连接数据库
         if not self.db_reader.connect_db():
-            return False
+            return None
         
         # 获取交易日历
         if not self.get_trading_days():
-            return False
+            return None
         
         if not self.trading_days:
             print("没有获取到交易日历，无法进行回测")
-            return False
+            return None
         
         # 一次性加载所有日K数据到内存
         if not self.db_reader.load_all_stock_daily_data(self.start_date, self.end_date):
-            return False
+            return None
         
         # 一次性加载所有roe数据到内存
         """ if not self.load_all_roe_data():
-            return False """
+            return None """
         
         # 一次性加载所有分红数据到内存
         if not self.db_reader.load_dividend_data(self.start_date, self.end_date):
-            return False
+            return None
         
         # 获取股票基本信息
         stock_basic = self.db_reader.get_stock_basic()
         if not stock_basic:
             print("没有获取到股票基本信息，无法进行回测")
-            return False
-        
+            return None
+        # 选股用的基本信息数组，回测开始前准备一次
+        self.prepare_select_data(stock_basic)
+        return stock_basic
+    
+    def simulate(self, stock_basic):
+        """按交易日逐日选股、交易，数据需要已经加载好"""
         # 遍历每个交易日
         for i, date in enumerate(self.trading_days):
             # 重置当日交易计数器
@@ -676,9 +688,33 @@ class BacktestEngine:
             
             # 计算每日结果
             self.calculate_daily_result(date)
+    
+    def run_backtest(self):
+        """运行回测"""
+        print("开始回测...")
         
+        stock_basic = self.load_data()
+        if stock_basic is None:
+            return False
+        
+        self.simulate(stock_basic)
         return True
     
+    def get_summary(self):
+        """回测结果汇总：总收益率、最大回撤、交易次数"""
+        if not self.daily_records:
+            return {'total_return': None, 'max_drawdown': None, 'trade_count': len(self.trade_records), 'final_asset': None}
+        total_asset = np.array([record['total_asset'] for record in self.daily_records])
+        # 最大回撤，单位：%
+        peak = np.maximum.accumulate(total_asset)
+        max_drawdown = float(((peak - total_asset) / peak).max() * 100)
+        return {
+            'total_return': self.daily_records[-1]['total_return'],
+            'max_drawdown': max_drawdown,
+            'trade_count': len(self.trade_records),
+            'final_asset': self.daily_records[-1]['total_asset']
+        }
+    
 
 
     def run(self):
@@ -706,5 +742,6 @@ class BacktestEngine:
             self.close()
 
 if __name__ == '__main__':
-    backtest = BacktestEngine()
+    # --cache 从本地列式缓存读取数据（先运行 python api/kline_cache.py 导出），不连MySQL
+    backtest = BacktestEngine(db_reader=DBReader(source='cache') if '--cache' in sys.argv else None)
     backtest.run()
\ No newline at end of file
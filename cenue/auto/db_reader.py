@@ -1,29 +1,36 @@
+import os
+import sys
 import pymysql
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from cenue.auto.market_panel import MarketPanel, PANEL_FIELDS
 
-# 数据库配置
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '123456',
-    'database': 'stock',
-    'charset': 'utf8mb4'
-}
+# 获取当前脚本的绝对路径并向上回溯到根目录
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(root_path + '/api')
+import stock_common
 
 class DBReader:
-    def __init__(self):
+    def __init__(self, source='db'):
+        """source: 'db' 从MySQL读取；'cache' 从本地列式缓存读取（api/kline_cache.py 导出），不需要MySQL"""
+        self.source = source
         self.conn = None
         self.cursor = None
-        self.stock_daily_data = {}  # 内存中的日K数据，结构：{date: {code: data}}
+        self.panel = None  # 内存中的日K数据，MarketPanel，交易日×股票的数组
         self.roe_data_cache = {}  # 股票roe数据，结构：{code: [{pubDate: datetime, statDate: datetime, roeAvg: float}, ...]}
         self.dividend_data_cache = {}  # 分红数据结构：{code: set(year1, year2, ...)}，存储股票每年的分红年份
     
     def connect_db(self):
-        """连接数据库"""
+        """连接数据库，从共享连接池中取pymysql连接；缓存模式检查缓存是否已导出"""
+        if self.source == 'cache':
+            import kline_cache
+            if not kline_cache.has_cache():
+                print(f"本地缓存不完整，先运行 python api/kline_cache.py 导出，目录：{kline_cache.KLINE_CACHE_DIR}")
+                return False
+            return True
         try:
-            self.conn = pymysql.connect(**DB_CONFIG)
+            self.conn = stock_common.get_raw_conn()
             self.cursor = self.conn.cursor(pymysql.cursors.DictCursor)
             # print("数据库连接成功")
             return True
@@ -33,6 +40,8 @@ class DBReader:
     
     def get_trading_days(self, start_date, end_date):
         """获取交易日历"""
+        if self.source == 'cache':
+            return self._get_trading_days_from_cache(start_date, end_date)
         if not self.conn:
             print("数据库未连接，无法获取交易日历")
             return False
@@ -54,6 +63,8 @@ class DBReader:
     
     def get_stock_basic(self):
         """获取股票基本信息"""
+        if self.source == 'cache':
+            return self._get_stock_basic_from_cache()
         if not self.conn:
             print("数据库未连接，无法获取股票基本信息")
             return {}
@@ -79,23 +90,22 @@ class DBReader:
     
     def get_stock_daily(self, code, date):
         """从内存中获取单个股票的日K数据"""
-        if date not in self.stock_daily_data:
+        if self.panel is None:
             return None
         
-        return self.stock_daily_data[date].get(code, None)
+        return self.panel.get_stock_daily(code, date)
     
     def get_all_stocks_daily(self, date):
         """从内存中获取所有股票的日K数据"""
-        if date not in self.stock_daily_data:
-            # print(f"{date} 没有日K数据")
+        if self.panel is None:
             return []
         
-        all_data = list(self.stock_daily_data[date].values())
-        # print(f"从内存中获取到{len(all_data)}条日K数据")
-        return all_data
+        return self.panel.get_all_stocks_daily(date)
     
-    def load_all_stock_daily_data(self, start_date, end_date):
-        """一次性加载所有股票在回测期间的日K数据到内存"""
+    def load_all_stock_daily_data(self, start_date, end_date, chunk_size=100000):
+        """一次性加载所有股票在回测期间的日K数据到内存，按块读取，组装成MarketPanel"""
+        if self.source == 'cache':
+            return self._load_all_stock_daily_data_from_cache(start_date, end_date, chunk_size)
         if not self.conn:
             print("数据库未连接，无法加载日K数据")
             return False
@@ -103,40 +113,23 @@ class DBReader:
         # print("开始加载所有股票日K数据...")
         
         # 确定需要的字段
-        required_fields = ['code', 'date', 'total_market_value', 'peTTM', 'psTTM', 'pe_year_1_percent', 'ps_year_1_percent', 'close', 'stock_fenghong_percent', 'isST']
+        required_fields = ['code', 'date'] + PANEL_FIELDS
         fields_str = ', '.join(required_fields)
         
         # 构建union all查询
         union_sql = []
         for i in range(10):
             table_name = f'bao_stock_trade_{i}'
-            union_sql.append(f"SELECT {fields_str} FROM {table_name} WHERE date BETWEEN %s AND %s")
+            union_sql.append(f"SELECT {fields_str} FROM {table_name} WHERE date BETWEEN :start_date AND :end_date")
         
         sql = " UNION ALL ".join(union_sql)
         
         try:
-            # 执行查询
-            self.cursor.execute(sql, (start_date, end_date) * 10)
-            all_data = self.cursor.fetchall()
-            # print(f"成功获取{len(all_data)}条日K数据")
+            # 流式读取，服务端游标按块取行，不在内存中保留全部行
+            chunks = stock_common.stream_query(sql, {'start_date': start_date, 'end_date': end_date}, chunk_size=chunk_size)
+            self.panel = MarketPanel.from_chunks(chunks, PANEL_FIELDS)
             
-            # 按日期和股票代码组织数据
-            for data in all_data:
-                # 处理date字段，可能是字符串或日期对象
-                if isinstance(data['date'], str):
-                    date_str = data['date']
-                else:
-                    date_str = data['date'].strftime('%Y-%m-%d')
-                code = data['code']
-                
-                if date_str not in self.stock_daily_data:
-                    self.stock_daily_data[date_str] = {}
-                
-                # 转换日期对象为字符串，方便后续使用
-                data['date'] = date_str
-                self.stock_daily_data[date_str][code] = data
-            
-            print(f"日K数据加载完成，覆盖{len(self.stock_daily_data)}个交易日")
+            print(f"日K数据加载完成，覆盖{len(self.panel.dates)}个交易日，{len(self.panel.codes)}只股票，占用内存{self.panel.nbytes() / 1024 / 1024:.1f}MB")
             return True
         except Exception as e:
             print(f"加载日K数据失败: {e}")
@@ -201,6 +194,8 @@ class DBReader:
     
     def load_dividend_data(self, start_date, end_date):
         """一次性加载回测开始时间2年前到回测结束时间的所有分红数据，按股票代码和年份存储"""
+        if self.source == 'cache':
+            return self._load_dividend_data_from_cache(start_date, end_date)
         if not self.conn:
             print("数据库未连接，无法加载分红数据")
             return False
@@ -303,6 +298,8 @@ class DBReader:
     
     def get_index_data(self, code, start_date, end_date):
         """从bao_nostock_trade表获取指数数据"""
+        if self.source == 'cache':
+            return self._get_index_data_from_cache(code, start_date, end_date)
         index_data = {}
         sql = """
         SELECT date, close FROM bao_nostock_trade 
@@ -318,8 +315,92 @@ class DBReader:
             print(f"获取{code}数据失败: {e}")
         return index_data
     
+    def _get_trading_days_from_cache(self, start_date, end_date):
+        """从缓存获取交易日历"""
+        import kline_cache
+        try:
+            table = kline_cache.read_snapshot('bao_trade_date', ['calendar_date', 'is_trading_day'])
+            table = kline_cache.filter_table(table, start_date, end_date, date_column='calendar_date')
+            df = table.to_pandas()
+            dates = df.loc[df['is_trading_day'] == 1, 'calendar_date']
+            return sorted(d.strftime('%Y-%m-%d') for d in dates)
+        except Exception as e:
+            print(f"获取交易日历失败: {e}")
+            return []
+    
+    def _get_stock_basic_from_cache(self):
+        """从缓存获取股票基本信息"""
+        import kline_cache
+        try:
+            df = kline_cache.read_snapshot('bao_stock_basic', ['code', 'code_name', 'ipo_date', 'status', 'type']).to_pandas()
+            df = df[(df['status'] == '1') & (df['type'] == '1')]
+            df = df.astype(object).where(df.notna(), None)
+            return {row['code']: {'code': row['code'], 'code_name': row['code_name'], 'ipo_date': row['ipo_date']}
+                    for row in df.to_dict('records')}
+        except Exception as e:
+            print(f"获取股票基本信息失败: {e}")
+            return {}
+    
+    def _load_all_stock_daily_data_from_cache(self, start_date, end_date, chunk_size=100000):
+        """从缓存加载日K数据，每张分表按id排序，和数据库UNION ALL读出的顺序一致；按列直接转NumPy数组，不逐行生成元组"""
+        import kline_cache
+        import pyarrow.compute as pc
+        
+        def fetch_columns():
+            for i in range(10):
+                table = kline_cache.read_kline(f'bao_stock_trade_{i}', start_date, end_date, ['id', 'code', 'date'] + PANEL_FIELDS)
+                table = table.take(pc.sort_indices(table['id']))
+                # 股票代码字典编码，每行只有一个整数序号
+                codes = pc.dictionary_encode(table['code']).combine_chunks()
+                values = {field: table[field].to_numpy(zero_copy_only=False).astype(np.float64) for field in PANEL_FIELDS}
+                yield (codes.indices.to_numpy(zero_copy_only=False), codes.dictionary.to_pylist(),
+                       table['date'].to_numpy(zero_copy_only=False), values)
+        
+        try:
+            self.panel = MarketPanel.from_columns(fetch_columns(), PANEL_FIELDS)
+            print(f"日K数据从缓存加载完成，覆盖{len(self.panel.dates)}个交易日，{len(self.panel.codes)}只股票，占用内存{self.panel.nbytes() / 1024 / 1024:.1f}MB")
+            return True
+        except Exception as e:
+            print(f"加载日K数据失败: {e}")
+            return False
+    
+    def _load_dividend_data_from_cache(self, start_date, end_date):
+        """从缓存加载分红年份"""
+        import kline_cache
+        try:
+            query_start_year = datetime.strptime(start_date, '%Y-%m-%d').year - 2
+            query_end_year = datetime.strptime(end_date, '%Y-%m-%d').year
+            df = kline_cache.read_snapshot('bao_stock_dividend', ['code', 'dividOperateDate', 'data_exist', 'dividCashPsBeforeTax']).to_pandas()
+            df = df[df['dividOperateDate'].notna() & (df['data_exist'] == 1) & (df['dividCashPsBeforeTax'] > 0)]
+            years = df['dividOperateDate'].map(lambda d: d.year)
+            df = df[(years >= query_start_year) & (years <= query_end_year)]
+            
+            self.dividend_data_cache = {}  # 重置缓存
+            for code, dividend_year in zip(df['code'], years[df.index]):
+                self.dividend_data_cache.setdefault(code, set()).add(int(dividend_year))
+            
+            print(f"加载了{len(self.dividend_data_cache)}只有分红记录的股票，共{sum(len(years) for years in self.dividend_data_cache.values())}条分红年份记录")
+            return True
+        except Exception as e:
+            print(f"加载分红数据失败: {e}")
+            return False
+    
+    def _get_index_data_from_cache(self, code, start_date, end_date):
+        """从缓存获取指数数据"""
+        import kline_cache
+        index_data = {}
+        try:
+            table = kline_cache.read_kline('bao_nostock_trade', start_date, end_date, ['date', 'close'], codes=[code])
+            table = table.sort_by('date')
+            for cur_date, close in zip(table['date'].to_pylist(), table['close'].to_pylist()):
+                index_data[cur_date.strftime('%Y-%m-%d')] = close
+            print(f"获取到{len(index_data)}个交易日的{code}数据")
+        except Exception as e:
+            print(f"获取{code}数据失败: {e}")
+        return index_data
+    
     def close(self):
-        """关闭数据库连接"""
+        """关闭数据库连接，归还到连接池"""
         if self.conn:
             self.conn.close()
             print("数据库连接已关闭")
@@ -0,0 +1,242 @@
+import numpy as np
+
+# 回测需要的日K字段
+PANEL_FIELDS = ['total_market_value', 'peTTM', 'psTTM', 'pe_year_1_percent', 'ps_year_1_percent', 'close', 'stock_fenghong_percent', 'isST']
+# 整数字段，取出时转回int
+PANEL_INT_FIELDS = ['isST']
+
+
+class MarketPanel:
+    """日K面板：每个字段一个 交易日×股票 的float64数组，空值为NaN
+
+    dates: 交易日列表，格式'YYYY-MM-DD'，升序
+    codes: 股票代码列表，按在数据中第一次出现的顺序
+    data: {字段: 数组[日期序号, 股票序号]}
+    exists: 当天有没有这只股票的日K
+    day_codes: 每个交易日的股票序号，按数据中出现的顺序，保证和原来逐行加载时的顺序一致
+    """
+    def __init__(self, dates, codes, data, exists, day_codes, fields=PANEL_FIELDS):
+        self.dates = list(dates)
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+        self.codes = list(codes)
+        self.code_index = {c: i for i, c in enumerate(self.codes)}
+        self.code_array = np.array(self.codes, dtype=object)
+        self.fields = list(fields)
+        self.data = data
+        self.exists = exists
+        self.day_codes = day_codes
+
+    @classmethod
+    def from_chunks(cls, chunks, fields=PANEL_FIELDS):
+        """按块构建面板，每块是(code, date, *fields)的元组列表，不需要一次性把所有行放进内存"""
+        code_index = {}
+        date_index = {}
+        date_idx_list = []
+        code_idx_list = []
+        value_list = []
+
+        for rows in chunks:
+            if not rows:
+                continue
+            date_idx = np.empty(len(rows), dtype=np.int32)
+            code_idx = np.empty(len(rows), dtype=np.int32)
+            for i, row in enumerate(rows):
+                code = row[0]
+                cur_date = row[1] if isinstance(row[1], str) else row[1].strftime('%Y-%m-%d')
+                if code not in code_index:
+                    code_index[code] = len(code_index)
+                if cur_date not in date_index:
+                    date_index[cur_date] = len(date_index)
+                code_idx[i] = code_index[code]
+                date_idx[i] = date_index[cur_date]
+            # None转NaN，Decimal转float
+            values = np.array([row[2:] for row in rows], dtype=np.float64).reshape(len(rows), len(fields))
+            date_idx_list.append(date_idx)
+            code_idx_list.append(code_idx)
+            value_list.append(values)
+
+        # 交易日按时间排序，序号重新映射
+        dates = sorted(date_index.keys())
+        date_remap = np.empty(len(dates), dtype=np.int32)
+        for new_idx, cur_date in enumerate(dates):
+            date_remap[date_index[cur_date]] = new_idx
+        codes = [None] * len(code_index)
+        for code, idx in code_index.items():
+            codes[idx] = code
+
+        if not value_list:
+            return cls.from_index_arrays(dates, codes, None, None, None, fields)
+        all_values = np.concatenate(value_list)
+        return cls.from_index_arrays(dates, codes, date_remap[np.concatenate(date_idx_list)], np.concatenate(code_idx_list),
+                                     [all_values[:, j] for j in range(len(fields))], fields)
+
+    @classmethod
+    def from_columns(cls, chunks, fields=PANEL_FIELDS):
+        """按列构建面板，不逐行生成元组，结果和from_chunks一致
+        每块是(code_idx, code_names, dates, values)：code_idx为块内的股票序号数组，code_names[序号]为股票代码，
+        dates为datetime64[D]数组，values为{字段: 数组}，空值为NaN
+        """
+        code_index = {}
+        date_list = []
+        code_idx_list = []
+        value_lists = {field: [] for field in fields}
+
+        for code_idx, code_names, dates, values in chunks:
+            if len(code_idx) == 0:
+                continue
+            code_idx = np.asarray(code_idx)
+            # 块内的股票按第一次出现的顺序加入全局序号
+            local_codes, first_pos = np.unique(code_idx, return_index=True)
+            code_remap = np.zeros(len(code_names), dtype=np.int32)
+            for local_code in local_codes[np.argsort(first_pos, kind='stable')]:
+                code = code_names[local_code]
+                if code not in code_index:
+                    code_index[code] = len(code_index)
+                code_remap[local_code] = code_index[code]
+            code_idx_list.append(code_remap[code_idx])
+            date_list.append(np.asarray(dates, dtype='datetime64[D]'))
+            for field in fields:
+                value_lists[field].append(np.asarray(values[field], dtype=np.float64))
+
+        codes = [None] * len(code_index)
+        for code, idx in code_index.items():
+            codes[idx] = code
+        if not date_list:
+            return cls.from_index_arrays([], codes, None, None, None, fields)
+
+        # 交易日升序，序号就是去重排序后的位置
+        unique_dates, all_date_idx = np.unique(np.concatenate(date_list), return_inverse=True)
+        dates = list(np.datetime_as_string(unique_dates, unit='D'))
+        return cls.from_index_arrays(dates, codes, all_date_idx.astype(np.int32).ravel(), np.concatenate(code_idx_list),
+                                     [np.concatenate(value_lists[field]) for field in fields], fields)
+
+    @classmethod
+    def from_index_arrays(cls, dates, codes, all_date_idx, all_code_idx, field_values, fields=PANEL_FIELDS):
+        """all_date_idx/all_code_idx为每行的日期、股票序号，field_values为每个字段每行的值，按数据顺序；为None时是空面板"""
+        shape = (len(dates), len(codes))
+        data = {field: np.full(shape, np.nan) for field in fields}
+        exists = np.zeros(shape, dtype=bool)
+        if all_date_idx is None:
+            return cls(dates, codes, data, exists, [np.empty(0, dtype=np.int32) for _ in dates], fields)
+
+        for field, values in zip(fields, field_values):
+            data[field][all_date_idx, all_code_idx] = values
+        exists[all_date_idx, all_code_idx] = True
+
+        # 每个交易日的股票顺序，稳定排序保留数据中的原始顺序
+        order = np.argsort(all_date_idx, kind='stable')
+        split_points = np.searchsorted(all_date_idx[order], np.arange(1, len(dates)))
+        day_codes = np.split(all_code_idx[order], split_points)
+        return cls(dates, codes, data, exists, day_codes, fields)
+
+    def nbytes(self):
+        """面板占用的内存字节数"""
+        total = self.exists.nbytes + sum(item.nbytes for item in self.data.values()) + sum(item.nbytes for item in self.day_codes)
+        return total
+
+    def field_value(self, field, date_idx, code_idx):
+        value = self.data[field][date_idx, code_idx]
+        if np.isnan(value):
+            return None
+        if field in PANEL_INT_FIELDS:
+            return int(value)
+        return float(value)
+
+    def row_view(self, date_idx, code_idx):
+        """单只股票单日的日K，字典格式，与原来的行数据一致"""
+        row = {'code': self.codes[code_idx], 'date': self.dates[date_idx]}
+        for field in self.fields:
+            row[field] = self.field_value(field, date_idx, code_idx)
+        return row
+
+    def get_stock_daily(self, code, date):
+        date_idx = self.date_index.get(date)
+        code_idx = self.code_index.get(code)
+        if date_idx is None or code_idx is None or not self.exists[date_idx, code_idx]:
+            return None
+        return self.row_view(date_idx, code_idx)
+
+    def get_all_stocks_daily(self, date):
+        date_idx = self.date_index.get(date)
+        if date_idx is None:
+            return []
+        return [self.row_view(date_idx, code_idx) for code_idx in self.day_codes[date_idx]]
+
+    def get_day_columns(self, date):
+        """某一天全部股票的列数据，{字段: 数组}，以及股票序号数组，顺序与get_all_stocks_daily一致"""
+        date_idx = self.date_index.get(date)
+        if date_idx is None:
+            return None, None
+        code_idx = self.day_codes[date_idx]
+        return {field: self.data[field][date_idx, code_idx] for field in self.fields}, code_idx
+
+
+def build_synthetic_panel(years=10, stock_num=5000, seed=0):
+    """生成测试用的面板，每年约250个交易日"""
+    rng = np.random.default_rng(seed)
+    import datetime
+    dates = []
+    cur_date = datetime.date(2015, 1, 1)
+    while len(dates) < years * 250:
+        if cur_date.weekday() < 5:
+            dates.append(cur_date.strftime('%Y-%m-%d'))
+        cur_date += datetime.timedelta(days=1)
+    codes = [f"sh.{600000 + i}" for i in range(stock_num)]
+    shape = (len(dates), len(codes))
+    data = {
+        'total_market_value': rng.lognormal(4, 1, shape),
+        'peTTM': rng.normal(30, 20, shape),
+        'psTTM': rng.lognormal(1, 1, shape),
+        'pe_year_1_percent': np.round(rng.uniform(0, 100, shape), 2),
+        'ps_year_1_percent': np.round(rng.uniform(0, 100, shape), 2),
+        'close': rng.lognormal(2, 1, shape),
+        'stock_fenghong_percent': np.round(rng.exponential(1.5, shape), 2),
+        'isST': (rng.uniform(0, 1, shape) < 0.03).astype(np.float64),
+    }
+    exists = rng.uniform(0, 1, shape) < 0.9
+    for field in data:
+        data[field][~exists] = np.nan
+    day_codes = [np.flatnonzero(exists[i]).astype(np.int32) for i in range(len(dates))]
+    return MarketPanel(dates, codes, data, exists, day_codes)
+
+
+if __name__ == '__main__':
+    # 性能测试：10年、5000只股票的面板，对比原来的{date: {code: dict}}结构
+    import time
+    import tracemalloc
+
+    start_time = time.time()
+    panel = build_synthetic_panel()
+    rows_num = int(panel.exists.sum())
+    print(f"面板: {len(panel.dates)}个交易日 x {len(panel.codes)}只股票，{rows_num}行，构建耗时 {time.time() - start_time:.2f}秒")
+    print(f"面板内存: {panel.nbytes() / 1024 / 1024:.1f} MB")
+
+    # 原结构按抽样的交易日测内存，再按行数折算
+    sample_days = 20
+    tracemalloc.start()
+    old_data = {}
+    for date_idx in range(sample_days):
+        old_data[panel.dates[date_idx]] = {panel.codes[code_idx]: panel.row_view(date_idx, code_idx) for code_idx in panel.day_codes[date_idx]}
+    old_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    sample_rows = sum(len(item) for item in old_data.values())
+    old_total_bytes = old_bytes / sample_rows * rows_num
+    print(f"原结构内存(按{sample_days}天抽样折算): {old_total_bytes / 1024 / 1024:.1f} MB，是面板的 {old_total_bytes / panel.nbytes():.1f} 倍")
+
+    # 每日选股的扫描耗时：原结构逐行判断 vs 面板按列判断
+    test_date = panel.dates[0]
+    start_time = time.time()
+    for _ in range(10):
+        selected = [row['code'] for row in old_data[test_date].values()
+                    if row['total_market_value'] and row['total_market_value'] > 50 and row['peTTM'] and row['peTTM'] <= 35
+                    and row['pe_year_1_percent'] and row['pe_year_1_percent'] <= 20]
+    old_time = (time.time() - start_time) / 10
+    start_time = time.time()
+    for _ in range(10):
+        columns, code_idx = panel.get_day_columns(test_date)
+        mask = (columns['total_market_value'] > 50) & (columns['peTTM'] != 0) & (columns['peTTM'] <= 35) \
+            & (columns['pe_year_1_percent'] != 0) & (columns['pe_year_1_percent'] <= 20)
+        selected_panel = panel.code_array[code_idx[mask]].tolist()
+    panel_time = (time.time() - start_time) / 10
+    assert selected == selected_panel
+    print(f"单日筛选: 原结构 {old_time * 1000:.2f} ms，面板 {panel_time * 1000:.2f} ms")
@@ -0,0 +1,145 @@
+import os
+import sys
+import io
+import time
+import itertools
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# 添加项目根目录到Python路径，确保能找到cenue模块
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from cenue.auto.auto_cenue1 import BacktestEngine
+from cenue.auto.db_reader import DBReader
+from cenue.auto.strategy_config import StrategyConfig
+
+"""
+auto_cenue1策略的参数扫描：日K面板只加载一次，每组参数跑一次回测，输出收益率、最大回撤、交易次数的汇总表。
+子进程用fork启动，直接继承父进程已加载的面板（只读，不复制），N组参数的耗时约为 1次加载 + N/进程数 次回测。
+"""
+
+# 父进程加载好数据的回测引擎，fork后子进程共用
+base_engine = None
+base_stock_basic = None
+
+
+def expand_param_grid(param_grid):
+    """参数网格展开成参数组合列表，param_grid: {参数名: [取值, ...]}"""
+    names = list(param_grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])]
+
+
+def run_one(params):
+    """用一组参数跑一次回测，返回汇总结果"""
+    start_time = time.time()
+    engine = BacktestEngine(config=StrategyConfig(**params), db_reader=base_engine.db_reader, write_log=False)
+    engine.start_date = base_engine.start_date
+    engine.end_date = base_engine.end_date
+    engine.trading_days = base_engine.trading_days
+    engine.trade_calendar = base_engine.trade_calendar
+    # 选股用的数组和分红掩码缓存都是只读的，直接共用
+    engine.select_stock_basic = base_engine.select_stock_basic
+    engine.basic_mask = base_engine.basic_mask
+    engine.ipo_ordinal = base_engine.ipo_ordinal
+    engine.dividend_mask_cache = dict(base_engine.dividend_mask_cache)
+
+    # 每日的打印太多，扫描时不输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.simulate(base_stock_basic)
+
+    result = dict(params)
+    result.update(engine.get_summary())
+    result['seconds'] = round(time.time() - start_time, 2)
+    return result
+
+
+def run_param_sweep(param_grid, workers=None, start_date=None, end_date=None, engine=None, source='db'):
+    """参数扫描
+    param_grid: {参数名: [取值, ...]}，参数名见StrategyConfig
+    workers: 进程数，默认CPU核数
+    engine: 已经load_data的回测引擎，为空时新建并加载
+    source: 新建引擎时的数据来源，'db' MySQL，'cache' 本地列式缓存
+    返回汇总表DataFrame，按总收益率从高到低排序
+    """
+    global base_engine, base_stock_basic
+
+    params_list = expand_param_grid(param_grid)
+    # 参数名先检查一遍，不要等到子进程里才报错
+    for params in params_list:
+        StrategyConfig(**params)
+
+    start_time = time.time()
+    if engine is None:
+        engine = BacktestEngine(db_reader=DBReader(source=source), write_log=False)
+        if start_date:
+            engine.start_date = start_date
+        if end_date:
+            engine.end_date = end_date
+        stock_basic = engine.load_data()
+        if stock_basic is None:
+            print("回测数据加载失败，无法进行参数扫描")
+            return None
+        # 数据已经在内存中，子进程不能共用数据库连接
+        engine.db_reader.close()
+    else:
+        stock_basic = engine.select_stock_basic
+    base_engine = engine
+    base_stock_basic = stock_basic
+    # 分红掩码在父进程中提前算好，子进程直接共用
+    for date in engine.trading_days:
+        engine.get_dividend_mask(int(date[:4]))
+    load_seconds = time.time() - start_time
+    print(f"数据加载完成，耗时 {load_seconds:.2f}秒，共{len(params_list)}组参数")
+
+    start_time = time.time()
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(params_list) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            results = list(executor.map(run_one, params_list))
+    else:
+        # 不支持fork的系统（Windows）在当前进程中逐个执行
+        results = [run_one(params) for params in params_list]
+    print(f"参数扫描完成，{len(params_list)}组参数，{workers}个进程，耗时 {time.time() - start_time:.2f}秒")
+
+    summary = pd.DataFrame(results).sort_values('total_return', ascending=False).reset_index(drop=True)
+    return summary
+
+
+def save_sweep_summary(summary, prefix='auto_cenue1'):
+    """汇总表保存到logs目录"""
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    file_name = f'logs/{prefix}_param_sweep.txt'
+    summary.to_csv(file_name, index=False, encoding='utf-8', float_format='%.2f')
+    print(f"参数扫描结果已保存到{file_name}，共{len(summary)}组")
+    return file_name
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='auto_cenue1策略参数扫描')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认CPU核数')
+    parser.add_argument('--start', default=None, help='回测开始日期')
+    parser.add_argument('--end', default=None, help='回测结束日期')
+    parser.add_argument('--cache', action='store_true', help='从本地列式缓存读取数据，不连MySQL')
+    args = parser.parse_args()
+
+    # 扫描的参数网格，按需修改
+    param_grid = {
+        'max_pe': [25, 35],
+        'max_pe_percent': [10, 20],
+        'max_ps_percent': [10, 20],
+        'sell_percent': [70, 80],
+        'stop_loss': [10, 15],
+        'take_profit_all': [100],
+    }
+    summary = run_param_sweep(param_grid, workers=args.workers, start_date=args.start, end_date=args.end,
+                              source='cache' if args.cache else 'db')
+    if summary is not None:
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(summary)
+        save_sweep_summary(summary)
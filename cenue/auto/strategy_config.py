@@ -0,0 +1,27 @@
+# 选股、卖出、止盈止损的阈值配置，默认值就是auto_cenue1.py原来写死的数值
+class StrategyConfig:
+    min_market_value = 50  # 最小总市值，单位：亿
+    max_pe = 35  # 动态PE上限
+    min_dividend = 1  # 动态股息率下限，单位：%
+    max_pe_percent = 20  # 买入时动态PE 1年分位值上限，单位：%
+    max_ps_percent = 20  # 买入时动态PS 1年分位值上限，单位：%
+    sell_percent = 70  # 动态PE或PS 1年分位值高于这个值卖出，单位：%
+    stop_buy_loss = 3  # 下跌这个比例停止买入，单位：%
+    stop_loss = 10  # 下跌这个比例清仓，单位：%
+    stop_loss_forbid_days = 30  # 止损清仓后禁止买入的交易日数
+    take_profit = 30  # 上涨这个比例开始止盈，单位：%
+    take_profit_all = 100  # 上涨这个比例清仓，单位：%
+    take_profit_forbid_days = 90  # 止盈清仓后禁止买入的交易日数
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            if not hasattr(StrategyConfig, name) or name.startswith('_'):
+                raise ValueError(f"未知的策略参数: {name}")
+            setattr(self, name, value)
+
+    def to_dict(self):
+        """全部参数，字典格式"""
+        return {name: getattr(self, name) for name in vars(StrategyConfig) if not name.startswith('_') and not callable(getattr(StrategyConfig, name))}
+
+    def __repr__(self):
+        return f"StrategyConfig({self.to_dict()})"
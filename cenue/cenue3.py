@@ -4,6 +4,8 @@ import pymysql
 import numpy as np
 import datetime
 import logging
+import os
+import sys
 from backtrader import indicators as btind
 from backtrader.utils import date2num
 
@@ -11,15 +13,10 @@ from backtrader.utils import date2num
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# MySQL连接配置
-MYSQL_CONFIG = {
-    'host': 'localhost',  # 假设数据库在本地
-    'user': 'root',  # 请修改为实际用户名
-    'password': '123456',  # 请修改为实际密码
-    'database': 'stock',
-    'charset': 'utf8mb4',
-    'cursorclass': pymysql.cursors.DictCursor
-}
+# 数据库连接从共享连接池中取(stock_common)，连接信息见 DATABASE_URL
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(root_path + '/api')
+import stock_common
 
 # 交易参数配置
 class StrategyConfig:
@@ -73,6 +70,7 @@ class MySQLData(bt.feeds.PandasData):
         ('fromdate', datetime.datetime(2023, 1, 1)),
         ('todate', datetime.datetime.now()),
         ('symbol', None),
+        ('use_cache', False),  # 从本地列式缓存读取（api/kline_cache.py 导出），不连MySQL
     )
 
     def __init__(self):
@@ -90,7 +88,7 @@ class MySQLData(bt.feeds.PandasData):
 
     def start(self):
         # 先获取数据
-        self.dataframe = self._fetch_data_from_mysql()
+        self.dataframe = self._fetch_data_from_cache() if self.p.use_cache else self._fetch_data_from_mysql()
         if self.dataframe.empty:
             logger.warning(f"未获取到股票 {self.p.symbol} 的数据")
         else:
@@ -111,11 +109,27 @@ class MySQLData(bt.feeds.PandasData):
             table_index = int(last_char)
         return f"bao_stock_trade_{table_index}"
 
+    def _fetch_data_from_cache(self):
+        try:
+            import kline_cache
+            table = kline_cache.read_kline(self._get_table_name(), self.p.fromdate, self.p.todate,
+                                           ['date', 'open', 'high', 'low', 'close', 'volume', 'amount'], codes=[self.p.symbol])
+            df = table.sort_by('date').to_pandas()
+            if df.empty:
+                return pd.DataFrame()
+            df['date'] = pd.to_datetime(df['date'])
+            df.set_index('date', inplace=True)
+            df.rename(columns={'amount': 'openinterest'}, inplace=True)
+            return df
+        except Exception as e:
+            logger.error(f"从缓存获取股票 {self.p.symbol} 数据时出错: {e}")
+            return pd.DataFrame()
+
     def _fetch_data_from_mysql(self):
         try:
-            conn = pymysql.connect(**MYSQL_CONFIG)
+            conn = stock_common.get_raw_conn()
             try:
-                with conn.cursor() as cursor:
+                with conn.cursor(pymysql.cursors.DictCursor) as cursor:
                     # 根据股票代码获取对应的分表名
                     table_name = self._get_table_name()
                     logger.info(f"为股票 {self.p.symbol} 使用表 {table_name}")
@@ -164,9 +178,9 @@ class StockFundamental:
         dateStr = date.strftime("%Y-%m-%d")
         """获取股票基本信息，包括市值、上市日期等"""
         try:
-            conn = pymysql.connect(**MYSQL_CONFIG)
+            conn = stock_common.get_raw_conn()
             try:
-                with conn.cursor() as cursor:
+                with conn.cursor(pymysql.cursors.DictCursor) as cursor:
                     sql = f""""""
                     for divide_table_num in range(0, 10, 1):
                         sql_sub = f"""SELECT a.code, a.code_name, a.ipo_date, 0 as is_st, 
@@ -191,9 +205,9 @@ class StockFundamental:
     def get_index_level(date):
         """获取大盘指数（上证指数）"""
         try:
-            conn = pymysql.connect(**MYSQL_CONFIG)
+            conn = stock_common.get_raw_conn()
             try:
-                with conn.cursor() as cursor:
+                with conn.cursor(pymysql.cursors.DictCursor) as cursor:
                     sql = """
                     SELECT close 
                     FROM bao_nostock_trade 
@@ -212,9 +226,9 @@ class StockFundamental:
     def get_index_percentile(date, years=3):
         """获取上证指数的3年百分位"""
         try:
-            conn = pymysql.connect(**MYSQL_CONFIG)
+            conn = stock_common.get_raw_conn()
             try:
-                with conn.cursor() as cursor:
+                with conn.cursor(pymysql.cursors.DictCursor) as cursor:
                     # 计算3年前的日期
                     start_date = date - pd.Timedelta(days=365*years)
                     
@@ -643,9 +657,9 @@ def run_backtest(start_date, end_date, initial_cash=1000000):
 # 获取回测股票列表
 def get_stock_list_for_backtest():
     try:
-        conn = pymysql.connect(**MYSQL_CONFIG)
+        conn = stock_common.get_raw_conn()
         try:
-            with conn.cursor() as cursor:
+            with conn.cursor(pymysql.cursors.DictCursor) as cursor:
                 # 获取活跃股票列表
                 # status = 1
                 sql = """SELECT code FROM bao_stock_basic """
@@ -661,9 +675,9 @@ def get_stock_list_for_backtest():
 # 添加沪深300指数数据
 def add_hs300_index(cerebro, start_date, end_date):
     try:
-        conn = pymysql.connect(**MYSQL_CONFIG)
+        conn = stock_common.get_raw_conn()
         try:
-            with conn.cursor() as cursor:
+            with conn.cursor(pymysql.cursors.DictCursor) as cursor:
                 sql = """
                 SELECT date, open, high, low, close, volume 
                 FROM bao_nostock_trade 
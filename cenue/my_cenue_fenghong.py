@@ -7,12 +7,14 @@ import os
 import sys
 from sqlalchemy import text
 # 获取当前脚本的绝对路径并向上回溯到根目录
-root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 sys.path.append(root_path + '/bao/season')
 import stock_common
 sys.path.append(root_path + '/bao')
+sys.path.append(root_path + '/cenue/util')
+import cenue_db
 
 # 配置logger
 import logging
@@ -285,20 +287,21 @@ class TradeStrategy():
 
 
     # 回测执行函数
-def run_backtest(conn, start_date_str, end_date_str, strategy_code):
+def run_backtest(conn, start_date_str, end_date_str, strategy_code, use_cache=False):
+    """use_cache: 每日K线从本地列式缓存读取（api/kline_cache.py 导出），不再每天查10张分表"""
     # 1股票列表
-    stock_info_list = get_all_stocks(conn)
+    stock_info_list = cenue_db.get_all_stocks(conn)
     # 转map
     stock_info_map = {r['code']: r for r in stock_info_list}
     logger.info(f"筛选出{len(stock_info_list)}只股票")
 
     # 2交易日列表
-    trade_date_list = get_all_trade_dates(conn, start_date_str, end_date_str)
+    trade_date_list = cenue_db.get_all_trade_dates(conn, start_date_str, end_date_str)
     trade_date_length = len(trade_date_list)
     logger.info(f"筛选出{trade_date_length}个交易日")
 
     # 3己执行的存档交易记录
-    trade_strategy_record_list = get_all_trade_strategy_records(conn, strategy_code)
+    trade_strategy_record_list = cenue_db.get_all_trade_strategy_records(conn, strategy_code)
     # 转map，key=hold_date
     trade_strategy_record_map = {r.hold_date: r for r in trade_strategy_record_list}
     logger.info(f"筛选出{len(trade_strategy_record_map)}条交易日期记录")
@@ -319,7 +322,10 @@ def run_backtest(conn, start_date_str, end_date_str, strategy_code):
             continue
         
         # 4.2获取当天全部的股票交易数据
-        k_line_list = get_k_line_by_date(conn, cur_trade_date_str)
+        if use_cache:
+            k_line_list = cenue_db.get_k_line_by_date_from_cache(cur_trade_date_str)
+        else:
+            k_line_list = cenue_db.get_k_line_by_date(conn, cur_trade_date_str)
 
         # 4.3执行策略
         tradeStrategy = TradeStrategy(cur_trade_date_str, stock_info_list, trade_strategy_record_list, k_line_list)
@@ -364,6 +370,7 @@ def run_backtest(conn, start_date_str, end_date_str, strategy_code):
 if __name__ == '__main__':
     conn = stock_common.get_db_conn(sql_echo=True)
     # 运行回测
-    run_backtest(conn, start_date_str='2010-01-01', end_date_str='2023-12-31', strategy_code='my_cenue_fenghong')
+    # --cache 每日K线从本地列式缓存读取（先运行 python api/kline_cache.py 导出）
+    run_backtest(conn, start_date_str='2010-01-01', end_date_str='2023-12-31', strategy_code='my_cenue_fenghong', use_cache='--cache' in sys.argv)
 
     conn.close()
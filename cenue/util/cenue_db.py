@@ -87,4 +87,14 @@ def get_k_line_by_date(conn, trade_date_str):
     trade_info_map = {}
     for r in results:
         trade_info_map[r['code']] = r
-    return trade_info_map
\ No newline at end of file
+    return trade_info_map
+#从本地列式缓存获取当天全部的股票交易数据（先运行 python api/kline_cache.py 导出），结构和get_k_line_by_date一致
+def get_k_line_by_date_from_cache(trade_date_str):
+    import kline_cache
+    trade_info_map = {}
+    for divide_table_num in range(0, 10, 1):
+        # 只读这一天所在年份的文件，内存映射，按日期过滤
+        table = kline_cache.read_kline(f'bao_stock_trade_{divide_table_num}', trade_date_str, trade_date_str)
+        for r in table.to_pylist():
+            trade_info_map[r['code']] = r
+    return trade_info_map
@@ -57,6 +57,41 @@ CREATE TABLE `fund_ana` (
   PRIMARY KEY (`id`),
   UNIQUE KEY `uk_industry` (`industry`)
 ) ENGINE=InnoDB AUTO_INCREMENT=249 DEFAULT CHARSET=utf8mb4 COMMENT='行业分析表';
+CREATE TABLE `fund_ana_cohort` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `industry` varchar(100) NOT NULL COMMENT '所属行业',
+  `fenghong_3_stock` text DEFAULT NULL COMMENT '3股息股票的代码，按市值倒序',
+  `growth_15_stock` text DEFAULT NULL COMMENT '15成长股票的代码，按市值倒序',
+  `growth_5_stock` varchar(200) DEFAULT NULL COMMENT '5成长大股股票的代码，市值TOP10',
+  `fenghong_1_growth_5_stock` varchar(200) DEFAULT NULL COMMENT '1股息5成长股票的代码，市值TOP10',
+  `fenghong_3_pe_year_1_percent` float DEFAULT NULL COMMENT '3股息股票1年PE分位值平均值',
+  `fenghong_3_pe_year_3_percent` float DEFAULT NULL COMMENT '3股息股票3年PE分位值平均值',
+  `fenghong_3_pe_year_5_percent` float DEFAULT NULL COMMENT '3股息股票5年PE分位值平均值',
+  `fenghong_3_ps_year_1_percent` float DEFAULT NULL COMMENT '3股息股票1年PS分位值平均值',
+  `fenghong_3_ps_year_3_percent` float DEFAULT NULL COMMENT '3股息股票3年PS分位值平均值',
+  `fenghong_3_ps_year_5_percent` float DEFAULT NULL COMMENT '3股息股票5年PS分位值平均值',
+  `growth_15_pe_year_1_percent` float DEFAULT NULL COMMENT '15成长股票1年PE分位值平均值',
+  `growth_15_pe_year_3_percent` float DEFAULT NULL COMMENT '15成长股票3年PE分位值平均值',
+  `growth_15_pe_year_5_percent` float DEFAULT NULL COMMENT '15成长股票5年PE分位值平均值',
+  `growth_15_ps_year_1_percent` float DEFAULT NULL COMMENT '15成长股票1年PS分位值平均值',
+  `growth_15_ps_year_3_percent` float DEFAULT NULL COMMENT '15成长股票3年PS分位值平均值',
+  `growth_15_ps_year_5_percent` float DEFAULT NULL COMMENT '15成长股票5年PS分位值平均值',
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_industry` (`industry`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='行业分析表-按自动标签分组的股票，auto_tags更新后生成';
+
+CREATE TABLE `stock_gen_watermark` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `stage` varchar(50) NOT NULL COMMENT '生成阶段，pe_percent：日K分位值、换手率、股息率',
+  `code` varchar(20) NOT NULL COMMENT '证券代码',
+  `last_date` date NOT NULL COMMENT '已经计算到的最后交易日',
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `unique_stage_code` (`stage`,`code`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='数据生成水位，每只股票每个阶段已经计算到的日期';
 
 
 CREATE TABLE `bao_nostock_basic` (
@@ -362,4 +397,42 @@ CREATE TABLE `stock_basic_ana` (
   `tradeSaleAllPE` float DEFAULT NULL COMMENT '交易-清仓pe',
   PRIMARY KEY (`id`),
   UNIQUE KEY `code` (`code`)
-) ENGINE=InnoDB AUTO_INCREMENT=10615 DEFAULT CHARSET=utf8mb4 COMMENT='证券分析表-股票';
\ No newline at end of file
+) ENGINE=InnoDB AUTO_INCREMENT=10615 DEFAULT CHARSET=utf8mb4 COMMENT='证券分析表-股票';
+CREATE TABLE `stock_latest_snapshot` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `code` varchar(20) NOT NULL COMMENT '证券代码',
+  `date` date DEFAULT NULL COMMENT '最新交易日期',
+  `open` float DEFAULT NULL COMMENT '开盘价',
+  `close` float DEFAULT NULL COMMENT '收盘价',
+  `peTTM` float DEFAULT NULL COMMENT '滚动市盈率',
+  `pbMRQ` float DEFAULT NULL COMMENT '市净率',
+  `psTTM` float DEFAULT NULL COMMENT '滚动市销率',
+  `pcfNcfTTM` float DEFAULT NULL COMMENT '滚动市现率',
+  `isST` int(11) DEFAULT NULL COMMENT 'ST标识，1：是，0：否',
+  `pe_year_1_percent` decimal(5,2) DEFAULT NULL COMMENT '1年PE分位值',
+  `pe_year_3_percent` decimal(5,2) DEFAULT NULL COMMENT '3年PE分位值',
+  `pe_year_5_percent` decimal(5,2) DEFAULT NULL COMMENT '5年PE分位值',
+  `pe_year_10_percent` decimal(5,2) DEFAULT NULL COMMENT '10年PE分位值',
+  `pb_year_1_percent` decimal(5,2) DEFAULT NULL COMMENT '1年pb分位值',
+  `pb_year_3_percent` decimal(5,2) DEFAULT NULL COMMENT '3年pb分位值',
+  `pb_year_5_percent` decimal(5,2) DEFAULT NULL COMMENT '5年pb分位值',
+  `pb_year_10_percent` decimal(5,2) DEFAULT NULL COMMENT '10年pb分位值',
+  `ps_year_1_percent` decimal(5,2) DEFAULT NULL COMMENT '1年ps分位值',
+  `ps_year_3_percent` decimal(5,2) DEFAULT NULL COMMENT '3年ps分位值',
+  `ps_year_5_percent` decimal(5,2) DEFAULT NULL COMMENT '5年ps分位值',
+  `ps_year_10_percent` decimal(5,2) DEFAULT NULL COMMENT '10年ps分位值',
+  `pcf_year_1_percent` decimal(5,2) DEFAULT NULL COMMENT '1年pcf分位值',
+  `pcf_year_3_percent` decimal(5,2) DEFAULT NULL COMMENT '3年pcf分位值',
+  `pcf_year_5_percent` decimal(5,2) DEFAULT NULL COMMENT '5年pcf分位值',
+  `pcf_year_10_percent` decimal(5,2) DEFAULT NULL COMMENT '10年pcf分位值',
+  `stock_fenghong_percent` float DEFAULT NULL COMMENT '股息率',
+  `turn_percent_5` float DEFAULT NULL COMMENT '换手率',
+  `turn_percent_15` float DEFAULT NULL COMMENT '换手率',
+  `turn_percent_30` float DEFAULT NULL COMMENT '换手率',
+  `total_market_value` float DEFAULT NULL COMMENT '总市值，单位：亿',
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `code` (`code`),
+  KEY `idx_date` (`date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='股票最新一条日K快照，由bao_stock_trade_x汇总';
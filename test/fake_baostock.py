@@ -0,0 +1,78 @@
+import os
+import json
+from datetime import date, timedelta
+
+""" 假的baostock模块，测试用，不连网络
+只实现日K获取用到的 login、query_history_k_data_plus、logout，返回固定生成的行
+交易日为今天之前30天内的工作日，每只股票每个交易日一行
+环境变量：
+    FAKE_BAOSTOCK_QUERY_LOG  查询记录文件，每次查询追加一行json(code, start_date, end_date)，多进程共用
+    FAKE_BAOSTOCK_FAIL_CODES 查询返回错误的股票代码，逗号分隔
+用法：init_kline_worker(rate_limiter, bs_module_name='fake_baostock') """
+
+# 假交易日的天数范围
+TRADE_DAYS_RANGE = 30
+
+class ResultData:
+    """与baostock的ResultData用法一致：error_code、error_msg、fields、next()、get_row_data()"""
+    def __init__(self, error_code='0', error_msg='success', fields=None, rows=None):
+        self.error_code = error_code
+        self.error_msg = error_msg
+        self.fields = fields or []
+        self.rows = rows or []
+        self.cur_index = -1
+
+    def next(self):
+        self.cur_index += 1
+        return self.cur_index < len(self.rows)
+
+    def get_row_data(self):
+        return self.rows[self.cur_index]
+
+def get_trade_dates(today=None):
+    """今天之前TRADE_DAYS_RANGE天内的工作日，不包含今天"""
+    today = today or date.today()
+    trade_dates = []
+    for days in range(TRADE_DAYS_RANGE, 0, -1):
+        cur_date = today - timedelta(days=days)
+        if cur_date.weekday() < 5:
+            trade_dates.append(cur_date.strftime('%Y-%m-%d'))
+    return trade_dates
+
+def build_kline_row(code, cur_date, index, adjustflag):
+    """固定的日K数据，值只和股票、交易日序号有关；pcfNcfTTM为空字符串，和接口缺值时一样"""
+    close = 10 + int(code[-1]) + index * 0.1
+    return {
+        'date': cur_date, 'code': code, 'open': f"{close - 0.05:.2f}", 'high': f"{close + 0.1:.2f}", 'low': f"{close - 0.1:.2f}",
+        'close': f"{close:.2f}", 'preclose': f"{close - 0.1:.2f}", 'volume': str(100000 + index), 'amount': f"{close * (100000 + index):.2f}",
+        'adjustflag': str(adjustflag), 'turn': '1.5', 'tradestatus': '1', 'pctChg': '1.0', 'peTTM': '15.0', 'pbMRQ': '1.2',
+        'psTTM': '2.0', 'pcfNcfTTM': '', 'isST': '0',
+    }
+
+def write_query_log(code, start_date, end_date):
+    query_log = os.getenv('FAKE_BAOSTOCK_QUERY_LOG')
+    if not query_log:
+        return
+    with open(query_log, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'code': code, 'start_date': start_date, 'end_date': end_date}) + "\n")
+
+def login(user_id='anonymous', password='123456'):
+    return ResultData(error_msg='login success!')
+
+def logout(user_id='anonymous'):
+    return ResultData(error_msg='logout success!')
+
+def query_history_k_data_plus(code, fields, start_date=None, end_date=None, frequency='d', adjustflag='3'):
+    write_query_log(code, start_date, end_date)
+    fail_codes = [item for item in os.getenv('FAKE_BAOSTOCK_FAIL_CODES', '').split(',') if item]
+    if code in fail_codes:
+        return ResultData('10002007', '网络接收错误。')
+
+    field_list = fields.split(',')
+    rows = []
+    for index, cur_date in enumerate(get_trade_dates()):
+        if (start_date and cur_date < start_date) or (end_date and cur_date > end_date):
+            continue
+        row = build_kline_row(code, cur_date, index, adjustflag)
+        rows.append([row[field] for field in field_list])
+    return ResultData(fields=field_list, rows=rows)
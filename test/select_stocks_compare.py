@@ -0,0 +1,120 @@
+import os
+import sys
+import io
+import contextlib
+import numpy as np
+from datetime import datetime, date
+
+# 添加项目根目录到搜索路径
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from cenue.auto.auto_cenue1 import BacktestEngine
+from cenue.auto.db_reader import DBReader
+from cenue.auto.market_panel import build_synthetic_panel
+
+""" 对比auto_cenue1选股排序的两种实现：原来按行逐只判断的循环，和现在按列生成布尔掩码的版本
+用build_synthetic_panel生成的固定面板，逐日比较排序后的TOP10列表和综合位次，不一致时assert报错
+运行: python test/select_stocks_compare.py [天数] """
+
+
+def legacy_sort_stocks(selected_stocks):
+    """原来的排序：按ps、pe分位值从小到大、股息率从大到小的位次和排序"""
+    if not selected_stocks:
+        return []
+    ps_sorted = sorted(selected_stocks, key=lambda x: x['ps_year_1_percent'])
+    ps_rank_dict = {stock['code']: i+1 for i, stock in enumerate(ps_sorted)}
+    pe_sorted = sorted(selected_stocks, key=lambda x: x['pe_year_1_percent'])
+    pe_rank_dict = {stock['code']: i+1 for i, stock in enumerate(pe_sorted)}
+    dividend_sorted = sorted(selected_stocks, key=lambda x: x['dividend_yield'], reverse=True)
+    dividend_rank_dict = {stock['code']: i+1 for i, stock in enumerate(dividend_sorted)}
+    for stock in selected_stocks:
+        stock['composite_rank'] = ps_rank_dict[stock['code']] + pe_rank_dict[stock['code']] + dividend_rank_dict[stock['code']]
+    return sorted(selected_stocks, key=lambda x: x['composite_rank'])
+
+def legacy_select_stocks(db_reader, config, date, stock_basic):
+    """原来的选股：每只股票取一行字典逐个条件判断，阈值取config"""
+    selected = []
+    for daily_data in db_reader.get_all_stocks_daily(date):
+        code = daily_data['code']
+        if code not in stock_basic:
+            continue
+        ipo_date = stock_basic[code]['ipo_date']
+        current_date = datetime.strptime(date, '%Y-%m-%d').date()
+        if (current_date - ipo_date).days < 2*365:
+            continue
+        if not daily_data['total_market_value'] or daily_data['total_market_value'] <= config.min_market_value:
+            continue
+        if not daily_data['peTTM'] or daily_data['peTTM'] > config.max_pe:
+            continue
+        dividend_yield = daily_data['stock_fenghong_percent'] if daily_data['stock_fenghong_percent'] else 0
+        if dividend_yield < config.min_dividend:
+            continue
+        if not daily_data['pe_year_1_percent'] or daily_data['pe_year_1_percent'] > config.max_pe_percent:
+            continue
+        if not daily_data['ps_year_1_percent'] or daily_data['ps_year_1_percent'] > config.max_ps_percent:
+            continue
+        if not daily_data['psTTM']:
+            continue
+        if not db_reader.has_dividend(code, date):
+            continue
+        if daily_data['isST'] == 1:
+            continue
+        if daily_data['close'] < 1:
+            continue
+        selected.append({
+            'code': code,
+            'code_name': stock_basic[code]['code_name'],
+            'peTTM': daily_data['peTTM'],
+            'psTTM': daily_data['psTTM'],
+            'total_market_value': daily_data['total_market_value'],
+            'pe_year_1_percent': daily_data['pe_year_1_percent'],
+            'ps_year_1_percent': daily_data['ps_year_1_percent'],
+            'close': daily_data['close'],
+            'dividend_yield': dividend_yield
+        })
+    return legacy_sort_stocks(selected)[:10]
+
+def build_test_engine(seed=0):
+    """固定面板、股票基本信息和分红数据的回测引擎，不连数据库"""
+    rng = np.random.default_rng(seed)
+    panel = build_synthetic_panel(years=2, stock_num=3000, seed=seed)
+    # 分位值和股息率取整，制造相同值，检查并列时的先后顺序
+    for field in ['pe_year_1_percent', 'ps_year_1_percent', 'stock_fenghong_percent']:
+        panel.data[field] = np.round(panel.data[field])
+
+    # 约5%的股票没有基本信息，上市日期分布在回测开始前4年到回测期间
+    stock_basic = {}
+    for code in panel.codes:
+        if rng.uniform() < 0.05:
+            continue
+        stock_basic[code] = {'code_name': code, 'ipo_date': date.fromordinal(date(2011, 1, 1).toordinal() + int(rng.integers(0, 6*365)))}
+    # 分红年份随机
+    dividend_data = {code: set(int(year) for year in range(2011, 2017) if rng.uniform() < 0.85) for code in panel.codes}
+
+    db_reader = DBReader()
+    db_reader.panel = panel
+    db_reader.dividend_data_cache = dividend_data
+    engine = BacktestEngine(db_reader=db_reader, write_log=False)
+    engine.prepare_select_data(stock_basic)
+    return engine, stock_basic
+
+def compare(days):
+    engine, stock_basic = build_test_engine()
+    panel = engine.db_reader.panel
+    selected_days = 0
+    for date_str in panel.dates[:days]:
+        # 选股时打印的排序清单不输出
+        with contextlib.redirect_stdout(io.StringIO()):
+            top10 = engine.select_stocks(date_str, stock_basic)
+        legacy_top10 = legacy_select_stocks(engine.db_reader, engine.config, date_str, stock_basic)
+        codes = [(stock['code'], stock['composite_rank']) for stock in top10]
+        legacy_codes = [(stock['code'], stock['composite_rank']) for stock in legacy_top10]
+        assert codes == legacy_codes, f"{date_str} TOP10不一致: {codes} != {legacy_codes}"
+        if codes:
+            selected_days += 1
+    print(f"{days}个交易日TOP10一致，其中{selected_days}天有选出股票")
+
+
+if __name__ == '__main__':
+    compare(int(sys.argv[1]) if len(sys.argv) > 1 else 120)
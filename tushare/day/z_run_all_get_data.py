@@ -9,6 +9,7 @@ sys.path.append(root_path)  # 添加根目录到搜索路径
 sys.path.append(root_path + '/api')
 sys.path.append(root_path + '/tushare/day')
 import stock_common
+import job_journal
 import tu_common
 
 # 配置logger
@@ -19,34 +20,41 @@ logger = logging.getLogger(__name__)
 if __name__ == '__main__':
     conn = stock_common.get_db_conn(sql_echo=False)
     pro = tu_common.get_tushare_pro()
+    # 每个阶段记入任务日志，失败的阶段重试，不影响后面的阶段；--resume 接着上次没跑完的批次，已完成的阶段跳过
+    journal = job_journal.JobJournal('tushare_day')
 
     # 1
     logger.info("ETF基金信息，日K")
     import tu_fund
-    tu_fund.etf_basic_all(conn=conn, pro=pro)
-    tu_fund.etf_k_increase(conn=conn, pro=pro)
+    journal.run('etf_basic', tu_fund.etf_basic_all, conn=conn, pro=pro, rollback_conn=conn)
+    journal.run('etf_k', tu_fund.etf_k_increase, conn=conn, pro=pro, rollback_conn=conn)
     logger.info("ETF基金信息，日K完成")
 
     #2
     logger.info("股票的季报开始 营收")
     import tu_stock_season_income
-    tu_stock_season_income.stock_season_income_increase(conn, pro)
+    journal.run('season_income', tu_stock_season_income.stock_season_income_increase, conn, pro, rollback_conn=conn)
 
     logger.info("股票的季报开始 财务指标")
     import tu_stock_season_fina_indicator
-    tu_stock_season_fina_indicator.stock_season_fina_indicator_increase(conn, pro)
+    journal.run('season_fina_indicator', tu_stock_season_fina_indicator.stock_season_fina_indicator_increase, conn, pro, rollback_conn=conn)
 
     logger.info("股票的季报开始 主营业务构成")
     import tu_stock_season_mainbz
-    tu_stock_season_mainbz.stock_season_mainbz_increase(conn, pro)
+    journal.run('season_mainbz', tu_stock_season_mainbz.stock_season_mainbz_increase, conn, pro, rollback_conn=conn)
 
     logger.info("股票的季报完成")
 
     #3 
     logger.info("index_k 日K线")
     import tu_index_k
-    tu_index_k.index_k_increase(conn, pro)
+    journal.run('index_k', tu_index_k.index_k_increase, conn, pro, rollback_conn=conn)
     logger.info("index_k 日K线完成")
 
     conn.close()
+    journal.log_summary()
+    exit_code = journal.exit_code()
+    journal.close()
+    # 有失败的阶段时非0退出
+    sys.exit(exit_code)
     
\ No newline at end of file